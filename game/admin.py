@@ -1,6 +1,12 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, Game, GameSession, Move
+from django.db import transaction
+from .models import (
+    User, Game, GameAnalysis, GameSession, Move, RatingHistory, Tournament, TournamentPlayer, Pairing,
+)
+from .analysis import dispatch
+from .movecodec import ucis
+from .tournaments import TournamentError, start_next_round, start_tournament
 
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
@@ -32,7 +38,8 @@ class GameAdmin(admin.ModelAdmin):
     list_display = ['code', 'status', 'get_white_name', 'get_black_name', 'time_control', 'winner', 'created_at']
     list_filter = ['status', 'time_control', 'is_rated', 'created_at']
     search_fields = ['code', 'white_player__username', 'black_player__username']
-    readonly_fields = ['code', 'created_at', 'updated_at', 'started_at', 'completed_at']
+    readonly_fields = ['code', 'created_at', 'updated_at', 'started_at', 'completed_at',
+                       'get_moves', 'get_uci_moves', 'get_captured']
     date_hierarchy = 'created_at'
     
     fieldsets = (
@@ -40,19 +47,20 @@ class GameAdmin(admin.ModelAdmin):
             'fields': ('code', 'status', 'fen', 'move_count')
         }),
         ('Players', {
-            'fields': ('white_player', 'white_guest_name', 'black_player', 'black_guest_name')
+            'fields': ('white_player', 'white_guest_name', 'black_player', 'black_guest_name',
+                       'engine_color', 'engine_level')
         }),
         ('Settings', {
             'fields': ('time_control', 'is_rated', 'is_private')
         }),
         ('Timer', {
-            'fields': ('white_time_remaining', 'black_time_remaining', 'last_move_time')
+            'fields': ('white_time_ms', 'black_time_ms', 'last_move_time')
         }),
         ('Result', {
             'fields': ('winner', 'result_reason')
         }),
         ('Game Data', {
-            'fields': ('move_history', 'captured_pieces'),
+            'fields': ('get_moves', 'get_uci_moves', 'get_captured'),
             'classes': ('collapse',)
         }),
         ('Timestamps', {
@@ -68,6 +76,19 @@ class GameAdmin(admin.ModelAdmin):
     def get_black_name(self, obj):
         return obj.get_black_display_name()
     get_black_name.short_description = 'Black Player'
+    
+    def get_moves(self, obj):
+        return ' '.join(obj.get_sans())
+    get_moves.short_description = 'Moves (SAN)'
+    
+    def get_uci_moves(self, obj):
+        return ' '.join(ucis(obj.move_data))
+    get_uci_moves.short_description = 'Moves (UCI)'
+    
+    def get_captured(self, obj):
+        captured = obj.get_captured_pieces()
+        return f"White lost: {' '.join(captured['white']) or '-'}; black lost: {' '.join(captured['black']) or '-'}"
+    get_captured.short_description = 'Captured pieces'
 
 
 @admin.register(GameSession)
@@ -80,8 +101,7 @@ class GameSessionAdmin(admin.ModelAdmin):
     
     def is_active(self, obj):
         from django.utils import timezone
-        from datetime import timedelta
-        return obj.last_seen > timezone.now() - timedelta(minutes=5)
+        return obj.last_seen > timezone.now() - GameSession.ACTIVE_WINDOW
     is_active.boolean = True
     is_active.short_description = 'Active'
 
@@ -89,7 +109,7 @@ class GameSessionAdmin(admin.ModelAdmin):
 @admin.register(Move)
 class MoveAdmin(admin.ModelAdmin):
     """Individual move tracking"""
-    list_display = ['game', 'move_number', 'player_color', 'move_san', 'captured_piece', 'time_spent', 'timestamp']
+    list_display = ['game', 'move_number', 'player_color', 'move_san', 'captured_piece', 'time_spent_ms', 'clock_ms', 'timestamp']
     list_filter = ['player_color', 'timestamp']
     search_fields = ['game__code', 'move_san']
     readonly_fields = ['timestamp']
@@ -97,3 +117,84 @@ class MoveAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('game')
+
+
+@admin.register(RatingHistory)
+class RatingHistoryAdmin(admin.ModelAdmin):
+    """Rating after each rated game"""
+    list_display = ['user', 'rating', 'deviation', 'game', 'recorded_at']
+    search_fields = ['user__username']
+    raw_id_fields = ['user', 'game']
+    date_hierarchy = 'recorded_at'
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user', 'game')
+
+
+class TournamentPlayerInline(admin.TabularInline):
+    model = TournamentPlayer
+    fields = ['user', 'seed', 'score', 'buchholz', 'sonneborn_berger', 'withdrawn']
+    readonly_fields = ['seed', 'score', 'buchholz', 'sonneborn_berger']
+    raw_id_fields = ['user']
+    extra = 0
+
+
+@admin.register(Tournament)
+class TournamentAdmin(admin.ModelAdmin):
+    """Tournaments; start them (and pair a stuck round) with the actions"""
+    list_display = ['name', 'format', 'time_control', 'status', 'current_round', 'rounds', 'created_at']
+    list_filter = ['format', 'status']
+    search_fields = ['name']
+    readonly_fields = ['current_round', 'created_at', 'started_at', 'completed_at']
+    inlines = [TournamentPlayerInline]
+    actions = ['start_tournaments', 'pair_next_round']
+    
+    @admin.action(description='Start selected tournaments')
+    def start_tournaments(self, request, queryset):
+        for tournament in queryset:
+            try:
+                start_tournament(tournament)
+                self.message_user(request, f"{tournament.name}: round 1 paired")
+            except TournamentError as e:
+                self.message_user(request, f"{tournament.name}: {e}", level=messages.ERROR)
+    
+    @admin.action(description='Pair the next round now (unfinished games stay as they are)')
+    def pair_next_round(self, request, queryset):
+        for tournament in queryset:
+            with transaction.atomic():
+                tournament = Tournament.objects.select_for_update().get(pk=tournament.pk)
+                if tournament.status != 'running' or tournament.current_round >= tournament.rounds:
+                    self.message_user(request, f"{tournament.name}: no round left to pair", level=messages.ERROR)
+                    continue
+                start_next_round(tournament)
+            self.message_user(request, f"{tournament.name}: round {tournament.current_round} paired")
+
+
+@admin.register(Pairing)
+class PairingAdmin(admin.ModelAdmin):
+    list_display = ['round', 'board', 'white', 'black', 'result', 'game']
+    list_filter = ['result']
+    search_fields = ['round__tournament__name', 'white__user__username', 'black__user__username']
+    raw_id_fields = ['white', 'black', 'game']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'round__tournament', 'white__user', 'black__user', 'game'
+        )
+
+
+@admin.register(GameAnalysis)
+class GameAnalysisAdmin(admin.ModelAdmin):
+    """Post-game analysis jobs"""
+    list_display = ['game', 'status', 'attempts', 'created_at', 'completed_at']
+    list_filter = ['status']
+    search_fields = ['game__code']
+    raw_id_fields = ['game']
+    readonly_fields = ['evaluations', 'best_moves', 'judgements', 'created_at', 'started_at', 'completed_at']
+    actions = ['reanalyse']
+    
+    @admin.action(description='Analyse again')
+    def reanalyse(self, request, queryset):
+        count = queryset.exclude(status='running').update(status='queued', attempts=0, error='')
+        transaction.on_commit(dispatch)
+        self.message_user(request, f"{count} game(s) queued for analysis")
@@ -0,0 +1,330 @@
+"""
+Post-game analysis
+
+When a game finishes, queue_analysis() adds a GameAnalysis row for it in
+the same transaction: the table is the job queue. In the server, up to
+MTU_CHESS_CONFIG['ANALYSIS_WORKERS'] jobs run at a time, each in a
+process pool of that size, separate from the computer opponent's so
+analysis never delays a live engine move. A job is claimed with a
+conditional UPDATE, so several server processes (or analyse_games) can
+share the queue without running a job twice.
+
+A job scores every position of the game with the built-in searcher
+(search.evaluate_positions, at most ANALYSIS_DEPTH plies and
+ANALYSIS_NODES nodes per position). Scores are cached in PositionEval by
+Zobrist key: a position any earlier game reached - every common opening
+line - is never searched again, only the new ones go to the pool.
+
+The drop in the mover's evaluation across a move marks it as an
+inaccuracy, mistake or blunder (scores are clamped to +/-EVAL_CLAMP
+first, so a won position that stays won isn't a mistake). Results are
+kept compactly on the job row; analysed_moves() expands them for the
+watch page and the analysis API.
+
+    python manage.py analyse_games --backfill     queue older games and run the queue
+"""
+import json
+import logging
+import multiprocessing
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .board import Board
+from .explorer import position_key
+from .movecodec import ucis
+from .search import MATE, MATE_BOUND, evaluate_positions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEPTH = 6
+DEFAULT_NODES = 20_000
+MAX_ATTEMPTS = 3
+
+# Centipawns the mover's evaluation drops by, at least
+INACCURACY = 50
+MISTAKE = 100
+BLUNDER = 300
+EVAL_CLAMP = 1000
+
+# Judgement characters stored per move
+GOOD, INACCURATE, MISTAKEN, BLUNDERED = '-', 'i', 'm', 'b'
+JUDGEMENTS = {INACCURATE: 'inaccuracy', MISTAKEN: 'mistake', BLUNDERED: 'blunder'}
+ANNOTATIONS = {INACCURATE: '?!', MISTAKEN: '?', BLUNDERED: '??'}
+
+# A claimed job's positions: the key of every position in game order, the
+# cached (score, best move) found for them, and the keys and FENs of the
+# positions still to be searched
+Plan = namedtuple('Plan', ['keys', 'cached', 'missing_keys', 'missing_fens'])
+
+_pool = None
+_pool_lock = threading.Lock()
+_running = 0
+
+
+def _config(key, default):
+    return getattr(settings, 'MTU_CHESS_CONFIG', {}).get(key, default)
+
+
+def search_budget():
+    """(depth, nodes) each position is searched with"""
+    return _config('ANALYSIS_DEPTH', DEFAULT_DEPTH), _config('ANALYSIS_NODES', DEFAULT_NODES)
+
+
+# ============================================
+# QUEUE
+# ============================================
+
+def queue_analysis(game):
+    """Queue a game that just finished (called by Game.mark_completed)"""
+    from .models import GameAnalysis
+
+    if not game.move_count:
+        return
+    GameAnalysis.objects.get_or_create(game=game)
+    transaction.on_commit(dispatch, robust=True)
+
+
+def claim_job():
+    """Mark the oldest queued job running and return it (None if the queue is empty)"""
+    from .models import GameAnalysis
+
+    queued = GameAnalysis.objects.filter(status='queued').order_by('created_at')
+    for pk in queued.values_list('pk', flat=True)[:10]:
+        # Someone else may have taken it since the read
+        claimed = GameAnalysis.objects.filter(pk=pk, status='queued').update(
+            status='running', started_at=timezone.now(), attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return GameAnalysis.objects.select_related('game').get(pk=pk)
+    return None
+
+
+def requeue_running():
+    """Put jobs left running by a restart back in the queue"""
+    from .models import GameAnalysis
+
+    return GameAnalysis.objects.filter(status='running').update(status='queued')
+
+
+# ============================================
+# JOBS
+# ============================================
+
+def plan(job):
+    """Replay a job's game and look its positions up in the evaluation cache"""
+    from .models import PositionEval
+
+    board = Board()
+    keys = [position_key(board.hash)]
+    fens = {keys[0]: board.fen()}
+    for uci in ucis(job.game.move_data):
+        board.push(board.parse_uci(uci))
+        key = position_key(board.hash)
+        keys.append(key)
+        fens.setdefault(key, board.fen())
+
+    cached = {
+        key: (score, best_move)
+        for key, score, best_move in PositionEval.objects.filter(position_key__in=set(keys))
+        .values_list('position_key', 'score', 'best_move')
+    }
+    missing = [key for key in fens if key not in cached]
+    return Plan(keys, cached, missing, [fens[key] for key in missing])
+
+
+def move_losses(scores):
+    """
+    How far each move dropped the mover's evaluation (negative if it
+    gained), from the scores of the positions before and after it
+    """
+    clamped = [max(-EVAL_CLAMP, min(EVAL_CLAMP, score)) for score in scores]
+    # White moves on even plies
+    return [
+        clamped[ply] - clamped[ply + 1] if ply % 2 == 0 else clamped[ply + 1] - clamped[ply]
+        for ply in range(len(clamped) - 1)
+    ]
+
+
+def judge(scores):
+    """Judgement character for each move"""
+    marks = []
+    for loss in move_losses(scores):
+        if loss >= BLUNDER:
+            marks.append(BLUNDERED)
+        elif loss >= MISTAKE:
+            marks.append(MISTAKEN)
+        elif loss >= INACCURACY:
+            marks.append(INACCURATE)
+        else:
+            marks.append(GOOD)
+    return ''.join(marks)
+
+
+def finish(job, job_plan, evaluated):
+    """
+    Store a job's result. `evaluated` has a (score, best move, depth) for
+    each of the plan's missing positions; they are added to the cache.
+    """
+    from .models import GameAnalysis, PositionEval
+
+    cached = dict(job_plan.cached)
+    new_evals = []
+    for key, (score, best_move, depth) in zip(job_plan.missing_keys, evaluated):
+        cached[key] = (score, best_move or '')
+        new_evals.append(PositionEval(position_key=key, score=score, best_move=best_move or '', depth=depth))
+    scores = [cached[key][0] for key in job_plan.keys]
+
+    with transaction.atomic():
+        # Another job may have cached the same position meanwhile
+        PositionEval.objects.bulk_create(new_evals, ignore_conflicts=True)
+        GameAnalysis.objects.filter(pk=job.pk).update(
+            status='done',
+            error='',
+            evaluations=json.dumps(scores, separators=(',', ':')),
+            best_moves=' '.join(cached[key][1] or '-' for key in job_plan.keys),
+            judgements=judge(scores),
+            completed_at=timezone.now(),
+        )
+
+
+def fail(job, error):
+    """Requeue a job that failed, or give up on it after MAX_ATTEMPTS"""
+    from .models import GameAnalysis
+
+    status = 'queued' if job.attempts < MAX_ATTEMPTS else 'failed'
+    GameAnalysis.objects.filter(pk=job.pk).update(status=status, error=str(error)[:200])
+
+
+# ============================================
+# SERVER WORKERS
+# ============================================
+
+def _get_pool(workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _reserve_slot(workers):
+    global _running
+    with _pool_lock:
+        if _running >= workers:
+            return False
+        _running += 1
+        return True
+
+
+def _release_slot():
+    global _running
+    with _pool_lock:
+        _running -= 1
+
+
+def dispatch():
+    """Start queued jobs while fewer than ANALYSIS_WORKERS are running in this process"""
+    workers = _config('ANALYSIS_WORKERS', 1)
+    while workers and _reserve_slot(workers):
+        job = None
+        try:
+            job = claim_job()
+            if job is None:
+                _release_slot()
+                return
+            job_plan = plan(job)
+            if not job_plan.missing_fens:
+                finish(job, job_plan, [])
+                _release_slot()
+                continue
+            future = _get_pool(workers).submit(evaluate_positions, job_plan.missing_fens, *search_budget())
+        except Exception as e:
+            _release_slot()
+            logger.exception("Analysis of job %s failed to start", job.pk if job else None)
+            if job is not None:
+                fail(job, e)
+            return
+        future.add_done_callback(partial(_job_done, job, job_plan))
+
+
+def _job_done(job, job_plan, future):
+    """Store a finished job's result (in the pool's result thread), then start the next"""
+    close_old_connections()
+    try:
+        finish(job, job_plan, future.result())
+    except Exception as e:
+        logger.exception("Analysis of game %s failed", job.game.code)
+        fail(job, e)
+    finally:
+        _release_slot()
+    try:
+        dispatch()
+    finally:
+        close_old_connections()
+
+
+def resume_analysis():
+    """Requeue jobs a restart interrupted and start the queue (scheduler start-up)"""
+    requeue_running()
+    dispatch()
+
+
+# ============================================
+# RESULTS
+# ============================================
+
+def format_score(score):
+    """Score for display: +0.35, -1.20, #3 (white mates in 3), #-2, 1-0 (mated)"""
+    if abs(score) > MATE_BOUND:
+        moves = (MATE - abs(score) + 1) // 2
+        if not moves:
+            return '1-0' if score > 0 else '0-1'
+        return f"#{moves}" if score > 0 else f"#-{moves}"
+    return f"{score / 100:+.2f}"
+
+
+def analysed_moves(analysis, sans):
+    """
+    Per-move analysis of a game: for each SAN, the score after it, the
+    best move in the position before it and its judgement (None if fine)
+    """
+    scores = json.loads(analysis.evaluations or '[]')
+    best_moves = analysis.best_moves.split()
+    moves = []
+    for ply, san in enumerate(sans):
+        if ply + 1 >= len(scores):
+            break
+        mark = analysis.judgements[ply:ply + 1]
+        moves.append({
+            'ply': ply + 1,
+            'san': san,
+            'score': scores[ply + 1],
+            'display': format_score(scores[ply + 1]),
+            'best': best_moves[ply] if ply < len(best_moves) and best_moves[ply] != '-' else None,
+            'judgement': JUDGEMENTS.get(mark),
+            'annotation': ANNOTATIONS.get(mark, ''),
+        })
+    return moves
+
+
+def summary(analysis):
+    """Inaccuracies, mistakes, blunders and average centipawn loss of each side"""
+    losses = move_losses(json.loads(analysis.evaluations or '[]'))
+    sides = {}
+    for first_ply, color in enumerate(('white', 'black')):
+        marks = analysis.judgements[first_ply::2]
+        side_losses = [max(0, loss) for loss in losses[first_ply::2]]
+        sides[color] = {
+            'inaccuracies': marks.count(INACCURATE),
+            'mistakes': marks.count(MISTAKEN),
+            'blunders': marks.count(BLUNDERED),
+            'average_loss': round(sum(side_losses) / len(side_losses)) if side_losses else 0,
+        }
+    return sides
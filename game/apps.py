@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class GameConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'game'
+
+    def ready(self):
+        # Connect the statistics cache and ranking index signal handlers
+        from . import ranking, stats  # noqa: F401
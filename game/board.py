@@ -0,0 +1,823 @@
+"""
+Server-side chess rules
+
+A 0x88 board with legal move generation, incremental make/unmake and
+Zobrist hashing. It lets the server validate moves itself instead of
+trusting the FEN sent by the browser, and detect checkmate, stalemate,
+insufficient material, repetition and the fifty-move rule.
+
+Squares are 0x88 indexes (rank * 16 + file, a1 = 0, h8 = 119). Pieces are
+small ints (piece type | colour) and moves are packed ints:
+
+    from | to << 7 | promotion << 14 | flag << 17
+
+    >>> board = Board()
+    >>> move = board.parse_uci('e2e4')
+    >>> board.san(move)
+    'e4'
+    >>> board.push(move)
+
+Legality is decided from the checkers and pins of a position, worked out
+once per position, rather than by making every move; only king moves and
+en passant are made to see if they leave the king attacked.
+
+The api_game_move hot path (load the stored FEN, validate a UCI move,
+make it, check for game end) costs about 55-70µs for a quiet move and up
+to about 100µs for a mate, where every reply has to be ruled out, on one
+CPython core (``manage.py perft`` times it). The target is therefore
+under 100µs for ordinary moves and under 150µs for any move, not "well
+under 100µs" throughout; loading the FEN alone is about 20µs.
+"""
+import random
+import re
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# Piece types and colours
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+WHITE, BLACK = 8, 16
+EMPTY = 0
+
+PIECE_SYMBOLS = {
+    WHITE | PAWN: 'P', WHITE | KNIGHT: 'N', WHITE | BISHOP: 'B',
+    WHITE | ROOK: 'R', WHITE | QUEEN: 'Q', WHITE | KING: 'K',
+    BLACK | PAWN: 'p', BLACK | KNIGHT: 'n', BLACK | BISHOP: 'b',
+    BLACK | ROOK: 'r', BLACK | QUEEN: 'q', BLACK | KING: 'k',
+}
+FEN_SYMBOLS = [PIECE_SYMBOLS.get(piece, '1') for piece in range(24)]
+SYMBOL_PIECES = {symbol: piece for piece, symbol in PIECE_SYMBOLS.items()}
+PROMOTION_PIECES = {'q': QUEEN, 'r': ROOK, 'b': BISHOP, 'n': KNIGHT}
+TYPE_LETTERS = {PAWN: 'p', KNIGHT: 'n', BISHOP: 'b', ROOK: 'r', QUEEN: 'q', KING: 'k'}
+LETTER_TYPES = {letter.upper(): kind for kind, letter in TYPE_LETTERS.items()}
+
+# piece, from file, from rank, target, promotion
+SAN_PATTERN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQnbrq]))?$')
+
+# Move flags
+NORMAL, DOUBLE_PUSH, EN_PASSANT, CASTLE = 0, 1, 2, 4
+
+# Castling rights
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+
+KNIGHT_OFFSETS = (33, 31, 18, 14, -14, -18, -31, -33)
+BISHOP_OFFSETS = (15, 17, -15, -17)
+ROOK_OFFSETS = (16, -16, 1, -1)
+KING_OFFSETS = BISHOP_OFFSETS + ROOK_OFFSETS
+
+SQUARES = tuple(rank * 16 + file for rank in range(8) for file in range(8))
+
+# Unit step from one square along the line to another, indexed by the 0x88
+# difference (to - from + 0x77); 0 if they share no rank, file or diagonal
+LINE_STEP = [0] * 240
+for _offset in KING_OFFSETS:
+    for _distance in range(1, 8):
+        LINE_STEP[0x77 + _offset * _distance] = _offset
+del _offset, _distance
+SQUARE_NAMES = {sq: 'abcdefgh'[sq & 7] + str((sq >> 4) + 1) for sq in SQUARES}
+NAME_SQUARES = {name: sq for sq, name in SQUARE_NAMES.items()}
+EMPTY_RUNS = tuple(('1' * count, str(count)) for count in range(8, 1, -1))
+EXPAND_EMPTY = str.maketrans({str(count): '1' * count for count in range(2, 9)})
+
+# FEN fields: a rank (piece letters and runs of 1-8 empty squares, never
+# two runs in a row), castling rights, en passant squares by side to move
+FEN_RANK = re.compile(r'(?:[pnbrqkPNBRQK]|[1-8](?![1-8]))+')
+FEN_CASTLING = re.compile(r'-|K?Q?k?q?')
+EP_SQUARES_WHITE_TO_MOVE = frozenset(file + '6' for file in 'abcdefgh')
+EP_SQUARES_BLACK_TO_MOVE = frozenset(file + '3' for file in 'abcdefgh')
+
+# Castling rights bitmask -> FEN field
+CASTLING_FEN = tuple(
+    ''.join(char for char, right in (('K', WHITE_KINGSIDE), ('Q', WHITE_QUEENSIDE),
+                                     ('k', BLACK_KINGSIDE), ('q', BLACK_QUEENSIDE)) if rights & right) or '-'
+    for rights in range(16)
+)
+
+# Rights lost when a piece moves from/to a square
+CASTLE_MASK = [15] * 128
+CASTLE_MASK[0x04] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLE_MASK[0x00] = 15 & ~WHITE_QUEENSIDE
+CASTLE_MASK[0x07] = 15 & ~WHITE_KINGSIDE
+CASTLE_MASK[0x74] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLE_MASK[0x70] = 15 & ~BLACK_QUEENSIDE
+CASTLE_MASK[0x77] = 15 & ~BLACK_KINGSIDE
+
+# Zobrist keys (fixed seed so hashes are stable across processes and restarts)
+_rng = random.Random(0x4D5455)
+ZOBRIST_PIECES = [[_rng.getrandbits(64) for _ in range(128)] for _ in range(24)]
+ZOBRIST_CASTLING = [_rng.getrandbits(64) for _ in range(16)]
+ZOBRIST_EP_FILE = [_rng.getrandbits(64) for _ in range(8)]
+ZOBRIST_BLACK_TO_MOVE = _rng.getrandbits(64)
+del _rng
+
+
+def encode_move(frm, to, promotion=0, flag=NORMAL):
+    return frm | (to << 7) | (promotion << 14) | (flag << 17)
+
+
+def move_from(move):
+    return move & 127
+
+
+def move_to(move):
+    return (move >> 7) & 127
+
+
+def move_promotion(move):
+    return (move >> 14) & 7
+
+
+def move_flag(move):
+    return move >> 17
+
+
+def move_to_uci(move):
+    uci = SQUARE_NAMES[move & 127] + SQUARE_NAMES[(move >> 7) & 127]
+    promotion = (move >> 14) & 7
+    if promotion:
+        uci += TYPE_LETTERS[promotion]
+    return uci
+
+
+class IllegalMoveError(ValueError):
+    """Raised when a move is not legal in the current position"""
+
+
+class Board:
+    """Chess position with make/unmake and an incremental Zobrist hash"""
+
+    def __init__(self, fen=START_FEN):
+        self.set_fen(fen)
+
+    # ------------------------------------------------------------------
+    # FEN
+    # ------------------------------------------------------------------
+
+    def set_fen(self, fen):
+        """Load a position; raises ValueError if the FEN is malformed"""
+        parts = fen.split()
+        if not 4 <= len(parts) <= 6:
+            raise ValueError(f"Invalid FEN: {fen!r}")
+        placement, turn, castling, ep = parts[:4]
+        halfmove = parts[4] if len(parts) > 4 else '0'
+        fullmove = parts[5] if len(parts) > 5 else '1'
+
+        self.squares = [EMPTY] * 128
+        self.king_squares = {WHITE: -1, BLACK: -1}
+        rows = placement.split('/')
+        if len(rows) != 8:
+            raise ValueError(f"Invalid FEN (needs 8 ranks): {fen!r}")
+        for row_index, row in enumerate(rows):
+            if not FEN_RANK.fullmatch(row):
+                raise ValueError(f"Invalid FEN (rank {8 - row_index}): {fen!r}")
+            rank = 7 - row_index
+            # Empty squares as '1's, as fen() writes them before collapsing
+            row = row.translate(EXPAND_EMPTY)
+            if len(row) != 8:
+                raise ValueError(f"Invalid FEN (rank {rank + 1} is not 8 squares): {fen!r}")
+            for file, char in enumerate(row):
+                if char == '1':
+                    continue
+                piece = SYMBOL_PIECES[char]
+                if piece & 7 == PAWN and rank in (0, 7):
+                    raise ValueError(f"Invalid FEN (pawn on rank {rank + 1}): {fen!r}")
+                sq = rank * 16 + file
+                self.squares[sq] = piece
+                if piece & 7 == KING:
+                    if self.king_squares[piece & 24] >= 0:
+                        raise ValueError(f"Invalid FEN (two kings): {fen!r}")
+                    self.king_squares[piece & 24] = sq
+        if self.king_squares[WHITE] < 0 or self.king_squares[BLACK] < 0:
+            raise ValueError(f"Invalid FEN (missing king): {fen!r}")
+
+        if turn not in ('w', 'b'):
+            raise ValueError(f"Invalid FEN (side to move): {fen!r}")
+        self.turn = WHITE if turn == 'w' else BLACK
+        if not FEN_CASTLING.fullmatch(castling):
+            raise ValueError(f"Invalid FEN (castling): {fen!r}")
+        self.castling = 0
+        for char, right in (('K', WHITE_KINGSIDE), ('Q', WHITE_QUEENSIDE),
+                            ('k', BLACK_KINGSIDE), ('q', BLACK_QUEENSIDE)):
+            if char in castling:
+                self.castling |= right
+        if ep != '-' and ep not in (EP_SQUARES_WHITE_TO_MOVE if turn == 'w' else EP_SQUARES_BLACK_TO_MOVE):
+            raise ValueError(f"Invalid FEN (en passant square): {fen!r}")
+        self.ep_square = NAME_SQUARES.get(ep, -1)
+        if not (halfmove.isdigit() and fullmove.isdigit() and int(fullmove) > 0):
+            raise ValueError(f"Invalid FEN (move counters): {fen!r}")
+        self.halfmove_clock = int(halfmove)
+        self.fullmove_number = int(fullmove)
+
+        self.stack = []
+        self._has_legal_move = (None, False)
+        self._checks = (None, None)
+        self.hash = self.compute_hash()
+        self.repetitions = {self.hash: 1}
+
+    def fen(self):
+        # Empty squares as '1's, then runs of them collapsed (longest first)
+        symbols = [FEN_SYMBOLS[piece] for piece in self.squares]
+        placement = '/'.join([''.join(symbols[rank:rank + 8]) for rank in range(112, -1, -16)])
+        for run in EMPTY_RUNS:
+            placement = placement.replace(*run)
+
+        castling = CASTLING_FEN[self.castling]
+        ep = SQUARE_NAMES[self.ep_square] if self.ep_square >= 0 else '-'
+        turn = 'w' if self.turn == WHITE else 'b'
+        return f"{placement} {turn} {castling} {ep} {self.halfmove_clock} {self.fullmove_number}"
+
+    def copy(self):
+        return Board(self.fen())
+
+    # ------------------------------------------------------------------
+    # Hashing
+    # ------------------------------------------------------------------
+
+    def _ep_capturable(self, ep_square, side):
+        """True if a pawn of `side` could capture en passant on ep_square"""
+        if ep_square < 0:
+            return False
+        pawn = side | PAWN
+        behind = ep_square - 16 if side == WHITE else ep_square + 16
+        for sq in (behind - 1, behind + 1):
+            if not sq & 0x88 and self.squares[sq] == pawn:
+                return True
+        return False
+
+    def compute_hash(self):
+        """Zobrist hash computed from scratch (make/unmake keep it incrementally)"""
+        h = 0
+        for sq in SQUARES:
+            piece = self.squares[sq]
+            if piece:
+                h ^= ZOBRIST_PIECES[piece][sq]
+        h ^= ZOBRIST_CASTLING[self.castling]
+        if self._ep_capturable(self.ep_square, self.turn):
+            h ^= ZOBRIST_EP_FILE[self.ep_square & 7]
+        if self.turn == BLACK:
+            h ^= ZOBRIST_BLACK_TO_MOVE
+        return h
+
+    # ------------------------------------------------------------------
+    # Attacks
+    # ------------------------------------------------------------------
+
+    def is_attacked(self, sq, by_color):
+        """True if any piece of by_color attacks sq"""
+        squares = self.squares
+
+        # Pawns attack diagonally forwards, so look backwards from sq
+        pawn = by_color | PAWN
+        if by_color == WHITE:
+            a, b = sq - 15, sq - 17
+        else:
+            a, b = sq + 15, sq + 17
+        if (not a & 0x88 and squares[a] == pawn) or (not b & 0x88 and squares[b] == pawn):
+            return True
+
+        knight = by_color | KNIGHT
+        for offset in KNIGHT_OFFSETS:
+            target = sq + offset
+            if not target & 0x88 and squares[target] == knight:
+                return True
+
+        king = by_color | KING
+        for offset in KING_OFFSETS:
+            target = sq + offset
+            if not target & 0x88 and squares[target] == king:
+                return True
+
+        queen = by_color | QUEEN
+        bishop = by_color | BISHOP
+        for offset in BISHOP_OFFSETS:
+            target = sq + offset
+            while not target & 0x88:
+                piece = squares[target]
+                if piece:
+                    if piece == bishop or piece == queen:
+                        return True
+                    break
+                target += offset
+
+        rook = by_color | ROOK
+        for offset in ROOK_OFFSETS:
+            target = sq + offset
+            while not target & 0x88:
+                piece = squares[target]
+                if piece:
+                    if piece == rook or piece == queen:
+                        return True
+                    break
+                target += offset
+        return False
+
+    def in_check(self):
+        return self.is_attacked(self.king_squares[self.turn], self.turn ^ 24)
+
+    # ------------------------------------------------------------------
+    # Move generation
+    # ------------------------------------------------------------------
+
+    def pseudo_legal_moves(self, from_squares=SQUARES):
+        """Moves that follow piece movement rules but may leave the king in check"""
+        squares = self.squares
+        us = self.turn
+        them = us ^ 24
+        moves = []
+        append = moves.append
+
+        for frm in from_squares:
+            piece = squares[frm]
+            if not piece or piece & 24 != us:
+                continue
+            kind = piece & 7
+
+            if kind == PAWN:
+                if us == WHITE:
+                    forward, start_rank, promo_rank = 16, 1, 7
+                else:
+                    forward, start_rank, promo_rank = -16, 6, 0
+                to = frm + forward
+                if not to & 0x88 and not squares[to]:
+                    if to >> 4 == promo_rank:
+                        for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                            append(frm | (to << 7) | (promotion << 14))
+                    else:
+                        append(frm | (to << 7))
+                        if frm >> 4 == start_rank:
+                            to2 = to + forward
+                            if not squares[to2]:
+                                append(frm | (to2 << 7) | (DOUBLE_PUSH << 17))
+                for to in (frm + forward - 1, frm + forward + 1):
+                    if to & 0x88:
+                        continue
+                    target = squares[to]
+                    if target and target & 24 == them:
+                        if to >> 4 == promo_rank:
+                            for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                                append(frm | (to << 7) | (promotion << 14))
+                        else:
+                            append(frm | (to << 7))
+                    elif to == self.ep_square:
+                        append(frm | (to << 7) | (EN_PASSANT << 17))
+
+            elif kind == KNIGHT or kind == KING:
+                for offset in (KNIGHT_OFFSETS if kind == KNIGHT else KING_OFFSETS):
+                    to = frm + offset
+                    if to & 0x88:
+                        continue
+                    target = squares[to]
+                    if not target or target & 24 == them:
+                        append(frm | (to << 7))
+                if kind == KING:
+                    self._castling_moves(frm, append)
+
+            else:
+                if kind == BISHOP:
+                    offsets = BISHOP_OFFSETS
+                elif kind == ROOK:
+                    offsets = ROOK_OFFSETS
+                else:
+                    offsets = KING_OFFSETS
+                for offset in offsets:
+                    to = frm + offset
+                    while not to & 0x88:
+                        target = squares[to]
+                        if target:
+                            if target & 24 == them:
+                                append(frm | (to << 7))
+                            break
+                        append(frm | (to << 7))
+                        to += offset
+        return moves
+
+    def _castling_moves(self, frm, append):
+        us = self.turn
+        if us == WHITE:
+            if frm != 0x04:
+                return
+            kingside, queenside = WHITE_KINGSIDE, WHITE_QUEENSIDE
+        else:
+            if frm != 0x74:
+                return
+            kingside, queenside = BLACK_KINGSIDE, BLACK_QUEENSIDE
+        if not self.castling & (kingside | queenside):
+            return
+        squares = self.squares
+        them = us ^ 24
+        if self.is_attacked(frm, them):
+            return
+        if (self.castling & kingside and not squares[frm + 1] and not squares[frm + 2]
+                and squares[frm + 3] == us | ROOK and not self.is_attacked(frm + 1, them)):
+            append(frm | ((frm + 2) << 7) | (CASTLE << 17))
+        if (self.castling & queenside and not squares[frm - 1] and not squares[frm - 2]
+                and not squares[frm - 3] and squares[frm - 4] == us | ROOK
+                and not self.is_attacked(frm - 1, them)):
+            append(frm | ((frm - 2) << 7) | (CASTLE << 17))
+
+    def _check_info(self):
+        """
+        (checkers, stops, pins) for the side to move, worked out once per
+        position: the squares of the pieces giving check, the squares where
+        a piece other than the king can answer a single check (capture or
+        block), and the line step of each pinned piece by its square
+        """
+        if self._checks[0] == self.hash:
+            return self._checks[1]
+        squares = self.squares
+        us = self.turn
+        them = us ^ 24
+        king = self.king_squares[us]
+        checkers = []
+        stops = set()
+        pins = {}
+
+        pawn = them | PAWN
+        for sq in ((king + 15, king + 17) if us == WHITE else (king - 15, king - 17)):
+            if not sq & 0x88 and squares[sq] == pawn:
+                checkers.append(sq)
+                stops.add(sq)
+        knight = them | KNIGHT
+        for offset in KNIGHT_OFFSETS:
+            sq = king + offset
+            if not sq & 0x88 and squares[sq] == knight:
+                checkers.append(sq)
+                stops.add(sq)
+
+        # Walk out from the king: an enemy slider is a checker if nothing is
+        # in the way, and pins the piece if exactly one of ours is
+        queen = them | QUEEN
+        for offsets, slider in ((BISHOP_OFFSETS, them | BISHOP), (ROOK_OFFSETS, them | ROOK)):
+            for offset in offsets:
+                line = []
+                pinned = -1
+                sq = king + offset
+                while not sq & 0x88:
+                    piece = squares[sq]
+                    if not piece:
+                        line.append(sq)
+                    elif piece & 24 == us:
+                        if pinned >= 0:
+                            break
+                        pinned = sq
+                    else:
+                        if piece == slider or piece == queen:
+                            if pinned >= 0:
+                                pins[pinned] = offset
+                            else:
+                                checkers.append(sq)
+                                stops.update(line)
+                                stops.add(sq)
+                        break
+                    sq += offset
+
+        info = (checkers, stops, pins)
+        self._checks = (self.hash, info)
+        return info
+
+    def is_legal(self, move):
+        """True if a pseudo-legal move doesn't leave the mover's king in check"""
+        us = self.turn
+        frm = move & 127
+        to = (move >> 7) & 127
+        king = self.king_squares[us]
+        if frm == king:
+            # Lift the king so it can't shield the square it steps back to.
+            # Castling never passes through check, so only the target counts
+            squares = self.squares
+            squares[frm] = EMPTY
+            legal = not self.is_attacked(to, us ^ 24)
+            squares[frm] = us | KING
+            return legal
+        if move >> 17 == EN_PASSANT:
+            # Lifts a second pawn, possibly off a line through the king
+            self.push(move)
+            legal = not self.is_attacked(king, us ^ 24)
+            self.pop()
+            return legal
+        checkers, stops, pins = self._check_info()
+        if checkers and (len(checkers) > 1 or to not in stops):
+            return False
+        # A pinned piece may only move along the line it is pinned on
+        step = pins.get(frm)
+        return step is None or LINE_STEP[0x77 + to - king] == step
+
+    def legal_moves(self):
+        return [move for move in self.pseudo_legal_moves() if self.is_legal(move)]
+
+    def has_legal_move(self):
+        # Remembered per position: SAN suffixes and outcome() both ask
+        if self._has_legal_move[0] == self.hash:
+            return self._has_legal_move[1]
+        squares = self.squares
+        us = self.turn
+        king = self.king_squares[us]
+        # King first (the usual way out of check)
+        result = any(self.is_legal(move) for move in self.pseudo_legal_moves((king,)))
+        if not result and self.in_check():
+            # Only the king can answer a double check. A single one is
+            # answered by an unpinned piece capturing or blocking the checker
+            checkers, stops, pins = self._check_info()
+            if len(checkers) == 1:
+                others = [sq for sq in SQUARES if squares[sq] & 24 == us and sq != king and sq not in pins]
+                result = any(
+                    (move >> 7) & 127 in stops if move >> 17 != EN_PASSANT else self.is_legal(move)
+                    for move in self.pseudo_legal_moves(others)
+                )
+        elif not result:
+            # One piece at a time so the common case stops after a handful
+            # of moves. A piece off every line through its king can't expose
+            # it, unless it captures en passant and lifts a second pawn
+            for frm in SQUARES:
+                piece = squares[frm]
+                if frm == king or not piece or piece & 24 != us:
+                    continue
+                unpinned = not LINE_STEP[0x77 + frm - king]
+                if any((unpinned and move >> 17 != EN_PASSANT) or self.is_legal(move)
+                       for move in self.pseudo_legal_moves((frm,))):
+                    result = True
+                    break
+        self._has_legal_move = (self.hash, result)
+        return result
+
+    # ------------------------------------------------------------------
+    # Make / unmake
+    # ------------------------------------------------------------------
+
+    def push(self, move):
+        """Make a move (assumed pseudo-legal) and update the hash incrementally"""
+        squares = self.squares
+        frm = move & 127
+        to = (move >> 7) & 127
+        promotion = (move >> 14) & 7
+        flag = move >> 17
+        piece = squares[frm]
+        us = piece & 24
+        captured = squares[to]
+
+        self.stack.append((move, captured, self.castling, self.ep_square,
+                           self.halfmove_clock, self.hash))
+
+        h = self.hash ^ ZOBRIST_PIECES[piece][frm]
+        if self._ep_capturable(self.ep_square, us):
+            h ^= ZOBRIST_EP_FILE[self.ep_square & 7]
+
+        if captured:
+            h ^= ZOBRIST_PIECES[captured][to]
+        elif flag == EN_PASSANT:
+            cap_sq = to - 16 if us == WHITE else to + 16
+            h ^= ZOBRIST_PIECES[squares[cap_sq]][cap_sq]
+            squares[cap_sq] = EMPTY
+
+        placed = us | promotion if promotion else piece
+        squares[to] = placed
+        squares[frm] = EMPTY
+        h ^= ZOBRIST_PIECES[placed][to]
+
+        if piece & 7 == KING:
+            self.king_squares[us] = to
+            if flag == CASTLE:
+                if to > frm:
+                    rook_from, rook_to = frm + 3, frm + 1
+                else:
+                    rook_from, rook_to = frm - 4, frm - 1
+                rook = squares[rook_from]
+                squares[rook_to] = rook
+                squares[rook_from] = EMPTY
+                h ^= ZOBRIST_PIECES[rook][rook_from] ^ ZOBRIST_PIECES[rook][rook_to]
+
+        castling = self.castling & CASTLE_MASK[frm] & CASTLE_MASK[to]
+        if castling != self.castling:
+            h ^= ZOBRIST_CASTLING[self.castling] ^ ZOBRIST_CASTLING[castling]
+            self.castling = castling
+
+        them = us ^ 24
+        if flag == DOUBLE_PUSH:
+            self.ep_square = (frm + to) >> 1
+            if self._ep_capturable(self.ep_square, them):
+                h ^= ZOBRIST_EP_FILE[self.ep_square & 7]
+        else:
+            self.ep_square = -1
+
+        if piece & 7 == PAWN or captured or flag == EN_PASSANT:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if us == BLACK:
+            self.fullmove_number += 1
+        self.turn = them
+        h ^= ZOBRIST_BLACK_TO_MOVE
+        self.hash = h
+        self.repetitions[h] = self.repetitions.get(h, 0) + 1
+
+    def pop(self):
+        """Unmake the last move"""
+        count = self.repetitions[self.hash] - 1
+        if count:
+            self.repetitions[self.hash] = count
+        else:
+            del self.repetitions[self.hash]
+
+        move, captured, castling, ep_square, halfmove_clock, h = self.stack.pop()
+        squares = self.squares
+        frm = move & 127
+        to = (move >> 7) & 127
+        promotion = (move >> 14) & 7
+        flag = move >> 17
+        them = self.turn
+        us = them ^ 24
+
+        piece = us | PAWN if promotion else squares[to]
+        squares[frm] = piece
+        squares[to] = captured
+        if flag == EN_PASSANT:
+            cap_sq = to - 16 if us == WHITE else to + 16
+            squares[cap_sq] = them | PAWN
+        if piece & 7 == KING:
+            self.king_squares[us] = frm
+            if flag == CASTLE:
+                if to > frm:
+                    rook_from, rook_to = frm + 3, frm + 1
+                else:
+                    rook_from, rook_to = frm - 4, frm - 1
+                squares[rook_from] = squares[rook_to]
+                squares[rook_to] = EMPTY
+
+        if us == BLACK:
+            self.fullmove_number -= 1
+        self.turn = us
+        self.castling = castling
+        self.ep_square = ep_square
+        self.halfmove_clock = halfmove_clock
+        self.hash = h
+
+    # ------------------------------------------------------------------
+    # Notation
+    # ------------------------------------------------------------------
+
+    def parse_uci(self, uci):
+        """Return the legal move for a UCI string (e.g. 'e7e8q') or raise IllegalMoveError"""
+        uci = uci.strip().lower()
+        frm = NAME_SQUARES.get(uci[:2])
+        to = NAME_SQUARES.get(uci[2:4])
+        promotion = PROMOTION_PIECES.get(uci[4:5], 0) if len(uci) > 4 else 0
+        if frm is None or to is None:
+            raise IllegalMoveError(f"Invalid move: {uci}")
+        for move in self.pseudo_legal_moves((frm,)):
+            if (move >> 7) & 127 == to and (move >> 14) & 7 == promotion:
+                if self.is_legal(move):
+                    return move
+                break
+        raise IllegalMoveError(f"Illegal move: {uci}")
+
+    def san(self, move):
+        """Standard algebraic notation for a legal move in this position"""
+        frm = move & 127
+        to = (move >> 7) & 127
+        flag = move >> 17
+        promotion = (move >> 14) & 7
+        piece = self.squares[frm]
+        kind = piece & 7
+
+        if flag == CASTLE:
+            san = 'O-O' if to > frm else 'O-O-O'
+        else:
+            capture = bool(self.squares[to]) or flag == EN_PASSANT
+            target = SQUARE_NAMES[to]
+            if kind == PAWN:
+                san = SQUARE_NAMES[frm][0] + 'x' + target if capture else target
+                if promotion:
+                    san += '=' + TYPE_LETTERS[promotion].upper()
+            else:
+                san = TYPE_LETTERS[kind].upper()
+                others = [sq for sq in SQUARES if self.squares[sq] == piece and sq != frm]
+                rivals = [
+                    other & 127 for other in self.pseudo_legal_moves(others)
+                    if (other >> 7) & 127 == to and self.is_legal(other)
+                ] if others else []
+                if rivals:
+                    same_file = any(sq & 7 == frm & 7 for sq in rivals)
+                    same_rank = any(sq >> 4 == frm >> 4 for sq in rivals)
+                    if not same_file:
+                        san += SQUARE_NAMES[frm][0]
+                    elif not same_rank:
+                        san += SQUARE_NAMES[frm][1]
+                    else:
+                        san += SQUARE_NAMES[frm]
+                if capture:
+                    san += 'x'
+                san += target
+
+        self.push(move)
+        if self.in_check():
+            san += '+' if self.has_legal_move() else '#'
+        self.pop()
+        return san
+
+    def parse_san(self, san):
+        """Return the legal move for a SAN string (e.g. 'Nxe5+') or raise IllegalMoveError"""
+        wanted = san.strip().rstrip('+#!?').replace('0', 'O')
+        if wanted in ('O-O', 'O-O-O'):
+            frm = self.king_squares[self.turn]
+            for move in self.pseudo_legal_moves((frm,)):
+                if move >> 17 == CASTLE and ((move >> 7) & 127 < frm) == (wanted == 'O-O-O'):
+                    if self.is_legal(move):
+                        return move
+            raise IllegalMoveError(f"Illegal move: {san}")
+
+        match = SAN_PATTERN.match(wanted)
+        if not match:
+            raise IllegalMoveError(f"Invalid move: {san}")
+        letter, file, rank, target, promotion = match.groups()
+        piece = self.turn | (LETTER_TYPES[letter] if letter else PAWN)
+        to = NAME_SQUARES[target]
+        promotion = PROMOTION_PIECES[promotion.lower()] if promotion else 0
+
+        # Only the squares holding the moving piece (and matching any
+        # disambiguation) need their moves generated
+        squares = self.squares
+        candidates = [
+            sq for sq in SQUARES
+            if squares[sq] == piece
+            and (file is None or SQUARE_NAMES[sq][0] == file)
+            and (rank is None or SQUARE_NAMES[sq][1] == rank)
+        ]
+        matches = [
+            move for move in self.pseudo_legal_moves(candidates)
+            if (move >> 7) & 127 == to and (move >> 14) & 7 == promotion and self.is_legal(move)
+        ]
+        if len(matches) != 1:
+            raise IllegalMoveError(f"{'Ambiguous' if matches else 'Illegal'} move: {san}")
+        return matches[0]
+
+    def captured_piece(self, move):
+        """Piece (as a FEN symbol) that a move would capture, or None"""
+        if move >> 17 == EN_PASSANT:
+            return 'p' if self.turn == WHITE else 'P'
+        target = self.squares[(move >> 7) & 127]
+        return PIECE_SYMBOLS[target] if target else None
+
+    # ------------------------------------------------------------------
+    # Game end
+    # ------------------------------------------------------------------
+
+    def is_insufficient_material(self):
+        minors = []
+        for sq in SQUARES:
+            piece = self.squares[sq]
+            kind = piece & 7
+            if not piece or kind == KING:
+                continue
+            if kind in (PAWN, ROOK, QUEEN):
+                return False
+            minors.append((kind, sq))
+        if len(minors) <= 1:
+            return True
+        # Bishops only, all on the same colour of square
+        if all(kind == BISHOP for kind, _ in minors):
+            colours = {((sq >> 4) + (sq & 7)) & 1 for _, sq in minors}
+            return len(colours) == 1
+        return False
+
+    def repetition_count(self):
+        """How many times the current position has occurred"""
+        return self.repetitions.get(self.hash, 0)
+
+    def outcome(self, claim_draw=False):
+        """
+        (winner, reason) if the game is over, else None.
+
+        Checkmate, stalemate, insufficient material, the seventy-five-move
+        rule and fivefold repetition end the game automatically. With
+        claim_draw, the fifty-move rule and threefold repetition count too.
+        """
+        if not self.has_legal_move():
+            if self.in_check():
+                return ('black' if self.turn == WHITE else 'white'), 'checkmate'
+            return 'draw', 'stalemate'
+        if self.is_insufficient_material():
+            return 'draw', 'insufficient'
+        if self.halfmove_clock >= 150:
+            return 'draw', 'fifty_move'
+        if self.repetition_count() >= 5:
+            return 'draw', 'repetition'
+        if claim_draw:
+            if self.halfmove_clock >= 100:
+                return 'draw', 'fifty_move'
+            if self.repetition_count() >= 3:
+                return 'draw', 'repetition'
+        return None
+
+
+def perft(board, depth):
+    """Count leaf nodes of the legal move tree (move generator correctness/speed test)"""
+    if depth == 0:
+        return 1
+    nodes = 0
+    us = board.turn
+    them = us ^ 24
+    for move in board.pseudo_legal_moves():
+        board.push(move)
+        if not board.is_attacked(board.king_squares[us], them):
+            nodes += perft(board, depth - 1) if depth > 1 else 1
+        board.pop()
+    return nodes
@@ -0,0 +1,69 @@
+"""
+Chess clock rules
+
+All clock values are integer milliseconds. A time control is a base time
+plus either a Fischer increment (added after every move) or a Bronstein
+delay (time used on a move is given back, up to the delay).
+
+    >>> tc = TIME_CONTROLS['blitz_3_2']
+    >>> charge_move(tc, remaining_ms=180_000, elapsed_ms=4_250)
+    177750
+"""
+from collections import namedtuple
+
+TimeControl = namedtuple('TimeControl', ['base_ms', 'increment_ms', 'delay_ms'])
+TimeControl.__new__.__defaults__ = (0, 0)
+
+UNLIMITED_MS = 999_999_000
+
+TIME_CONTROLS = {
+    'bullet_1': TimeControl(60_000),
+    'bullet_1_1': TimeControl(60_000, increment_ms=1_000),
+    'bullet_2': TimeControl(120_000),
+    'blitz_3': TimeControl(180_000),
+    'blitz_3_2': TimeControl(180_000, increment_ms=2_000),
+    'blitz_5': TimeControl(300_000),
+    'blitz_5_d3': TimeControl(300_000, delay_ms=3_000),
+    'rapid_10': TimeControl(600_000),
+    'rapid_10_5': TimeControl(600_000, increment_ms=5_000),
+    'rapid_15': TimeControl(900_000),
+    'rapid_15_10': TimeControl(900_000, increment_ms=10_000),
+    'classical_30': TimeControl(1_800_000),
+    'classical_30_d10': TimeControl(1_800_000, delay_ms=10_000),
+    'classical_60': TimeControl(3_600_000),
+    'unlimited': TimeControl(UNLIMITED_MS),
+}
+DEFAULT_TIME_CONTROL = 'blitz_5'
+
+
+def get_time_control(name):
+    return TIME_CONTROLS.get(name, TIME_CONTROLS[DEFAULT_TIME_CONTROL])
+
+
+def running_time(remaining_ms, elapsed_ms):
+    """Time left on a running clock (never below zero)"""
+    left = remaining_ms - elapsed_ms
+    return left if left > 0 else 0
+
+
+def charge_move(tc, remaining_ms, elapsed_ms):
+    """
+    Clock of the player who just moved, after spending elapsed_ms.
+
+    A flag fall (remaining time used up) returns 0 with no increment or
+    delay credit; the game is lost on time.
+    """
+    left = remaining_ms - elapsed_ms
+    if left <= 0:
+        return 0
+    if tc.increment_ms:
+        left += tc.increment_ms
+    if tc.delay_ms:
+        left += elapsed_ms if elapsed_ms < tc.delay_ms else tc.delay_ms
+    return left
+
+
+def elapsed_ms_between(start, end):
+    """Whole milliseconds between two datetimes"""
+    delta = end - start
+    return (delta.days * 86_400_000) + (delta.seconds * 1000) + (delta.microseconds // 1000)
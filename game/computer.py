@@ -0,0 +1,157 @@
+"""
+Computer opponent
+
+A game against the computer has engine_color and engine_level set (see
+api_create_game). Whenever it is the engine's turn - after the player's
+move, or straight away when the engine has white - request_engine_move()
+hands the search (search.best_move) to a pool of
+MTU_CHESS_CONFIG['ENGINE_WORKERS'] processes, so request workers never
+run a search. The move that comes back is played through
+services.commit_move like any other and published to the players.
+
+The level sets the search budget (search.LEVELS), capped so a move never
+takes more than a thirtieth of the engine's remaining clock plus the
+increment: the engine's clock runs while it thinks, like anyone's.
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, transaction
+
+from .search import DEFAULT_LEVEL, LEVELS, Limits, best_move
+
+logger = logging.getLogger(__name__)
+
+COLORS = ('white', 'black')
+CLOCK_FRACTION = 30
+MIN_SEARCH_MS = 50
+COMMIT_ATTEMPTS = 3
+COMMIT_RETRY_SECONDS = 0.2
+
+_pool = None
+_pool_lock = threading.Lock()
+# Codes of games with a search in flight, so one isn't started twice
+# (added from request threads, removed from the pool's result thread)
+_searching = set()
+_searching_lock = threading.Lock()
+
+
+def _config(key, default):
+    return getattr(settings, 'MTU_CHESS_CONFIG', {}).get(key, default)
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned workers start clean: no copies of the server's threads
+            # or database connections, and they only import the search code
+            _pool = ProcessPoolExecutor(
+                max_workers=_config('ENGINE_WORKERS', 2),
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+
+def _reset_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def engine_name(level):
+    """Name shown for the computer player"""
+    return f'Computer (level {level})'
+
+
+def search_limits(game):
+    """Search budget for the engine's next move in a game"""
+    level = LEVELS.get(game.engine_level, LEVELS[DEFAULT_LEVEL])
+    remaining_ms = game.get_timer_state()[f'{game.engine_color}_time_ms']
+    time_control = game.get_time_control()
+    clock_ms = remaining_ms // CLOCK_FRACTION + time_control.increment_ms + time_control.delay_ms
+    return Limits(level.depth, level.nodes, max(MIN_SEARCH_MS, min(level.time_ms, clock_ms)))
+
+
+def is_engine_turn(game):
+    return (game.status == 'active' and game.engine_color in COLORS
+            and game.engine_color == ('white' if game.fen.split()[1] == 'w' else 'black'))
+
+
+def request_engine_move(game):
+    """
+    Start a search for the engine's move if it is the engine's turn, once
+    the current transaction commits. The move is played from the pool's
+    result thread when the search finishes.
+    """
+    if not is_engine_turn(game):
+        return
+    code = game.code
+    ply = game.move_count
+    move_data = bytes(game.move_data)
+    limits = search_limits(game)
+
+    def submit():
+        with _searching_lock:
+            if code in _searching:
+                return
+            _searching.add(code)
+        pool = _get_pool()
+        try:
+            future = pool.submit(best_move, move_data, *limits)
+        except (BrokenProcessPool, RuntimeError):
+            with _searching_lock:
+                _searching.discard(code)
+            _reset_pool(pool)
+            logger.exception("Engine pool unavailable for game %s", code)
+            return
+        future.add_done_callback(partial(_play, code, ply, pool))
+    transaction.on_commit(submit, robust=True)
+
+
+def _play(code, ply, pool, future):
+    """Play a finished search's move, unless the game moved on meanwhile"""
+    from .services import MoveRejected, commit_move
+
+    with _searching_lock:
+        _searching.discard(code)
+    close_old_connections()
+    try:
+        result = future.result()
+        if result.uci is None:
+            return
+        for attempt in range(COMMIT_ATTEMPTS):
+            try:
+                commit_move(code, uci=result.uci, ply=ply)
+                break
+            except OperationalError:
+                # SQLite refuses a write that collides with another
+                # thread's; the move is still good, so try again
+                if attempt == COMMIT_ATTEMPTS - 1:
+                    raise
+                time.sleep(COMMIT_RETRY_SECONDS)
+    except MoveRejected as e:
+        logger.info("Engine move in game %s not played: %s", code, e)
+    except BrokenProcessPool:
+        _reset_pool(pool)
+        logger.exception("Engine worker died searching game %s", code)
+    except Exception:
+        logger.exception("Engine move failed in game %s", code)
+    finally:
+        close_old_connections()
+
+
+def resume_engine_games():
+    """Restart searches for games left waiting on the engine (e.g. by a restart)"""
+    from .models import Game
+
+    for game in Game.objects.filter(status='active').exclude(engine_color='').iterator():
+        request_engine_move(game)
@@ -0,0 +1,64 @@
+"""
+WebSocket endpoint for live games
+
+    ws://<server>/ws/game/<code>/
+    ws://<server>/ws/game/<code>/?since=<version>
+
+On connect the client receives a full 'snapshot' of the game followed by
+the deltas published since it, then every delta until it disconnects.
+A reconnecting client that passes the last version it saw gets only the
+deltas it missed when they are still buffered. All connections to a game
+share one subscription and buffer (see spectators.py).
+"""
+import asyncio
+import re
+from urllib.parse import parse_qs
+
+from .spectators import hub
+
+GAME_PATH = re.compile(r'^/ws/game/(?P<code>[A-Za-z0-9]+)/?$')
+
+
+def _since(scope):
+    values = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('since')
+    try:
+        return int(values[0]) if values else None
+    except ValueError:
+        return None
+
+
+async def game_websocket(scope, receive, send):
+    """ASGI application handling one game WebSocket connection"""
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+
+    match = GAME_PATH.match(scope.get('path', ''))
+    if not match:
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    code = match.group('code').upper()
+
+    broadcast = await hub.join(code)
+    if broadcast is None:
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    try:
+        await send({'type': 'websocket.accept'})
+        sender = asyncio.ensure_future(broadcast.serve(send, since=_since(scope)))
+        try:
+            while True:
+                receiver = asyncio.ensure_future(receive())
+                done, _ = await asyncio.wait({receiver, sender}, return_when=asyncio.FIRST_COMPLETED)
+                if sender in done:
+                    # Sending failed (the connection is gone)
+                    receiver.cancel()
+                    sender.result()
+                    break
+                # Clients only listen; anything they send is ignored
+                if receiver.result()['type'] == 'websocket.disconnect':
+                    break
+        finally:
+            sender.cancel()
+    finally:
+        hub.leave(broadcast)
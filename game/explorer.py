@@ -0,0 +1,199 @@
+"""
+Opening explorer
+
+For every position reached in the first EXPLORER_MAX_PLY plies of a
+finished game, PositionMove holds one row per move played from it with
+white wins / draws / black wins and the players' rating points (games
+against the computer aren't counted). Positions are identified by their
+Zobrist key (Board.hash, stored as a signed 64-bit integer), so
+transpositions share rows and a lookup is a single index seek on
+(position_key, move_san) - no FEN strings are compared.
+
+    explore(fen)          moves played from a position, most popular first
+    index_game(game)      add a finished game (Game.mark_completed calls it)
+    add_games(games)      add many games in one upsert (import, rebuild)
+    rebuild()             re-index every finished game
+
+Counts are added with INSERT ... ON CONFLICT DO UPDATE (SQLite and
+PostgreSQL), so concurrent games can't lose increments.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+
+from .board import Board, IllegalMoveError
+from .movecodec import replay
+from .rating import RESULTS
+
+DEFAULT_MAX_PLY = 40
+REBUILD_CHUNK_SIZE = 1000
+
+# winner -> (white_wins, draws, black_wins)
+RESULT_COUNTS = {'white': (1, 0, 0), 'draw': (0, 1, 0), 'black': (0, 0, 1)}
+
+COUNT_FIELDS = ['white_wins', 'draws', 'black_wins', 'rating_sum', 'rated_players']
+
+
+def _max_ply():
+    return getattr(settings, 'MTU_CHESS_CONFIG', {}).get('EXPLORER_MAX_PLY', DEFAULT_MAX_PLY)
+
+
+def position_key(zobrist_hash):
+    """A Board.hash (unsigned 64-bit) as the signed value a BigIntegerField stores"""
+    return zobrist_hash - (1 << 64) if zobrist_hash >= 1 << 63 else zobrist_hash
+
+
+def game_entries(hashes, sans, max_ply=None):
+    """
+    (position key, SAN) for each move within the explorer depth, given the
+    Board.hash before each move. A position/move repeated within the game
+    is counted once.
+    """
+    limit = _max_ply() if max_ply is None else max_ply
+    return list(dict.fromkeys(
+        (position_key(zobrist_hash), san) for zobrist_hash, san in zip(hashes[:limit], sans[:limit])
+    ))
+
+
+def replay_moves(move_data, max_ply=None):
+    """(Board.hash before each move, SANs) of the first max_ply moves of a Game.move_data"""
+    limit = _max_ply() if max_ply is None else max_ply
+    hashes = []
+    sans = []
+    for board, move in replay(bytes(move_data)[:limit * 2]):
+        hashes.append(board.hash)
+        sans.append(board.san(move))
+    return hashes, sans
+
+
+def _upsert_sql():
+    from .models import PositionMove
+
+    quote = connection.ops.quote_name
+    table = quote(PositionMove._meta.db_table)
+    columns = ['position_key', 'move_san'] + COUNT_FIELDS
+    return 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s, %s) DO UPDATE SET %s' % (
+        table,
+        ', '.join(quote(column) for column in columns),
+        ', '.join(['%s'] * len(columns)),
+        quote('position_key'), quote('move_san'),
+        ', '.join('%s = %s.%s + excluded.%s' % (quote(field), table, quote(field), quote(field))
+                  for field in COUNT_FIELDS),
+    )
+
+
+def add_games(games):
+    """
+    Add games to the index. `games` yields (entries from game_entries(),
+    winner, rating sum, number of rated players); everything is merged in
+    memory first and written in one executemany.
+    """
+    totals = {}
+    for entries, winner, rating_sum, rated_players in games:
+        counts = RESULT_COUNTS.get(winner)
+        if counts is None:
+            continue
+        for entry in entries:
+            total = totals.get(entry)
+            if total is None:
+                totals[entry] = [*counts, rating_sum, rated_players]
+            else:
+                total[0] += counts[0]
+                total[1] += counts[1]
+                total[2] += counts[2]
+                total[3] += rating_sum
+                total[4] += rated_players
+    if totals:
+        with connection.cursor() as cursor:
+            cursor.executemany(_upsert_sql(), [(key, san, *total) for (key, san), total in totals.items()])
+    return len(totals)
+
+
+def player_ratings(*ratings):
+    """(sum, count) of the players' ratings (guests have none)"""
+    rated = [round(rating) for rating in ratings if rating is not None]
+    return sum(rated), len(rated)
+
+
+def index_game(game):
+    """
+    Add a game that just finished, once the transaction commits. Called
+    before the result is rated, so the players' ratings going into the
+    game are the ones counted. Game.mark_completed only calls it on the
+    active -> completed transition, and the completing write is version
+    checked, so a game is added once.
+    """
+    from .models import User
+
+    if game.winner not in RESULTS or not game.move_count or game.engine_color:
+        return
+    move_data = bytes(game.move_data)
+    winner = game.winner
+    player_ids = [pk for pk in (game.white_player_id, game.black_player_id) if pk]
+    ratings = []
+    if player_ids:
+        ratings = list(User.objects.filter(pk__in=player_ids).values_list('rating_points', flat=True))
+
+    def add():
+        try:
+            hashes, sans = replay_moves(move_data)
+        except IllegalMoveError:
+            return
+        add_games([(game_entries(hashes, sans), winner, *player_ratings(*ratings))])
+    transaction.on_commit(add, robust=True)
+
+
+def rebuild(chunk_size=REBUILD_CHUNK_SIZE, progress=None):
+    """
+    Empty the index and re-add every finished game, chunk_size games per
+    upsert. progress(games done) is called after each chunk. Returns the
+    number of games indexed.
+    """
+    from .models import Game, PositionMove
+
+    games = (
+        Game.objects.filter(status='completed', winner__in=list(RESULTS), engine_color='')
+        .order_by('pk')
+        .values_list('move_data', 'winner', 'white_player__rating_points', 'black_player__rating_points')
+    )
+    done = 0
+    with transaction.atomic():
+        PositionMove.objects.all().delete()
+        chunk = []
+        for move_data, winner, white_rating, black_rating in games.iterator(chunk_size=chunk_size):
+            try:
+                hashes, sans = replay_moves(move_data)
+            except IllegalMoveError:
+                continue
+            chunk.append((game_entries(hashes, sans), winner, *player_ratings(white_rating, black_rating)))
+            if len(chunk) == chunk_size:
+                add_games(chunk)
+                done += len(chunk)
+                chunk = []
+                if progress:
+                    progress(done)
+        add_games(chunk)
+        done += len(chunk)
+    return done
+
+
+def explore(fen):
+    """
+    Moves played from a position (a FEN; raises ValueError if malformed),
+    most played first, with their results and average player rating
+    """
+    from .models import PositionMove
+
+    key = position_key(Board(fen).hash)
+    rows = PositionMove.objects.filter(position_key=key).values_list('move_san', *COUNT_FIELDS)
+    moves = []
+    for san, white_wins, draws, black_wins, rating_sum, rated_players in rows:
+        moves.append({
+            'san': san,
+            'games': white_wins + draws + black_wins,
+            'white_wins': white_wins,
+            'draws': draws,
+            'black_wins': black_wins,
+            'average_rating': round(rating_sum / rated_players) if rated_players else None,
+        })
+    moves.sort(key=lambda move: -move['games'])
+    return moves
@@ -0,0 +1,94 @@
+"""
+Run the post-game analysis queue
+
+    python manage.py analyse_games                     # run queued jobs until none are left
+    python manage.py analyse_games --backfill          # queue finished games never analysed first
+    python manage.py analyse_games --game K3XQ9P --workers 4
+
+The server analyses games as they finish (ANALYSIS_WORKERS); this runs
+the same jobs in the foreground, e.g. for games imported or played
+before analysis existed, or with ANALYSIS_WORKERS set to 0. Jobs are
+claimed the same way the server claims them, so both can run at once.
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game import analysis
+from game.models import Game, GameAnalysis
+from game.search import evaluate_positions
+
+
+class Command(BaseCommand):
+    help = 'Analyse finished games: run the analysis queue in the foreground'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--game', action='append', default=[], metavar='CODE',
+                            help='Queue this game (again); may be repeated')
+        parser.add_argument('--backfill', action='store_true',
+                            help='Queue every finished game that has no analysis')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Queue at most this many games with --backfill')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Games analysed at once, one process each (default: 1)')
+
+    def _queue(self, options):
+        for code in options['game']:
+            game = Game.objects.filter(code=code.upper()).first()
+            if game is None:
+                raise CommandError(f"No game {code}")
+            GameAnalysis.objects.update_or_create(game=game, defaults={'status': 'queued', 'attempts': 0})
+        if options['backfill']:
+            games = (Game.objects.filter(status='completed', move_count__gt=0, analysis__isnull=True)
+                     .order_by('pk').values_list('pk', flat=True))
+            if options['limit']:
+                games = games[:options['limit']]
+            jobs = GameAnalysis.objects.bulk_create([GameAnalysis(game_id=pk) for pk in games])
+            self.stdout.write(f"Queued {len(jobs)} games")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        self._queue(options)
+
+        depth, nodes = analysis.search_budget()
+        done = failed = positions = cached = 0
+        start = time.perf_counter()
+        with ProcessPoolExecutor(options['workers']) as pool:
+            running = {}
+            while True:
+                while len(running) < options['workers']:
+                    job = analysis.claim_job()
+                    if job is None:
+                        break
+                    try:
+                        job_plan = analysis.plan(job)
+                    except Exception as e:
+                        analysis.fail(job, e)
+                        failed += 1
+                        continue
+                    positions += len(job_plan.keys)
+                    cached += len(job_plan.keys) - len(job_plan.missing_keys)
+                    future = pool.submit(evaluate_positions, job_plan.missing_fens, depth, nodes)
+                    running[future] = (job, job_plan)
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job, job_plan = running.pop(future)
+                    try:
+                        analysis.finish(job, job_plan, future.result())
+                        done += 1
+                    except Exception as e:
+                        analysis.fail(job, e)
+                        failed += 1
+                        self.stderr.write(f"{job.game.code}: {e}")
+                self.stdout.write(f"{done} games analysed ({positions} positions, {cached} from the cache) "
+                                  f"- {done / (time.perf_counter() - start):.1f} games/s")
+
+        message = f"Analysed {done} games in {time.perf_counter() - start:.1f}s"
+        if failed:
+            message += f", {failed} failed"
+        self.stdout.write(self.style.SUCCESS(message))
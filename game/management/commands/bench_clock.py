@@ -0,0 +1,98 @@
+"""
+Clock arithmetic check and benchmark
+
+    python manage.py bench_clock
+    python manage.py bench_clock --iterations 50000
+
+Plays simulated moves with known thinking times through every time control
+and checks the clocks against the expected increment/delay results, then
+times the per-move clock work (update_timer_on_move and get_timer_state on
+an unsaved game) next to the old whole-second version of the same maths.
+No database access is needed.
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from game.clocks import TIME_CONTROLS, charge_move
+from game.models import Game, START_FEN
+
+# Thinking times (ms) for the simulated moves
+THINK_TIMES_MS = [1_250, 480, 9_999, 3_001, 15, 2_500, 700, 12_345]
+
+AFTER_WHITE_MOVE_FEN = 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1'
+
+
+def new_game(time_control):
+    tc = TIME_CONTROLS[time_control]
+    return Game(
+        code='BENCH', fen=AFTER_WHITE_MOVE_FEN, status='active', time_control=time_control,
+        white_time_ms=tc.base_ms, black_time_ms=tc.base_ms,
+    )
+
+
+def legacy_update_timer(game, now):
+    """Whole-second clock update as done before millisecond clocks"""
+    elapsed = int((now - game.last_move_time).total_seconds())
+    remaining = game.white_time_ms // 1000 - elapsed
+    return max(0, remaining)
+
+
+class Command(BaseCommand):
+    help = 'Check clock increment/delay maths and time the per-move clock update'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000,
+                            help='Moves timed per benchmark (default: 20000)')
+
+    def handle(self, *args, **options):
+        failures = 0
+        for name, tc in TIME_CONTROLS.items():
+            game = new_game(name)
+            expected = tc.base_ms
+            for think_ms in THINK_TIMES_MS:
+                game.status = 'active'
+                game.last_move_time = timezone.now() - timedelta(milliseconds=think_ms)
+                spent = game.update_timer_on_move(save=False)
+                expected = charge_move(tc, expected, spent)
+                if spent < think_ms or spent > think_ms + 50:
+                    failures += 1
+                    self.stdout.write(self.style.ERROR(f"{name}: measured {spent}ms for a {think_ms}ms move"))
+            if game.white_time_ms != expected:
+                failures += 1
+                self.stdout.write(self.style.ERROR(
+                    f"{name}: white clock {game.white_time_ms}ms, expected {expected}ms"
+                ))
+            else:
+                self.stdout.write(f"{name:<17} {tc.base_ms:>9}ms +{tc.increment_ms}ms "
+                                  f"delay {tc.delay_ms}ms -> {game.white_time_ms}ms  "
+                                  + self.style.SUCCESS('ok'))
+
+        iterations = options['iterations']
+        game = new_game('blitz_3_2')
+        game.last_move_time = timezone.now()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            legacy_update_timer(game, timezone.now())
+        legacy_us = (time.perf_counter() - start) / iterations * 1e6
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            game.white_time_ms = 180_000
+            game.update_timer_on_move(save=False)
+        update_us = (time.perf_counter() - start) / iterations * 1e6
+
+        game.fen = START_FEN
+        start = time.perf_counter()
+        for _ in range(iterations):
+            game.get_timer_state()
+        state_us = (time.perf_counter() - start) / iterations * 1e6
+
+        self.stdout.write(f"legacy seconds update  : {legacy_us:6.2f} µs/move")
+        self.stdout.write(f"update_timer_on_move   : {update_us:6.2f} µs/move")
+        self.stdout.write(f"get_timer_state        : {state_us:6.2f} µs/call")
+
+        if failures:
+            raise CommandError(f"{failures} clock check(s) failed")
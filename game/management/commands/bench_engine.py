@@ -0,0 +1,74 @@
+"""
+Computer opponent benchmark
+
+    python manage.py bench_engine                  # fixed depth on every position
+    python manage.py bench_engine --depth 5 --position middlegame
+    python manage.py bench_engine --level 4        # a strength level's budgets
+
+Searches a fixed set of positions in this process (not the engine pool)
+with a fresh transposition table each, and reports nodes, time, nodes per
+second and the move chosen. Fixed-depth runs search the same tree every
+time, so their node counts only change when the search itself does and
+their nps tracks the engine's speed.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game.board import Board, START_FEN
+from game.search import LEVELS, Searcher
+
+BENCH_POSITIONS = {
+    'start': START_FEN,
+    'kiwipete': 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    'middlegame': 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+    'tactics': 'r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4',
+    'endgame': '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+}
+
+DEFAULT_DEPTH = 4
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the computer opponent search on fixed positions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', type=int, default=None,
+                            help='Search depth (default: %d)' % DEFAULT_DEPTH)
+        parser.add_argument('--time', type=int, default=None,
+                            help='Time budget per position in milliseconds')
+        parser.add_argument('--level', type=int, choices=sorted(LEVELS),
+                            help="Use a strength level's depth, node and time budgets")
+        parser.add_argument('--position', choices=sorted(BENCH_POSITIONS),
+                            help='Only search one position')
+
+    def handle(self, *args, **options):
+        if options['level']:
+            depth, nodes, time_ms = LEVELS[options['level']]
+        else:
+            depth, nodes, time_ms = DEFAULT_DEPTH, None, None
+        if options['depth'] is not None:
+            depth = options['depth']
+        if options['time'] is not None:
+            time_ms = options['time']
+        if depth < 1:
+            raise CommandError('--depth must be at least 1')
+
+        names = [options['position']] if options['position'] else list(BENCH_POSITIONS)
+        total_nodes = 0
+        total_time = 0.0
+        for name in names:
+            board = Board(BENCH_POSITIONS[name])
+            start = time.perf_counter()
+            result = Searcher(board).search(depth=depth, nodes=nodes, time_ms=time_ms)
+            elapsed = time.perf_counter() - start
+            total_nodes += result.nodes
+            total_time += elapsed
+            nps = result.nodes / elapsed if elapsed else 0
+            self.stdout.write(
+                f"{name:<10} depth {result.depth:>2}: {result.nodes:>9} nodes  {elapsed:7.2f}s  "
+                f"{nps:>9,.0f} nps  {result.san:<7} ({result.score:+d})  {' '.join(result.pv)}"
+            )
+
+        if total_time:
+            self.stdout.write(f"total: {total_nodes} nodes, {total_nodes / total_time:,.0f} nps")
@@ -0,0 +1,148 @@
+"""
+Tournament pairing check and benchmark
+
+    python manage.py bench_tournament
+    python manage.py bench_tournament --players 500 --rounds 9
+    python manage.py bench_tournament --format round_robin --players 12
+
+Plays a simulated tournament in memory: each round is paired, times the
+pairing, gives every game a random result weighted by seed, and applies the
+results with the same incremental standings updates the server uses. At
+the end the pairings are checked for rematches and colour balance, and the
+incremental Buchholz / Sonneborn-Berger values are compared with a full
+recomputation. No database access is needed.
+"""
+import random
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game.tournaments import (
+    BYE_POINTS, POINTS, PairingPlayer, _add_score, _opponents, berger_rounds, swiss_pairings,
+)
+
+
+def _random_result(white_seed, black_seed):
+    """Result with the better seed more likely to win"""
+    edge = (black_seed - white_seed) / (white_seed + black_seed) / 2
+    roll = random.random()
+    if roll < 0.45 + edge:
+        return '1-0'
+    if roll < 0.65 + edge:
+        return '1/2-1/2'
+    return '0-1'
+
+
+class Command(BaseCommand):
+    help = 'Simulate a tournament in memory: time the pairings and check them and the tiebreaks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=500, help='Number of players (default: 500)')
+        parser.add_argument('--rounds', type=int, default=9, help='Swiss rounds (default: 9)')
+        parser.add_argument('--format', choices=['swiss', 'round_robin'], default='swiss')
+        parser.add_argument('--seed', type=int, help='Random seed')
+
+    def handle(self, *args, **options):
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+        count = options['players']
+        if count < 2:
+            raise CommandError('Need at least 2 players')
+
+        entries = {i: SimpleNamespace(seed=i, score=0.0, buchholz=0.0, sonneborn_berger=0.0)
+                   for i in range(1, count + 1)}
+        rows = []          # (white, black, result) for every board played so far
+        colours = {i: '' for i in entries}
+        byes = set()
+        schedule = berger_rounds(count) if options['format'] == 'round_robin' else None
+        rounds = len(schedule) if schedule else options['rounds']
+
+        timings = []
+        for number in range(1, rounds + 1):
+            start = time.perf_counter()
+            if schedule:
+                pairs = [(None if w is None else w + 1, None if b is None else b + 1)
+                         for w, b in schedule[number - 1]]
+                pairs = [(w, b) if w is not None else (b, None) for w, b in pairs]
+            else:
+                opponents = _opponents(rows)
+                players = [
+                    PairingPlayer(i, entry.seed, entry.score, colours[i],
+                                  (o for o, _ in opponents.get(i, ())), i in byes)
+                    for i, entry in entries.items()
+                ]
+                boards, bye = swiss_pairings(players)
+                pairs = [(white.id, black.id) for white, black in boards]
+                if bye is not None:
+                    pairs.append((bye.id, None))
+            timings.append(time.perf_counter() - start)
+
+            # Start the round: new opponents' scores join the Buchholz, byes score
+            rows.extend((white, black, '') for white, black in pairs)
+            opponents = _opponents(rows)
+            for white, black in pairs:
+                if black is None:
+                    byes.add(white)
+                    _add_score(entries, opponents, white, BYE_POINTS)
+                else:
+                    colours[white] += 'w'
+                    colours[black] += 'b'
+                    entries[white].buchholz += entries[black].score
+                    entries[black].buchholz += entries[white].score
+
+            # Finish the games one at a time, as the server does
+            for index in range(len(rows) - len(pairs), len(rows)):
+                white, black, _ = rows[index]
+                if black is None:
+                    continue
+                result = _random_result(white, black)
+                opponents = _opponents(row for row in rows if row[0] in (white, black) or row[1] in (white, black))
+                white_points, black_points = POINTS[result]
+                _add_score(entries, opponents, white, white_points)
+                _add_score(entries, opponents, black, black_points)
+                entries[white].sonneborn_berger += white_points * entries[black].score
+                entries[black].sonneborn_berger += black_points * entries[white].score
+                rows[index] = (white, black, result)
+
+        self._check(entries, rows, colours)
+        timings_ms = [t * 1000 for t in timings]
+        self.stdout.write(f"{options['format']}: {count} players, {rounds} rounds")
+        self.stdout.write(f"Pairing time per round: mean {sum(timings_ms) / len(timings_ms):.1f}ms, "
+                          f"max {max(timings_ms):.1f}ms")
+        leaders = sorted(entries.items(), key=lambda item: (-item[1].score, -item[1].buchholz,
+                                                            -item[1].sonneborn_berger, item[1].seed))[:5]
+        for player, entry in leaders:
+            self.stdout.write(f"  seed {player:<5} {entry.score:4.1f}  Bh {entry.buchholz:5.1f}  "
+                              f"SB {entry.sonneborn_berger:6.2f}")
+
+    def _check(self, entries, rows, colours):
+        seen = set()
+        rematches = 0
+        for white, black, _ in rows:
+            if black is None:
+                continue
+            pair = frozenset((white, black))
+            rematches += pair in seen
+            seen.add(pair)
+        worst_balance = max(abs(c.count('w') - c.count('b')) for c in colours.values())
+        three_in_a_row = sum(('www' in c) or ('bbb' in c) for c in colours.values())
+        self.stdout.write(f"Rematches: {rematches}  worst colour imbalance: {worst_balance}  "
+                          f"players with 3 same colours in a row: {three_in_a_row}")
+
+        # Full recomputation of the tiebreaks from the final results
+        results = {i: [] for i in entries}
+        for white, black, result in rows:
+            if black is None:
+                continue
+            white_points, black_points = POINTS[result]
+            results[white].append((black, white_points))
+            results[black].append((white, black_points))
+        for player, entry in entries.items():
+            buchholz = sum(entries[o].score for o, _ in results[player])
+            sonneborn_berger = sum(points * entries[o].score for o, points in results[player])
+            if abs(buchholz - entry.buchholz) > 1e-9 or abs(sonneborn_berger - entry.sonneborn_berger) > 1e-9:
+                raise CommandError(f"Tiebreak mismatch for player {player}: "
+                                   f"{entry.buchholz}/{entry.sonneborn_berger} "
+                                   f"expected {buchholz}/{sonneborn_berger}")
+        self.stdout.write(self.style.SUCCESS('Incremental tiebreaks match a full recomputation'))
@@ -0,0 +1,186 @@
+"""
+Import games from PGN files
+
+    python manage.py import_pgn club-2019.pgn club-2020.pgn
+    python manage.py import_pgn archive.pgn --workers 4 --batch-size 2000
+    zcat archive.pgn.gz | python manage.py import_pgn -
+
+Games are read as a stream, replayed on the server Board (an illegal or
+ambiguous move skips the game and is reported) and written with
+bulk_create, one transaction per batch, so an interrupted import keeps
+every batch it finished. With --workers, parsing and replaying run in
+that many processes while this one does all the writing.
+
+Players whose name matches a username (ignoring case) are linked to that
+user; everyone else is stored as a guest name. Imported games are
+unrated and don't change anyone's statistics, but finished ones are added
+to the opening explorer.
+"""
+import multiprocessing
+import sys
+import time
+from collections import deque
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from game import explorer, stats
+from game.models import Game, Move, User
+from game.pgn import parse_games, read_games
+from game.services import new_game_codes
+
+GUEST_NAME_LENGTH = 50
+
+# Move columns in the order of the rows built by _write (ImportedGame.moves
+# plus the game, number, colour and timestamp)
+MOVE_FIELDS = ['game', 'move_number', 'player_color', 'move_san', 'move_from', 'move_to',
+               'captured_piece', 'fen_after', 'time_spent_ms', 'clock_ms', 'timestamp']
+
+
+def _move_insert_sql():
+    quote = connection.ops.quote_name
+    return 'INSERT INTO %s (%s) VALUES (%s)' % (
+        quote(Move._meta.db_table),
+        ', '.join(quote(Move._meta.get_field(name).column) for name in MOVE_FIELDS),
+        ', '.join(['%s'] * len(MOVE_FIELDS)),
+    )
+
+
+class Command(BaseCommand):
+    help = 'Import games from PGN files (use - for standard input)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='PGN files to import')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Games written per transaction (default: 1000)')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Processes that parse games while this one writes (default: none)')
+
+    def _read(self, paths, batch_size):
+        """Batches of (headers, movetext) pairs from all the files, in order"""
+        batch = []
+        for path in paths:
+            stream = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', errors='replace')
+            with stream:
+                for game in read_games(stream):
+                    batch.append(game)
+                    if len(batch) == batch_size:
+                        yield batch
+                        batch = []
+        if batch:
+            yield batch
+
+    def _parsed(self, batches, workers):
+        """(games, errors) for each batch in file order, parsed here or by a pool of processes"""
+        if not workers:
+            for batch in batches:
+                yield parse_games(batch)
+            return
+        with multiprocessing.Pool(workers) as pool:
+            # Keep a few batches in flight per worker so reading stays ahead
+            # of writing without holding the whole file in memory
+            pending = deque()
+            for batch in batches:
+                pending.append(pool.apply_async(parse_games, (batch,)))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+
+    def _player(self, name, users):
+        """(user id, guest name, rating) for a PGN player name"""
+        user = users.get(name.lower())
+        if user:
+            user_id, rating = user
+            return user_id, None, rating
+        return None, name[:GUEST_NAME_LENGTH] or None, None
+
+    def _write(self, parsed, users):
+        """Insert one batch of games and their moves in a single transaction"""
+        codes = new_game_codes(len(parsed))
+        games = []
+        explorer_games = []
+        for code, imported in zip(codes, parsed):
+            white_id, white_guest, white_rating = self._player(imported.headers.get('White', ''), users)
+            black_id, black_guest, black_rating = self._player(imported.headers.get('Black', ''), users)
+            sans = [move[0] for move in imported.moves]
+            explorer_games.append((explorer.game_entries(imported.hashes, sans), imported.winner,
+                                   *explorer.player_ratings(white_rating, black_rating)))
+            games.append(Game(
+                code=code,
+                fen=imported.fen,
+                status='completed' if imported.winner else 'abandoned',
+                white_player_id=white_id,
+                black_player_id=black_id,
+                white_guest_name=white_guest,
+                black_guest_name=black_guest,
+                time_control=imported.time_control,
+                is_rated=False,
+                white_time_ms=imported.white_time_ms,
+                black_time_ms=imported.black_time_ms,
+                winner=imported.winner,
+                result_reason=imported.result_reason,
+                move_data=imported.move_data,
+                move_count=len(sans),
+                state_version=1,
+                started_at=imported.started_at,
+                completed_at=imported.started_at,
+            ))
+
+        # Games go through bulk_create (their ids are needed for the moves);
+        # the moves, dozens per game, are written with a plain executemany,
+        # which skips the per-field preparation bulk_create does for each row
+        timestamp = connection.ops.adapt_datetimefield_value(timezone.now())
+        with transaction.atomic(), connection.cursor() as cursor:
+            Game.objects.bulk_create(games)
+            moves = [
+                (game.pk, number, 'white' if number % 2 else 'black') + move + (timestamp,)
+                for game, imported in zip(games, parsed)
+                for number, move in enumerate(imported.moves, 1)
+            ]
+            cursor.executemany(_move_insert_sql(), moves)
+            explorer.add_games(explorer_games)
+        return games, len(moves)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['workers'] < 0:
+            raise CommandError('--workers cannot be negative')
+        for path in options['files']:
+            if path != '-':
+                try:
+                    open(path).close()
+                except OSError as e:
+                    raise CommandError(f"Can't read {path}: {e}")
+
+        users = {
+            username.lower(): (pk, rating)
+            for username, pk, rating in User.objects.values_list('username', 'pk', 'rating_points')
+        }
+        linked_users = set()
+        imported = skipped = move_count = 0
+        start = time.perf_counter()
+
+        batches = self._read(options['files'], options['batch_size'])
+        for parsed, errors in self._parsed(batches, options['workers']):
+            for error in errors:
+                self.stderr.write(f"Skipped {error}")
+            skipped += len(errors)
+            if parsed:
+                games, moves = self._write(parsed, users)
+                imported += len(games)
+                move_count += moves
+                for game in games:
+                    linked_users.update((game.white_player_id, game.black_player_id))
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{imported} games, {move_count} moves imported ({skipped} skipped) "
+                              f"- {imported / elapsed:.0f} games/s")
+
+        stats.invalidate('total_games')
+        stats.invalidate_user_games(*linked_users)
+        message = f"Imported {imported} games with {move_count} moves in {time.perf_counter() - start:.1f}s"
+        if skipped:
+            message += f", skipped {skipped}"
+        self.stdout.write(self.style.SUCCESS(message))
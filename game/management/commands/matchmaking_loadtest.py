@@ -0,0 +1,120 @@
+"""
+Matchmaking load test
+
+    python manage.py matchmaking_loadtest
+    python manage.py matchmaking_loadtest --seekers 1000 --threads 64 --spread 10 --cleanup
+
+Creates throwaway players (loadtest_<n>) with random ratings, sends their
+seeks into the matchmaking pool from a thread pool (all at once, or spread
+over --spread seconds) with the clock scheduler running, and reports how
+long players waited to be paired and how many games were created. Games
+are really created, so use a development database; --cleanup deletes the
+players and their games afterwards.
+"""
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+
+from game.clocks import DEFAULT_TIME_CONTROL, TIME_CONTROLS
+from game.matchmaking import SEEK_IDLE_SECONDS, matchmaking
+from game.models import Game, User
+from game.scheduler import scheduler
+
+USERNAME_PREFIX = 'loadtest_'
+POLL_INTERVAL = 0.01
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = 'Simulate many players seeking games at once and report matchmaking latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seekers', type=int, default=500, help='Number of players (default: 500)')
+        parser.add_argument('--time-control', default=DEFAULT_TIME_CONTROL, choices=sorted(TIME_CONTROLS))
+        parser.add_argument('--threads', type=int, default=32, help='Concurrent seekers (default: 32)')
+        parser.add_argument('--spread', type=float, default=0.0,
+                            help='Seconds over which seeks arrive (default: all at once)')
+        parser.add_argument('--rating-spread', type=float, default=300.0,
+                            help='Standard deviation of player ratings around 1200 (default: 300)')
+        parser.add_argument('--cleanup', action='store_true', help='Delete the test players and games afterwards')
+
+    def _players(self, count, rating_spread):
+        existing = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+        if existing:
+            raise CommandError(f"{existing} {USERNAME_PREFIX}* users already exist; run with --cleanup first")
+        users = [
+            User(username=f'{USERNAME_PREFIX}{i}', matric_number=f'9{i:010d}', department='OTHER',
+                 password='!', rating_points=random.gauss(1200, rating_spread))
+            for i in range(count)
+        ]
+        User.objects.bulk_create(users, batch_size=500)
+        return list(User.objects.filter(username__startswith=USERNAME_PREFIX))
+
+    def _seek(self, user, time_control, delay, deadline):
+        """Seek and wait for a match; returns seconds until paired, or None"""
+        try:
+            time.sleep(delay)
+            start = time.perf_counter()
+            if matchmaking.seek(user, time_control) is None:
+                while matchmaking.status(user.pk)['status'] == 'waiting':
+                    if time.perf_counter() > deadline:
+                        matchmaking.cancel(user.pk)
+                        return None
+                    time.sleep(POLL_INTERVAL)
+                if matchmaking.status(user.pk)['status'] != 'matched':
+                    return None
+            return time.perf_counter() - start
+        finally:
+            connection.close()
+
+    def handle(self, *args, **options):
+        seekers = options['seekers']
+        if seekers < 2:
+            raise CommandError('Need at least 2 seekers')
+
+        players = self._players(seekers, options['rating_spread'])
+        random.shuffle(players)
+        self.stdout.write(f"Created {len(players)} players; seeking {options['time_control']} "
+                          f"with {options['threads']} threads")
+
+        scheduler.start()
+        games_before = Game.objects.count()
+        deadline = time.perf_counter() + options['spread'] + SEEK_IDLE_SECONDS
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            latencies = list(pool.map(
+                lambda user: self._seek(user, options['time_control'],
+                                        random.uniform(0, options['spread']), deadline),
+                players,
+            ))
+        elapsed = time.perf_counter() - start
+        for user in players:
+            matchmaking.cancel(user.pk)
+
+        matched = sorted(latency for latency in latencies if latency is not None)
+        games = Game.objects.filter(white_player__username__startswith=USERNAME_PREFIX).count()
+        self.stdout.write(f"Paired {len(matched)}/{len(players)} players into {games} games "
+                          f"({Game.objects.count() - games_before} created) in {elapsed:.2f}s")
+        if matched:
+            self.stdout.write(
+                f"Time to pair: p50 {_percentile(matched, 0.5) * 1000:.1f}ms  "
+                f"p95 {_percentile(matched, 0.95) * 1000:.1f}ms  "
+                f"max {matched[-1] * 1000:.1f}ms  mean {statistics.mean(matched) * 1000:.1f}ms"
+            )
+
+        if options['cleanup']:
+            test_players = Q(white_player__username__startswith=USERNAME_PREFIX) | Q(
+                black_player__username__startswith=USERNAME_PREFIX)
+            deleted_games, _ = Game.objects.filter(test_players).delete()
+            deleted_users, _ = User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+            self.stdout.write(f"Deleted {deleted_games} objects with the test games and "
+                              f"{deleted_users} with the players")
+        self.stdout.write(self.style.SUCCESS('Done'))
@@ -0,0 +1,124 @@
+"""
+Move generator benchmark and correctness check
+
+    python manage.py perft                 # all positions, default depths
+    python manage.py perft --depth 4 --position kiwipete
+
+Counts leaf nodes for the standard perft positions, compares them with the
+published results and reports nodes per second. It also times the
+api_game_move hot path (parse FEN, validate a UCI move, make it, check
+for game end), which should stay under 100µs for ordinary moves and
+under 150µs for a mate (see game/board.py).
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game.board import Board, START_FEN, perft
+
+# name: (fen, {depth: expected nodes})
+PERFT_POSITIONS = {
+    'start': (START_FEN, {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    'kiwipete': (
+        'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+        {1: 48, 2: 2039, 3: 97862, 4: 4085603},
+    ),
+    'position3': (
+        '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+        {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624},
+    ),
+    'position4': (
+        'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+        {1: 6, 2: 264, 3: 9467, 4: 422333},
+    ),
+    'position5': (
+        'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+        {1: 44, 2: 1486, 3: 62379, 4: 2103487},
+    ),
+    'position6': (
+        'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+        {1: 46, 2: 2079, 3: 89890, 4: 3894594},
+    ),
+}
+
+DEFAULT_DEPTH = 3
+HOT_PATH_ROUNDS = 5
+
+# (fen, uci) pairs timed for the move hot path: a quiet opening move,
+# castling in a busy middlegame, and a mate (every reply has to be tried)
+HOT_PATH_MOVES = [
+    (START_FEN, 'e2e4'),
+    ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', 'e1g1'),
+    ('r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5Q2/PPPP1PPP/RNB1K1NR w KQkq - 2 3', 'f3f7'),
+]
+
+
+def apply_move(fen, uci):
+    """Same work api_game_move does per move"""
+    board = Board(fen)
+    move = board.parse_uci(uci)
+    san = board.san(move)
+    board.push(move)
+    return board.fen(), san, board.outcome()
+
+
+class Command(BaseCommand):
+    help = 'Run perft on the standard positions to check and benchmark move generation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH,
+                            help='Search depth (default: %d)' % DEFAULT_DEPTH)
+        parser.add_argument('--position', choices=sorted(PERFT_POSITIONS),
+                            help='Only run one position')
+        parser.add_argument('--iterations', type=int, default=2000,
+                            help='Iterations for the move hot-path timing')
+
+    def handle(self, *args, **options):
+        depth = options['depth']
+        names = [options['position']] if options['position'] else list(PERFT_POSITIONS)
+        failures = 0
+        total_nodes = 0
+        total_time = 0.0
+
+        for name in names:
+            fen, expected = PERFT_POSITIONS[name]
+            board = Board(fen)
+            start = time.perf_counter()
+            nodes = perft(board, depth)
+            elapsed = time.perf_counter() - start
+            total_nodes += nodes
+            total_time += elapsed
+
+            if board.fen() != fen.strip() or board.hash != board.compute_hash():
+                raise CommandError(f"{name}: board not restored after make/unmake")
+
+            want = expected.get(depth)
+            if want is None:
+                verdict = 'unchecked'
+            elif want == nodes:
+                verdict = self.style.SUCCESS('ok')
+            else:
+                verdict = self.style.ERROR(f'FAIL (expected {want})')
+                failures += 1
+            nps = nodes / elapsed if elapsed else 0
+            self.stdout.write(
+                f"{name:<10} depth {depth}: {nodes:>9} nodes  {elapsed:7.2f}s  {nps:>9,.0f} nps  {verdict}"
+            )
+
+        if total_time:
+            self.stdout.write(f"total: {total_nodes} nodes, {total_nodes / total_time:,.0f} nps")
+
+        # Best of a few rounds, so a busy machine doesn't swamp the figure
+        iterations = options['iterations']
+        for fen, uci in HOT_PATH_MOVES:
+            best = float('inf')
+            for _ in range(HOT_PATH_ROUNDS):
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    apply_move(fen, uci)
+                best = min(best, time.perf_counter() - start)
+            per_move = best / iterations * 1e6
+            self.stdout.write(f"move hot path {uci:<5}: {per_move:6.1f} µs/move")
+
+        if failures:
+            raise CommandError(f"{failures} perft position(s) failed")
@@ -0,0 +1,39 @@
+"""
+Rebuild the opening explorer index
+
+    python manage.py rebuild_explorer
+    python manage.py rebuild_explorer --chunk-size 5000
+
+Empties PositionMove and replays the first EXPLORER_MAX_PLY moves of every
+finished game into it, in one transaction. Finished games are indexed as
+they end (and by import_pgn), so this is only needed after changing
+EXPLORER_MAX_PLY or for games that finished before the index existed.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game import explorer
+from game.models import PositionMove
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the opening explorer index from every finished game'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=explorer.REBUILD_CHUNK_SIZE,
+                            help=f'Games merged per write (default: {explorer.REBUILD_CHUNK_SIZE})')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        start = time.perf_counter()
+
+        def progress(done):
+            self.stdout.write(f"{done} games indexed - {done / (time.perf_counter() - start):.0f} games/s")
+
+        games = explorer.rebuild(chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {games} games into {PositionMove.objects.count()} position/move rows "
+            f"in {time.perf_counter() - start:.1f}s"
+        ))
@@ -0,0 +1,130 @@
+"""
+Recompute every rating from the game history
+
+    python manage.py recompute_ratings
+    python manage.py recompute_ratings --system elo --dry-run
+
+Replays all completed rated games in the order they finished, in one pass
+over the games table, with ratings and game counters kept in memory, then
+writes every user back in batches and rebuilds the rating history. Use it after changing the rating rules
+(RATING_SYSTEM, K-factors, minimum games...).
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+
+from game.models import Game, RatingHistory, User
+from game.ranking import ranking
+from game.rating import NEW_PLAYER, RATING_SYSTEMS, RESULTS, get_rating_system, published_rating
+
+HISTORY_FIELDS = ('user', 'game', 'recorded_at', 'rating', 'deviation')
+
+# Per player counters: total, wins, losses, draws, current streak, longest streak
+NO_GAMES = (0, 0, 0, 0, 0, 0)
+
+
+def _add_result(counters, result):
+    total, wins, losses, draws, streak, longest = counters
+    if result == 'win':
+        streak += 1
+        return total + 1, wins + 1, losses, draws, streak, max(longest, streak)
+    if result == 'loss':
+        return total + 1, wins, losses + 1, draws, 0, longest
+    return total + 1, wins, losses, draws + 1, 0, longest
+
+
+class Command(BaseCommand):
+    help = 'Replay all completed rated games and recompute ratings, rating history and game counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--system', choices=sorted(RATING_SYSTEMS),
+                            help='Rating system (default: MTU_CHESS_CONFIG RATING_SYSTEM)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Users per UPDATE batch (default: 1000)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Show the new top ratings without saving')
+
+    def handle(self, *args, **options):
+        system = get_rating_system(options['system'])
+        start = time.perf_counter()
+
+        games = (
+            Game.objects.filter(
+                status='completed', is_rated=True, winner__in=list(RESULTS),
+                white_player__isnull=False, black_player__isnull=False,
+            )
+            .exclude(white_player=F('black_player'))
+            .order_by('completed_at', 'pk')
+            .values_list('pk', 'completed_at', 'white_player_id', 'black_player_id', 'winner')
+        )
+        ratings = {}
+        counters = {}
+        history = []
+        played = 0
+        for game_id, completed_at, white_id, black_id, winner in games.iterator(chunk_size=5000):
+            white_score, white_result, black_result = RESULTS[winner]
+            new_white, new_black = system.rate(
+                ratings.get(white_id, NEW_PLAYER), ratings.get(black_id, NEW_PLAYER), white_score
+            )
+            ratings[white_id] = new_white
+            ratings[black_id] = new_black
+            counters[white_id] = _add_result(counters.get(white_id, NO_GAMES), white_result)
+            counters[black_id] = _add_result(counters.get(black_id, NO_GAMES), black_result)
+            history.append((white_id, game_id, completed_at, new_white))
+            history.append((black_id, game_id, completed_at, new_black))
+            played += 1
+
+        replay_time = time.perf_counter() - start
+        self.stdout.write(f"Replayed {played} games for {len(ratings)} players "
+                          f"with {system.name} in {replay_time:.2f}s")
+
+        if options['dry_run']:
+            top = sorted(ratings.items(), key=lambda item: -item[1].points)[:10]
+            names = User.objects.in_bulk([user_id for user_id, _ in top])
+            for user_id, rating in top:
+                self.stdout.write(f"  {names[user_id].username:<20} {rating.points:7.1f} "
+                                  f"±{rating.deviation:5.1f}  {rating.games} games")
+            return
+
+        # Users and history are written with plain executemany statements:
+        # much faster than bulk_update/bulk_create for every user and game
+        fields = ['rating', 'rating_assigned', 'rating_points', 'rating_deviation', 'rating_volatility',
+                  'total_games', 'wins', 'losses', 'draws', 'current_win_streak', 'longest_win_streak']
+        quote = connection.ops.quote_name
+        sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+            quote(User._meta.db_table),
+            ', '.join('%s = %%s' % quote(User._meta.get_field(name).column) for name in fields),
+            quote(User._meta.pk.column),
+        )
+        user_ids = list(User.objects.order_by('pk').values_list('pk', flat=True))
+        batch_size = options['batch_size']
+        with transaction.atomic(), connection.cursor() as cursor:
+            for offset in range(0, len(user_ids), batch_size):
+                rows = []
+                for user_id in user_ids[offset:offset + batch_size]:
+                    rating = ratings.get(user_id, NEW_PLAYER)
+                    published = published_rating(rating)
+                    rows.append((published, published is not None, rating.points, rating.deviation,
+                                 rating.volatility) + counters.get(user_id, NO_GAMES) + (user_id,))
+                cursor.executemany(sql, rows)
+
+            RatingHistory.objects.all().delete()
+            insert = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                quote(RatingHistory._meta.db_table),
+                ', '.join(quote(RatingHistory._meta.get_field(name).column) for name in HISTORY_FIELDS),
+                ', '.join(['%s'] * len(HISTORY_FIELDS)),
+            )
+            adapt_datetime = connection.ops.adapt_datetimefield_value
+            for offset in range(0, len(history), batch_size):
+                cursor.executemany(insert, [
+                    (user_id, game_id, adapt_datetime(recorded_at),
+                     int(round(rating.points)), int(round(rating.deviation)))
+                    for user_id, game_id, recorded_at, rating in history[offset:offset + batch_size]
+                ])
+
+        ranking.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated {len(user_ids)} users and {len(history)} rating history entries in {time.perf_counter() - start:.2f}s"
+        ))
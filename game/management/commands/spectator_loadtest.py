@@ -0,0 +1,160 @@
+"""
+Spectator fan-out load test
+
+    python manage.py spectator_loadtest
+    python manage.py spectator_loadtest --spectators 1000 --slow 50 --moves 40 --interval 0.2
+
+Opens --spectators WebSocket connections to one game in this process
+(through the real ASGI handler with in-memory sockets), plays --moves
+random moves through commit_move from another thread, and reports how
+long each move took to reach every fast spectator. --slow of the
+connections take --slow-delay seconds to accept each message, to show they
+don't hold up the others; --late more connect halfway through and must
+catch up from the snapshot and tail. A throwaway game is created and
+deleted afterwards, so use a development database.
+"""
+import asyncio
+import json
+import random
+import statistics
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from game.board import Board, move_to_uci
+from game.consumers import game_websocket
+from game.models import Game
+from game.services import commit_move, new_game_code
+from game.spectators import hub
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Spectator:
+    """An in-memory WebSocket client recording when each move arrives"""
+
+    def __init__(self, code, delay=0.0):
+        self.scope = {'type': 'websocket', 'path': f'/ws/game/{code}/', 'query_string': b''}
+        self.delay = delay
+        self.arrivals = {}
+        self.move_count = 0
+        self.snapshots = 0
+        self.closing = asyncio.Event()
+        self.connected = False
+
+    async def receive(self):
+        if not self.connected:
+            self.connected = True
+            return {'type': 'websocket.connect'}
+        await self.closing.wait()
+        return {'type': 'websocket.disconnect'}
+
+    async def send(self, message):
+        if message['type'] != 'websocket.send':
+            return
+        data = json.loads(message['text'])
+        if data['type'] == 'snapshot':
+            self.snapshots += 1
+        self.move_count = max(self.move_count, data.get('move_count', 0))
+        self.arrivals.setdefault(data.get('move_count', 0), time.perf_counter())
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+    def run(self):
+        return asyncio.ensure_future(game_websocket(self.scope, self.receive, self.send))
+
+
+def _play(code, moves, interval, sent):
+    """Play random legal moves, recording when each was submitted"""
+    rng = random.Random(1)
+    fen = Game.objects.get(code=code).fen
+    for number in range(1, moves + 1):
+        legal = Board(fen).legal_moves()
+        if not legal:
+            break
+        sent[number] = time.perf_counter()
+        game, _ = commit_move(code, uci=move_to_uci(rng.choice(legal)))
+        fen = game.fen
+        if game.status != 'active':
+            break
+        time.sleep(interval)
+    return len(sent)
+
+
+class Command(BaseCommand):
+    help = 'Simulate many spectators watching one game and report move fan-out latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spectators', type=int, default=1000, help='Fast spectators (default: 1000)')
+        parser.add_argument('--slow', type=int, default=50, help='Slow spectators (default: 50)')
+        parser.add_argument('--slow-delay', type=float, default=1.0,
+                            help='Seconds a slow spectator takes per message (default: 1.0)')
+        parser.add_argument('--late', type=int, default=100, help='Spectators joining halfway (default: 100)')
+        parser.add_argument('--moves', type=int, default=40, help='Moves to play (default: 40)')
+        parser.add_argument('--interval', type=float, default=0.2, help='Seconds between moves (default: 0.2)')
+
+    def handle(self, *args, **options):
+        if options['spectators'] < 1 or options['moves'] < 1:
+            raise CommandError('--spectators and --moves must be at least 1')
+        now = timezone.now()
+        game = Game.objects.create(
+            code=new_game_code(), status='active', time_control='unlimited', is_rated=False,
+            white_guest_name='Load test', black_guest_name='Load test',
+            white_time_ms=999_000_000, black_time_ms=999_000_000,
+            started_at=now, last_move_time=now, timer_last_updated=now,
+        )
+        try:
+            asyncio.run(self._run(game.code, options))
+        finally:
+            game.delete()
+
+    async def _run(self, code, options):
+        fast = [Spectator(code) for _ in range(options['spectators'])]
+        slow = [Spectator(code, options['slow_delay']) for _ in range(options['slow'])]
+        late = [Spectator(code) for _ in range(options['late'])]
+
+        start = time.perf_counter()
+        tasks = [spectator.run() for spectator in fast + slow]
+        while sum(1 for spectator in fast + slow if spectator.snapshots) < len(tasks):
+            await asyncio.sleep(0.01)
+        self.stdout.write(f"{len(tasks)} spectators connected in {time.perf_counter() - start:.2f}s "
+                          f"({hub.viewer_count(code)} on one broadcast)")
+
+        sent = {}
+        player = asyncio.ensure_future(sync_to_async(_play, thread_sensitive=False)(
+            code, options['moves'], options['interval'], sent))
+        while len(sent) < options['moves'] // 2 and not player.done():
+            await asyncio.sleep(0.01)
+        tasks += [spectator.run() for spectator in late]
+        played = await player
+        await asyncio.sleep(0.5)
+
+        latencies = sorted(
+            (spectator.arrivals[number] - submitted) * 1000
+            for spectator in fast for number, submitted in sent.items() if number in spectator.arrivals
+        )
+        missing = sum(1 for spectator in fast for number in sent if number not in spectator.arrivals)
+        if latencies:
+            self.stdout.write(
+                f"{played} moves to {len(fast)} fast spectators: "
+                f"p50 {statistics.median(latencies):.1f} ms, p99 {_percentile(latencies, 0.99):.1f} ms, "
+                f"max {latencies[-1]:.1f} ms (from commit_move to delivery), {missing} missed"
+            )
+        up_to_date = sum(1 for spectator in late if spectator.move_count == played)
+        self.stdout.write(f"late joiners up to date: {up_to_date}/{len(late)}")
+        if slow:
+            behind = [played - spectator.move_count for spectator in slow]
+            resyncs = sum(spectator.snapshots - 1 for spectator in slow)
+            self.stdout.write(f"slow spectators: up to {max(behind)} moves behind, {resyncs} snapshot resyncs")
+
+        for spectator in fast + slow + late:
+            spectator.closing.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.stdout.write(f"broadcasts left open: {hub.viewer_count(code)} viewers")
+
+        if missing:
+            raise CommandError(f"{missing} move deliveries missing")
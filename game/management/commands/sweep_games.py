@@ -0,0 +1,30 @@
+"""
+Abandon stale games and prune old game sessions
+
+    python manage.py sweep_games
+    python manage.py sweep_games --timeout 60 --batch-size 500
+
+Waiting/active games idle for longer than GAME_TIMEOUT_MINUTES become
+abandoned (or are completed on time if a clock has run out), and sessions
+of finished games past the activity window are deleted. See game/sweeper.py.
+"""
+from django.core.management.base import BaseCommand
+
+from game.sweeper import DEFAULT_BATCH_SIZE, sweep
+
+
+class Command(BaseCommand):
+    help = 'Mark stale games abandoned and delete old sessions of finished games'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timeout', type=int, default=None,
+                            help='Idle minutes before a game is stale (default: GAME_TIMEOUT_MINUTES)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Rows per UPDATE/DELETE (default: %d)' % DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        result = sweep(timeout_minutes=options['timeout'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Abandoned {result['abandoned']} game(s), flagged {result['timed_out']} on time, "
+            f"deleted {result['sessions_deleted']} session(s) in {result['seconds']}s"
+        ))
@@ -0,0 +1,261 @@
+"""
+Matchmaking
+
+Players looking for a game ("seeks") wait in an in-memory pool per time
+control, kept sorted by rating. A new seek is paired at once with the
+closest-rated waiting player inside the rating band; otherwise it waits
+and the background matcher (run on the clock scheduler every
+MATCH_INTERVAL seconds while anyone is waiting) retries as bands widen:
+
+    band = BASE_BAND + WIDEN_PER_SECOND * seconds waited, up to MAX_BAND
+
+Two seeks can be paired when their rating difference is within the wider
+of their two bands, so long waits are ended by whoever arrives next.
+
+Finding an opponent is a bisect into the sorted pool plus a short walk
+outwards; the game and both GameSession rows are created in one
+transaction outside the pool lock, and rolled back if either seek was
+cancelled meanwhile. Both players are told on the realtime
+channel 'seek:<user id>' (api_matchmaking_status long-polls it).
+
+Seeks that haven't been polled for SEEK_IDLE_SECONDS are dropped. The
+pool lives in one server process, like the state cache.
+"""
+import itertools
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left, insort
+
+from .realtime import get_channel_layer
+from .scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+BASE_BAND = 100
+WIDEN_PER_SECOND = 25
+MAX_BAND = 600
+MATCH_INTERVAL = 1.0
+SEEK_IDLE_SECONDS = 45
+MATCH_KEEP_SECONDS = 300
+
+
+def seek_channel(user_id):
+    return 'seek:%d' % user_id
+
+
+class Seek:
+    __slots__ = ('user_id', 'username', 'rating', 'time_control', 'session_key',
+                 'created', 'last_seen', 'seq')
+
+    def __init__(self, user, time_control, session_key, seq, now):
+        self.user_id = user.pk
+        self.username = user.username
+        self.rating = user.rating_points
+        self.time_control = time_control
+        self.session_key = session_key
+        self.created = now
+        self.last_seen = now
+        self.seq = seq
+
+    def band(self, now):
+        return min(MAX_BAND, BASE_BAND + WIDEN_PER_SECOND * (now - self.created))
+
+    @property
+    def entry(self):
+        return (self.rating, self.seq, self)
+
+
+class MatchmakingPool:
+    """Waiting seeks by time control, sorted by rating"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}    # time control -> sorted [(rating, seq, Seek)]
+        self._seeks = {}    # user id -> Seek
+        self._pairing = {}  # user id -> Seek whose game is being created
+        self._matches = {}  # user id -> (match info, monotonic time)
+        self._seq = itertools.count()
+
+    # -- pool maintenance (lock held) --
+
+    def _remove(self, user_id):
+        seek = self._seeks.pop(user_id, None)
+        if seek is not None:
+            entries = self._pools[seek.time_control]
+            del entries[bisect_left(entries, (seek.rating, seek.seq))]
+        return seek
+
+    def _add(self, seek):
+        self._seeks[seek.user_id] = seek
+        insort(self._pools.setdefault(seek.time_control, []), seek.entry)
+
+    def _take(self, *seeks):
+        """Move seeks from the pool to the pairing set"""
+        for seek in seeks:
+            self._remove(seek.user_id)
+            self._pairing[seek.user_id] = seek
+
+    def _find_opponent(self, seek, now):
+        """Closest-rated waiting seek that can be paired with `seek`, or None"""
+        entries = self._pools.get(seek.time_control)
+        if not entries:
+            return None
+        band = seek.band(now)
+        position = bisect_left(entries, (seek.rating,))
+        best = None
+        for step in (-1, 1):
+            i = position - 1 if step < 0 else position
+            while 0 <= i < len(entries):
+                rating, _, other = entries[i]
+                diff = abs(rating - seek.rating)
+                if diff > MAX_BAND:
+                    break
+                if (other is not seek and diff <= max(band, other.band(now))
+                        and now - other.last_seen <= SEEK_IDLE_SECONDS):
+                    if best is None or diff < abs(best.rating - seek.rating):
+                        best = other
+                    break
+                i += step
+        return best
+
+    # -- public API --
+
+    def seek(self, user, time_control, session_key=''):
+        """
+        Start looking for a game. Returns the match info if an opponent was
+        found straight away, else None (the player then waits in the pool).
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._remove(user.pk)
+            self._matches.pop(user.pk, None)
+            seek = Seek(user, time_control, session_key, next(self._seq), now)
+            opponent = self._find_opponent(seek, now)
+            if opponent is None:
+                self._add(seek)
+            else:
+                self._take(seek, opponent)
+        if opponent is None:
+            self._schedule_matcher()
+            return None
+        return self._pair(seek, opponent)
+
+    def cancel(self, user_id):
+        with self._lock:
+            cancelled = self._remove(user_id) or self._pairing.pop(user_id, None)
+            return cancelled is not None
+
+    def status(self, user_id):
+        """{'status': 'matched'|'waiting'|'idle', ...} for a player; counts as a poll"""
+        now = time.monotonic()
+        with self._lock:
+            match = self._matches.get(user_id)
+            if match is not None:
+                return dict(match[0], status='matched')
+            seek = self._seeks.get(user_id) or self._pairing.get(user_id)
+            if seek is None:
+                return {'status': 'idle'}
+            seek.last_seen = now
+            return {
+                'status': 'waiting',
+                'time_control': seek.time_control,
+                'waited': round(now - seek.created, 1),
+                'band': int(seek.band(now)),
+            }
+
+    def waiting_count(self, time_control=None):
+        with self._lock:
+            if time_control is None:
+                return len(self._seeks)
+            return len(self._pools.get(time_control, ()))
+
+    def match_waiting(self):
+        """Pair every waiting seek that now has an opponent in band (background matcher)"""
+        now = time.monotonic()
+        pairs = []
+        with self._lock:
+            for user_id, seek in list(self._seeks.items()):
+                if now - seek.last_seen > SEEK_IDLE_SECONDS:
+                    self._remove(user_id)
+            for user_id, (info, matched_at) in list(self._matches.items()):
+                if now - matched_at > MATCH_KEEP_SECONDS:
+                    del self._matches[user_id]
+            # Longest waiting first
+            for seek in sorted(self._seeks.values(), key=lambda s: s.created):
+                if seek.user_id not in self._seeks:
+                    continue
+                opponent = self._find_opponent(seek, now)
+                if opponent is not None:
+                    self._take(seek, opponent)
+                    pairs.append((seek, opponent))
+        for seek, opponent in pairs:
+            self._pair(seek, opponent)
+        self._schedule_matcher()
+
+    # -- pairing --
+
+    def _schedule_matcher(self):
+        with self._lock:
+            waiting = bool(self._seeks)
+        key = ('matchmaking',)
+        if not waiting:
+            scheduler.cancel(key)
+        elif scheduler.deadline(key) is None:
+            scheduler.schedule(key, time.time() + MATCH_INTERVAL, self.match_waiting)
+
+    def _pair(self, a, b):
+        """Create the game for two seeks; returns a's match info (None on failure)"""
+        from .services import create_matched_game
+
+        white, black = (a, b) if random.random() < 0.5 else (b, a)
+        infos = {}
+
+        def claim(game):
+            # Checked under the pool lock inside the game's transaction: a
+            # cancel either lands first (and the game is rolled back) or
+            # finds the seek already matched
+            with self._lock:
+                if any(self._pairing.get(seek.user_id) is not seek for seek in (a, b)):
+                    return False
+                now = time.monotonic()
+                infos[white.user_id] = {'code': game.code, 'color': 'white', 'opponent': black.username,
+                                        'time_control': game.time_control}
+                infos[black.user_id] = {'code': game.code, 'color': 'black', 'opponent': white.username,
+                                        'time_control': game.time_control}
+                for user_id, info in infos.items():
+                    del self._pairing[user_id]
+                    self._matches[user_id] = (info, now)
+                return True
+
+        try:
+            game = create_matched_game(
+                white.user_id, black.user_id, a.time_control,
+                white_session=white.session_key, black_session=black.session_key, confirm=claim,
+            )
+        except Exception:
+            logger.exception("Could not create a game for %s and %s", white.username, black.username)
+            game = None
+            with self._lock:
+                # Claimed but not committed: the match never happened
+                for seek in (a, b):
+                    if seek.user_id in infos:
+                        self._matches.pop(seek.user_id, None)
+                        self._pairing[seek.user_id] = seek
+        if game is None:
+            with self._lock:
+                # Back into the pool, unless cancelled meanwhile
+                for seek in (a, b):
+                    if self._pairing.get(seek.user_id) is seek:
+                        del self._pairing[seek.user_id]
+                        self._add(seek)
+            return None
+
+        layer = get_channel_layer()
+        for user_id, info in infos.items():
+            layer.publish(seek_channel(user_id), dict(info, type='matched'))
+        return infos[a.user_id]
+
+
+matchmaking = MatchmakingPool()
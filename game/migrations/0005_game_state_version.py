@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0004_alter_user_matric_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='state_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
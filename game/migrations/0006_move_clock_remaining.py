@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0005_game_state_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='move',
+            name='clock_remaining',
+            field=models.IntegerField(blank=True, help_text="Mover's clock (seconds) after the move", null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='move',
+            constraint=models.UniqueConstraint(fields=('game', 'move_number'), name='unique_move_number_per_game'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Rebuild Move rows for games recorded before moves were logged
+
+import json
+import logging
+
+from django.db import migrations
+
+from ._chess import Board, IllegalMoveError, move_to_uci
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_moves(apps, schema_editor):
+    Game = apps.get_model('game', 'Game')
+    Move = apps.get_model('game', 'Move')
+
+    games = Game.objects.exclude(move_history__in=['', '[]']).filter(moves__isnull=True)
+    for game in games.iterator():
+        try:
+            history = json.loads(game.move_history)
+        except ValueError:
+            continue
+
+        board = Board()
+        rows = []
+        for ply, san in enumerate(history, start=1):
+            try:
+                move = board.parse_san(san)
+            except IllegalMoveError:
+                logger.warning("Game %s: move %d (%r) doesn't parse; kept the %d moves before it",
+                               game.code, ply, san, ply - 1)
+                break
+            captured = board.captured_piece(move)
+            player_color = 'white' if ply % 2 else 'black'
+            board.push(move)
+            uci = move_to_uci(move)
+            rows.append(Move(
+                game_id=game.id,
+                move_number=ply,
+                player_color=player_color,
+                move_san=san,
+                move_from=uci[:2],
+                move_to=uci[2:4],
+                captured_piece=captured.lower() if captured else None,
+                fen_after=board.fen(),
+            ))
+        Move.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0006_move_clock_remaining'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_moves, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,76 @@
+# Store clocks in milliseconds and add increment/delay time controls
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def seconds_to_ms(apps, schema_editor):
+    Game = apps.get_model('game', 'Game')
+    Move = apps.get_model('game', 'Move')
+
+    Game.objects.update(white_time_ms=F('white_time_ms') * 1000,
+                        black_time_ms=F('black_time_ms') * 1000)
+    Game.objects.filter(time_control='classical_2_60').update(time_control='classical_60')
+    Move.objects.update(time_spent_ms=F('time_spent_ms') * 1000)
+    Move.objects.filter(clock_ms__isnull=False).update(clock_ms=F('clock_ms') * 1000)
+
+
+def ms_to_seconds(apps, schema_editor):
+    Game = apps.get_model('game', 'Game')
+    Move = apps.get_model('game', 'Move')
+
+    Game.objects.update(white_time_ms=F('white_time_ms') / 1000,
+                        black_time_ms=F('black_time_ms') / 1000)
+    Move.objects.update(time_spent_ms=F('time_spent_ms') / 1000)
+    Move.objects.filter(clock_ms__isnull=False).update(clock_ms=F('clock_ms') / 1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0007_backfill_moves'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='game',
+            old_name='white_time_remaining',
+            new_name='white_time_ms',
+        ),
+        migrations.RenameField(
+            model_name='game',
+            old_name='black_time_remaining',
+            new_name='black_time_ms',
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='white_time_ms',
+            field=models.BigIntegerField(default=300000),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='black_time_ms',
+            field=models.BigIntegerField(default=300000),
+        ),
+        migrations.RenameField(
+            model_name='move',
+            old_name='time_spent',
+            new_name='time_spent_ms',
+        ),
+        migrations.RenameField(
+            model_name='move',
+            old_name='clock_remaining',
+            new_name='clock_ms',
+        ),
+        migrations.AlterField(
+            model_name='move',
+            name='clock_ms',
+            field=models.BigIntegerField(blank=True, help_text="Mover's clock (milliseconds) after the move", null=True),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='time_control',
+            field=models.CharField(choices=[('bullet_1', '1 min (Bullet)'), ('bullet_1_1', '1+1 (Bullet)'), ('bullet_2', '2 min (Bullet)'), ('blitz_3', '3 min (Blitz)'), ('blitz_3_2', '3+2 (Blitz)'), ('blitz_5', '5 min (Blitz)'), ('blitz_5_d3', '5 min, 3s delay (Blitz)'), ('rapid_10', '10 min (Rapid)'), ('rapid_10_5', '10+5 (Rapid)'), ('rapid_15', '15 min (Rapid)'), ('rapid_15_10', '15+10 (Rapid)'), ('classical_30', '30 min (Classical)'), ('classical_30_d10', '30 min, 10s delay (Classical)'), ('classical_60', '60 min (Classical)'), ('unlimited', 'Unlimited')], default='blitz_5', max_length=20),
+        ),
+        migrations.RunPython(seconds_to_ms, ms_to_seconds),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0008_millisecond_clocks'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='rating',
+            field=models.IntegerField(blank=True, db_index=True, default=None, help_text='ELO rating - assigned after 5 games', null=True),
+        ),
+    ]
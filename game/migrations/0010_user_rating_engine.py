@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:50
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def keep_current_ratings(apps, schema_editor):
+    # Start the rating engine from each player's current rating; run
+    # `manage.py recompute_ratings` to rebuild everything from game history
+    User = apps.get_model('game', 'User')
+    User.objects.filter(rating__isnull=False).update(rating_points=F('rating'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0009_user_rating_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='rating_deviation',
+            field=models.FloatField(default=350.0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='rating_points',
+            field=models.FloatField(default=1000.0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='rating_volatility',
+            field=models.FloatField(default=0.06),
+        ),
+        migrations.RunPython(keep_current_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0010_user_rating_engine'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recorded_at', models.DateTimeField()),
+                ('rating', models.IntegerField()),
+                ('deviation', models.PositiveSmallIntegerField()),
+                ('game', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='game.game')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='rating_history', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['recorded_at'],
+                'indexes': [models.Index(fields=['user', 'recorded_at', 'rating'], name='rating_history_user_time')],
+            },
+        ),
+    ]
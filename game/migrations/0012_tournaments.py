@@ -0,0 +1,101 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0011_rating_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tournament',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('format', models.CharField(choices=[('swiss', 'Swiss'), ('round_robin', 'Round robin')], default='swiss', max_length=20)),
+                ('time_control', models.CharField(choices=[('bullet_1', '1 min (Bullet)'), ('bullet_1_1', '1+1 (Bullet)'), ('bullet_2', '2 min (Bullet)'), ('blitz_3', '3 min (Blitz)'), ('blitz_3_2', '3+2 (Blitz)'), ('blitz_5', '5 min (Blitz)'), ('blitz_5_d3', '5 min, 3s delay (Blitz)'), ('rapid_10', '10 min (Rapid)'), ('rapid_10_5', '10+5 (Rapid)'), ('rapid_15', '15 min (Rapid)'), ('rapid_15_10', '15+10 (Rapid)'), ('classical_30', '30 min (Classical)'), ('classical_30_d10', '30 min, 10s delay (Classical)'), ('classical_60', '60 min (Classical)'), ('unlimited', 'Unlimited')], default='rapid_10', max_length=20)),
+                ('is_rated', models.BooleanField(default=True)),
+                ('status', models.CharField(choices=[('registration', 'Registration open'), ('running', 'Running'), ('completed', 'Completed')], default='registration', max_length=20)),
+                ('rounds', models.PositiveSmallIntegerField(default=5, help_text='Number of rounds (set from the player count for round robins)')),
+                ('current_round', models.PositiveSmallIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='tournament',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='games', to='game.tournament'),
+        ),
+        migrations.CreateModel(
+            name='TournamentPlayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seed', models.PositiveIntegerField(default=0)),
+                ('score', models.FloatField(default=0)),
+                ('buchholz', models.FloatField(default=0)),
+                ('sonneborn_berger', models.FloatField(default=0)),
+                ('withdrawn', models.BooleanField(default=False)),
+                ('joined_at', models.DateTimeField(auto_now_add=True)),
+                ('tournament', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='game.tournament')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tournament_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-score', '-buchholz', '-sonneborn_berger', 'seed'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TournamentRound',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveSmallIntegerField()),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('tournament', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='round_set', to='game.tournament')),
+            ],
+            options={
+                'ordering': ['number'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Pairing',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.PositiveSmallIntegerField()),
+                ('result', models.CharField(blank=True, choices=[('', 'Pending'), ('1-0', '1-0'), ('0-1', '0-1'), ('1/2-1/2', '½-½'), ('0-0', 'Double forfeit'), ('bye', 'Bye')], default='', max_length=7)),
+                ('game', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pairing', to='game.game')),
+                ('black', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='game.tournamentplayer')),
+                ('white', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='game.tournamentplayer')),
+                ('round', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pairings', to='game.tournamentround')),
+            ],
+            options={
+                'ordering': ['round', 'board'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tournamentplayer',
+            index=models.Index(fields=['tournament', '-score', '-buchholz', '-sonneborn_berger'], name='tournament_standings'),
+        ),
+        migrations.AddConstraint(
+            model_name='tournamentplayer',
+            constraint=models.UniqueConstraint(fields=('tournament', 'user'), name='unique_tournament_player'),
+        ),
+        migrations.AddConstraint(
+            model_name='tournamentround',
+            constraint=models.UniqueConstraint(fields=('tournament', 'number'), name='unique_round_number'),
+        ),
+        migrations.AddIndex(
+            model_name='pairing',
+            index=models.Index(fields=['round', 'result'], name='pairing_round_result'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0012_tournaments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionMove',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position_key', models.BigIntegerField()),
+                ('move_san', models.CharField(max_length=10)),
+                ('white_wins', models.PositiveIntegerField(default=0)),
+                ('draws', models.PositiveIntegerField(default=0)),
+                ('black_wins', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.BigIntegerField(default=0)),
+                ('rated_players', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('position_key', 'move_san'), name='position_move_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0013_position_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='engine_color',
+            field=models.CharField(blank=True, default='', max_length=5),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='engine_level',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0014_computer_opponent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionEval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position_key', models.BigIntegerField(unique=True)),
+                ('score', models.IntegerField()),
+                ('best_move', models.CharField(blank=True, max_length=5)),
+                ('depth', models.PositiveSmallIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GameAnalysis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.CharField(blank=True, max_length=200)),
+                ('evaluations', models.TextField(blank=True, default='[]')),
+                ('best_moves', models.TextField(blank=True, default='')),
+                ('judgements', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='analysis', to='game.game')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='analysis_queue_idx')],
+            },
+        ),
+    ]
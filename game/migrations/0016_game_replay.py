@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0015_game_analysis'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameReplay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('keyframe_interval', models.PositiveSmallIntegerField()),
+                ('keyframes', models.TextField()),
+                ('moves', models.TextField(blank=True, default='')),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='replay', to='game.game')),
+            ],
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Store moves as two bytes per ply (game/movecodec.py) instead of the JSON
+# move_history and captured_pieces columns, which are derived from them now
+
+import json
+import logging
+
+from django.db import migrations, models
+
+from ._chess import Board, IllegalMoveError, move_to_uci, pack, unpack
+
+BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+def encode_histories(apps, schema_editor):
+    Game = apps.get_model('game', 'Game')
+
+    games = Game.objects.exclude(move_history__in=['', '[]']).only('pk', 'code', 'move_history', 'move_count')
+    batch = []
+    for game in games.iterator(chunk_size=BATCH_SIZE):
+        try:
+            history = json.loads(game.move_history)
+        except ValueError:
+            continue
+        # Keep the moves up to the first one that doesn't parse, if any,
+        # and count only those
+        board = Board()
+        moves = []
+        for san in history:
+            try:
+                move = board.parse_san(san)
+            except IllegalMoveError:
+                logger.warning("Game %s: move %d (%r) doesn't parse; kept the %d moves before it",
+                               game.code, len(moves) + 1, san, len(moves))
+                break
+            moves.append(move_to_uci(move))
+            board.push(move)
+        game.move_data = pack(moves)
+        game.move_count = len(moves)
+        batch.append(game)
+        if len(batch) == BATCH_SIZE:
+            Game.objects.bulk_update(batch, ['move_data', 'move_count'])
+            batch = []
+    Game.objects.bulk_update(batch, ['move_data', 'move_count'])
+
+
+def decode_histories(apps, schema_editor):
+    Game = apps.get_model('game', 'Game')
+
+    games = Game.objects.exclude(move_data=b'').only('pk', 'move_data')
+    batch = []
+    for game in games.iterator(chunk_size=BATCH_SIZE):
+        sans = []
+        captured = {'white': [], 'black': []}
+        board = Board()
+        for uci in unpack(game.move_data):
+            move = board.parse_uci(uci)
+            piece = board.captured_piece(move)
+            if piece:
+                captured['white' if piece.isupper() else 'black'].append(piece.lower())
+            sans.append(board.san(move))
+            board.push(move)
+        game.move_history = json.dumps(sans)
+        game.captured_pieces = json.dumps(captured)
+        batch.append(game)
+        if len(batch) == BATCH_SIZE:
+            Game.objects.bulk_update(batch, ['move_history', 'captured_pieces'])
+            batch = []
+    Game.objects.bulk_update(batch, ['move_history', 'captured_pieces'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0016_game_replay'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='move_data',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.RunPython(encode_histories, decode_histories),
+        migrations.RemoveField(
+            model_name='game',
+            name='captured_pieces',
+        ),
+        migrations.RemoveField(
+            model_name='game',
+            name='move_history',
+        ),
+    ]
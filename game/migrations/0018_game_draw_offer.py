@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0017_binary_move_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='draw_offer_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='draw_offer_ply',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='draw_offered_by',
+            field=models.CharField(blank=True, choices=[('white', 'White'), ('black', 'Black')], default='', max_length=5),
+        ),
+    ]
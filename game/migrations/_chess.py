@@ -0,0 +1,380 @@
+"""
+Frozen chess rules for the data migrations
+
+A copy of what 0007_backfill_moves and 0017_binary_move_data need from
+game/board.py and game/movecodec.py, taken when they were written: play
+SAN or UCI moves from the starting position, name them, list captures and
+write the FEN. Migrations must not import the live modules, which are free
+to change (or go) after the migrations that used them have run.
+
+Don't edit this to follow game/board.py. The underscore keeps Django's
+migration loader from treating it as a migration.
+"""
+import re
+import struct
+
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+WHITE, BLACK = 8, 16
+EMPTY = 0
+
+PIECE_SYMBOLS = {
+    WHITE | PAWN: 'P', WHITE | KNIGHT: 'N', WHITE | BISHOP: 'B',
+    WHITE | ROOK: 'R', WHITE | QUEEN: 'Q', WHITE | KING: 'K',
+    BLACK | PAWN: 'p', BLACK | KNIGHT: 'n', BLACK | BISHOP: 'b',
+    BLACK | ROOK: 'r', BLACK | QUEEN: 'q', BLACK | KING: 'k',
+}
+FEN_SYMBOLS = [PIECE_SYMBOLS.get(piece, '1') for piece in range(24)]
+PROMOTION_PIECES = {'q': QUEEN, 'r': ROOK, 'b': BISHOP, 'n': KNIGHT}
+TYPE_LETTERS = {PAWN: 'p', KNIGHT: 'n', BISHOP: 'b', ROOK: 'r', QUEEN: 'q', KING: 'k'}
+LETTER_TYPES = {letter.upper(): kind for kind, letter in TYPE_LETTERS.items()}
+SAN_PATTERN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQnbrq]))?$')
+
+NORMAL, DOUBLE_PUSH, EN_PASSANT, CASTLE = 0, 1, 2, 4
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+
+KNIGHT_OFFSETS = (33, 31, 18, 14, -14, -18, -31, -33)
+BISHOP_OFFSETS = (15, 17, -15, -17)
+ROOK_OFFSETS = (16, -16, 1, -1)
+KING_OFFSETS = BISHOP_OFFSETS + ROOK_OFFSETS
+
+SQUARES = tuple(rank * 16 + file for rank in range(8) for file in range(8))
+SQUARE_NAMES = {sq: 'abcdefgh'[sq & 7] + str((sq >> 4) + 1) for sq in SQUARES}
+NAME_SQUARES = {name: sq for sq, name in SQUARE_NAMES.items()}
+EMPTY_RUNS = tuple(('1' * count, str(count)) for count in range(8, 1, -1))
+CASTLING_FEN = tuple(
+    ''.join(char for char, right in (('K', WHITE_KINGSIDE), ('Q', WHITE_QUEENSIDE),
+                                     ('k', BLACK_KINGSIDE), ('q', BLACK_QUEENSIDE)) if rights & right) or '-'
+    for rights in range(16)
+)
+CASTLE_MASK = [15] * 128
+CASTLE_MASK[0x04] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLE_MASK[0x00] = 15 & ~WHITE_QUEENSIDE
+CASTLE_MASK[0x07] = 15 & ~WHITE_KINGSIDE
+CASTLE_MASK[0x74] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLE_MASK[0x70] = 15 & ~BLACK_QUEENSIDE
+CASTLE_MASK[0x77] = 15 & ~BLACK_KINGSIDE
+
+BACK_RANK = (ROOK, KNIGHT, BISHOP, QUEEN, KING, BISHOP, KNIGHT, ROOK)
+
+FILES = 'abcdefgh'
+PROMOTIONS = ' nbrq'
+
+
+class IllegalMoveError(ValueError):
+    pass
+
+
+def move_to_uci(move):
+    uci = SQUARE_NAMES[move & 127] + SQUARE_NAMES[(move >> 7) & 127]
+    promotion = (move >> 14) & 7
+    if promotion:
+        uci += TYPE_LETTERS[promotion]
+    return uci
+
+
+def encode_uci(uci):
+    frm = (int(uci[1]) - 1) * 8 + FILES.index(uci[0])
+    to = (int(uci[3]) - 1) * 8 + FILES.index(uci[2])
+    promotion = PROMOTIONS.index(uci[4]) if len(uci) > 4 else 0
+    return frm | to << 6 | promotion << 12
+
+
+def decode_uci(code):
+    frm, to, promotion = code & 63, (code >> 6) & 63, code >> 12
+    uci = f'{FILES[frm & 7]}{(frm >> 3) + 1}{FILES[to & 7]}{(to >> 3) + 1}'
+    return uci + PROMOTIONS[promotion] if promotion else uci
+
+
+def pack(uci_moves):
+    return struct.pack(f'>{len(uci_moves)}H', *map(encode_uci, uci_moves))
+
+
+def unpack(data):
+    data = bytes(data)
+    return [decode_uci(code) for code in struct.unpack(f'>{len(data) // 2}H', data)]
+
+
+class Board:
+    """The starting position, with make/unmake and notation"""
+
+    def __init__(self):
+        self.squares = [EMPTY] * 128
+        for file, kind in enumerate(BACK_RANK):
+            self.squares[file] = WHITE | kind
+            self.squares[0x10 + file] = WHITE | PAWN
+            self.squares[0x60 + file] = BLACK | PAWN
+            self.squares[0x70 + file] = BLACK | kind
+        self.king_squares = {WHITE: 0x04, BLACK: 0x74}
+        self.turn = WHITE
+        self.castling = 15
+        self.ep_square = -1
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.stack = []
+
+    def fen(self):
+        symbols = [FEN_SYMBOLS[piece] for piece in self.squares]
+        placement = '/'.join([''.join(symbols[rank:rank + 8]) for rank in range(112, -1, -16)])
+        for run in EMPTY_RUNS:
+            placement = placement.replace(*run)
+        ep = SQUARE_NAMES[self.ep_square] if self.ep_square >= 0 else '-'
+        turn = 'w' if self.turn == WHITE else 'b'
+        return f"{placement} {turn} {CASTLING_FEN[self.castling]} {ep} {self.halfmove_clock} {self.fullmove_number}"
+
+    def is_attacked(self, sq, by_color):
+        squares = self.squares
+        pawn = by_color | PAWN
+        a, b = (sq - 15, sq - 17) if by_color == WHITE else (sq + 15, sq + 17)
+        if (not a & 0x88 and squares[a] == pawn) or (not b & 0x88 and squares[b] == pawn):
+            return True
+        for offsets, piece in ((KNIGHT_OFFSETS, by_color | KNIGHT), (KING_OFFSETS, by_color | KING)):
+            for offset in offsets:
+                target = sq + offset
+                if not target & 0x88 and squares[target] == piece:
+                    return True
+        queen = by_color | QUEEN
+        for offsets, piece in ((BISHOP_OFFSETS, by_color | BISHOP), (ROOK_OFFSETS, by_color | ROOK)):
+            for offset in offsets:
+                target = sq + offset
+                while not target & 0x88:
+                    found = squares[target]
+                    if found:
+                        if found == piece or found == queen:
+                            return True
+                        break
+                    target += offset
+        return False
+
+    def in_check(self):
+        return self.is_attacked(self.king_squares[self.turn], self.turn ^ 24)
+
+    def pseudo_legal_moves(self, from_squares=SQUARES):
+        squares = self.squares
+        us = self.turn
+        them = us ^ 24
+        moves = []
+        append = moves.append
+        for frm in from_squares:
+            piece = squares[frm]
+            if not piece or piece & 24 != us:
+                continue
+            kind = piece & 7
+            if kind == PAWN:
+                forward, start_rank, promo_rank = (16, 1, 7) if us == WHITE else (-16, 6, 0)
+                to = frm + forward
+                if not to & 0x88 and not squares[to]:
+                    if to >> 4 == promo_rank:
+                        for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                            append(frm | (to << 7) | (promotion << 14))
+                    else:
+                        append(frm | (to << 7))
+                        if frm >> 4 == start_rank and not squares[to + forward]:
+                            append(frm | ((to + forward) << 7) | (DOUBLE_PUSH << 17))
+                for to in (frm + forward - 1, frm + forward + 1):
+                    if to & 0x88:
+                        continue
+                    target = squares[to]
+                    if target and target & 24 == them:
+                        if to >> 4 == promo_rank:
+                            for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                                append(frm | (to << 7) | (promotion << 14))
+                        else:
+                            append(frm | (to << 7))
+                    elif to == self.ep_square:
+                        append(frm | (to << 7) | (EN_PASSANT << 17))
+            elif kind == KNIGHT or kind == KING:
+                for offset in (KNIGHT_OFFSETS if kind == KNIGHT else KING_OFFSETS):
+                    to = frm + offset
+                    if not to & 0x88 and (not squares[to] or squares[to] & 24 == them):
+                        append(frm | (to << 7))
+                if kind == KING:
+                    self._castling_moves(frm, append)
+            else:
+                offsets = {BISHOP: BISHOP_OFFSETS, ROOK: ROOK_OFFSETS}.get(kind, KING_OFFSETS)
+                for offset in offsets:
+                    to = frm + offset
+                    while not to & 0x88:
+                        target = squares[to]
+                        if target:
+                            if target & 24 == them:
+                                append(frm | (to << 7))
+                            break
+                        append(frm | (to << 7))
+                        to += offset
+        return moves
+
+    def _castling_moves(self, frm, append):
+        us = self.turn
+        if frm != (0x04 if us == WHITE else 0x74):
+            return
+        kingside, queenside = (WHITE_KINGSIDE, WHITE_QUEENSIDE) if us == WHITE else (BLACK_KINGSIDE, BLACK_QUEENSIDE)
+        if not self.castling & (kingside | queenside):
+            return
+        squares = self.squares
+        them = us ^ 24
+        if self.is_attacked(frm, them):
+            return
+        if (self.castling & kingside and not squares[frm + 1] and not squares[frm + 2]
+                and squares[frm + 3] == us | ROOK and not self.is_attacked(frm + 1, them)):
+            append(frm | ((frm + 2) << 7) | (CASTLE << 17))
+        if (self.castling & queenside and not squares[frm - 1] and not squares[frm - 2]
+                and not squares[frm - 3] and squares[frm - 4] == us | ROOK
+                and not self.is_attacked(frm - 1, them)):
+            append(frm | ((frm - 2) << 7) | (CASTLE << 17))
+
+    def is_legal(self, move):
+        us = self.turn
+        self.push(move)
+        legal = not self.is_attacked(self.king_squares[us], us ^ 24)
+        self.pop()
+        return legal
+
+    def has_legal_move(self):
+        return any(self.is_legal(move) for move in self.pseudo_legal_moves())
+
+    def push(self, move):
+        squares = self.squares
+        frm = move & 127
+        to = (move >> 7) & 127
+        promotion = (move >> 14) & 7
+        flag = move >> 17
+        piece = squares[frm]
+        us = piece & 24
+        captured = squares[to]
+        self.stack.append((move, captured, self.castling, self.ep_square, self.halfmove_clock))
+
+        if flag == EN_PASSANT:
+            squares[to - 16 if us == WHITE else to + 16] = EMPTY
+        squares[to] = us | promotion if promotion else piece
+        squares[frm] = EMPTY
+        if piece & 7 == KING:
+            self.king_squares[us] = to
+            if flag == CASTLE:
+                rook_from, rook_to = (frm + 3, frm + 1) if to > frm else (frm - 4, frm - 1)
+                squares[rook_to] = squares[rook_from]
+                squares[rook_from] = EMPTY
+
+        self.castling &= CASTLE_MASK[frm] & CASTLE_MASK[to]
+        self.ep_square = (frm + to) >> 1 if flag == DOUBLE_PUSH else -1
+        if piece & 7 == PAWN or captured or flag == EN_PASSANT:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if us == BLACK:
+            self.fullmove_number += 1
+        self.turn = us ^ 24
+
+    def pop(self):
+        move, captured, castling, ep_square, halfmove_clock = self.stack.pop()
+        squares = self.squares
+        frm = move & 127
+        to = (move >> 7) & 127
+        flag = move >> 17
+        them = self.turn
+        us = them ^ 24
+
+        piece = us | PAWN if (move >> 14) & 7 else squares[to]
+        squares[frm] = piece
+        squares[to] = captured
+        if flag == EN_PASSANT:
+            squares[to - 16 if us == WHITE else to + 16] = them | PAWN
+        if piece & 7 == KING:
+            self.king_squares[us] = frm
+            if flag == CASTLE:
+                rook_from, rook_to = (frm + 3, frm + 1) if to > frm else (frm - 4, frm - 1)
+                squares[rook_from] = squares[rook_to]
+                squares[rook_to] = EMPTY
+
+        if us == BLACK:
+            self.fullmove_number -= 1
+        self.turn = us
+        self.castling = castling
+        self.ep_square = ep_square
+        self.halfmove_clock = halfmove_clock
+
+    def parse_uci(self, uci):
+        frm = NAME_SQUARES.get(uci[:2])
+        to = NAME_SQUARES.get(uci[2:4])
+        promotion = PROMOTION_PIECES.get(uci[4:5], 0) if len(uci) > 4 else 0
+        for move in self.pseudo_legal_moves((frm,)) if frm is not None else ():
+            if (move >> 7) & 127 == to and (move >> 14) & 7 == promotion and self.is_legal(move):
+                return move
+        raise IllegalMoveError(f"Illegal move: {uci}")
+
+    def parse_san(self, san):
+        wanted = san.strip().rstrip('+#!?').replace('0', 'O')
+        if wanted in ('O-O', 'O-O-O'):
+            frm = self.king_squares[self.turn]
+            for move in self.pseudo_legal_moves((frm,)):
+                if move >> 17 == CASTLE and ((move >> 7) & 127 < frm) == (wanted == 'O-O-O'):
+                    if self.is_legal(move):
+                        return move
+            raise IllegalMoveError(f"Illegal move: {san}")
+
+        match = SAN_PATTERN.match(wanted)
+        if not match:
+            raise IllegalMoveError(f"Invalid move: {san}")
+        letter, file, rank, target, promotion = match.groups()
+        piece = self.turn | (LETTER_TYPES[letter] if letter else PAWN)
+        to = NAME_SQUARES[target]
+        promotion = PROMOTION_PIECES[promotion.lower()] if promotion else 0
+        candidates = [
+            sq for sq in SQUARES
+            if self.squares[sq] == piece
+            and (file is None or SQUARE_NAMES[sq][0] == file)
+            and (rank is None or SQUARE_NAMES[sq][1] == rank)
+        ]
+        matches = [
+            move for move in self.pseudo_legal_moves(candidates)
+            if (move >> 7) & 127 == to and (move >> 14) & 7 == promotion and self.is_legal(move)
+        ]
+        if len(matches) != 1:
+            raise IllegalMoveError(f"{'Ambiguous' if matches else 'Illegal'} move: {san}")
+        return matches[0]
+
+    def san(self, move):
+        frm = move & 127
+        to = (move >> 7) & 127
+        flag = move >> 17
+        promotion = (move >> 14) & 7
+        piece = self.squares[frm]
+        kind = piece & 7
+
+        if flag == CASTLE:
+            san = 'O-O' if to > frm else 'O-O-O'
+        else:
+            capture = bool(self.squares[to]) or flag == EN_PASSANT
+            target = SQUARE_NAMES[to]
+            if kind == PAWN:
+                san = SQUARE_NAMES[frm][0] + 'x' + target if capture else target
+                if promotion:
+                    san += '=' + TYPE_LETTERS[promotion].upper()
+            else:
+                san = TYPE_LETTERS[kind].upper()
+                others = [sq for sq in SQUARES if self.squares[sq] == piece and sq != frm]
+                rivals = [
+                    other & 127 for other in self.pseudo_legal_moves(others)
+                    if (other >> 7) & 127 == to and self.is_legal(other)
+                ]
+                if rivals:
+                    if not any(sq & 7 == frm & 7 for sq in rivals):
+                        san += SQUARE_NAMES[frm][0]
+                    elif not any(sq >> 4 == frm >> 4 for sq in rivals):
+                        san += SQUARE_NAMES[frm][1]
+                    else:
+                        san += SQUARE_NAMES[frm]
+                if capture:
+                    san += 'x'
+                san += target
+
+        self.push(move)
+        if self.in_check():
+            san += '+' if self.has_legal_move() else '#'
+        self.pop()
+        return san
+
+    def captured_piece(self, move):
+        if move >> 17 == EN_PASSANT:
+            return 'p' if self.turn == WHITE else 'P'
+        target = self.squares[(move >> 7) & 127]
+        return PIECE_SYMBOLS[target] if target else None
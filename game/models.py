@@ -1,11 +1,28 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 from django.core.validators import RegexValidator
+from datetime import timedelta
+import copy
 import json
 
+from .clocks import TIME_CONTROLS, charge_move, elapsed_ms_between, get_time_control, running_time
+from . import stats
+from .analysis import queue_analysis
+from .explorer import index_game
+from .movecodec import append as append_move, decode as decode_moves, from_sans
+from .rating import INITIAL_DEVIATION, INITIAL_RATING, INITIAL_VOLATILITY, RESULTS, record_result
+from .scheduler import track_game_clock
+from .state_cache import game_cache
+from .tournaments import record_game_result
+
 START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
 
+
+class StaleGameError(Exception):
+    """The game row changed between reading and writing it"""
+
+
 class User(AbstractUser):
     """Extended user model for MTU Chess Club"""
     
@@ -61,12 +78,17 @@ class User(AbstractUser):
         default=None, 
         null=True, 
         blank=True,
+        db_index=True,
         help_text='ELO rating - assigned after 5 games'
     )
     rating_assigned = models.BooleanField(
         default=False,
         help_text='True if rating has been calculated'
     )
+    # Rating engine state (game/rating.py), kept from the first game
+    rating_points = models.FloatField(default=INITIAL_RATING)
+    rating_deviation = models.FloatField(default=INITIAL_DEVIATION)
+    rating_volatility = models.FloatField(default=INITIAL_VOLATILITY)
     
     # Achievements & Streaks
     longest_win_streak = models.IntegerField(default=0)
@@ -100,8 +122,11 @@ class User(AbstractUser):
             return f"Unrated ({games_needed} games needed)"
         return self.rating
     
-    def update_stats(self, result):
-        """Update user statistics after a game"""
+    def update_stats(self, result, save=True):
+        """
+        Update user statistics after a game.
+        Ratings are updated by rating.record_result, which calls this.
+        """
         self.total_games += 1
         
         if result == 'win':
@@ -109,32 +134,18 @@ class User(AbstractUser):
             self.current_win_streak += 1
             if self.current_win_streak > self.longest_win_streak:
                 self.longest_win_streak = self.current_win_streak
-            if self.rating is not None:
-                self.rating += 10
         elif result == 'loss':
             self.losses += 1
             self.current_win_streak = 0
-            if self.rating is not None:
-                self.rating -= 10
         elif result == 'draw':
             self.draws += 1
             self.current_win_streak = 0
         
-        # Assign initial rating after 5 games
-        if self.total_games == 5 and not self.rating_assigned:
-            self.assign_initial_rating()
-        
         # Check for achievements
         self.check_achievements()
         
-        self.save()
-    
-    def assign_initial_rating(self):
-        """Calculate and assign initial rating based on first 5 games"""
-        base_rating = 1000
-        rating_adjustment = (self.wins * 20) + (self.losses * -15) + (self.draws * 5)
-        self.rating = max(800, min(2000, base_rating + rating_adjustment))
-        self.rating_assigned = True
+        if save:
+            self.save()
     
     def check_achievements(self):
         """Check and award achievements"""
@@ -169,14 +180,22 @@ class Game(models.Model):
         ('abandoned', 'Game abandoned'),
     )
     
+    # Base time, increment and delay for each choice live in clocks.TIME_CONTROLS
     TIME_CONTROL_CHOICES = (
         ('bullet_1', '1 min (Bullet)'),
+        ('bullet_1_1', '1+1 (Bullet)'),
         ('bullet_2', '2 min (Bullet)'),
         ('blitz_3', '3 min (Blitz)'),
+        ('blitz_3_2', '3+2 (Blitz)'),
         ('blitz_5', '5 min (Blitz)'),
+        ('blitz_5_d3', '5 min, 3s delay (Blitz)'),
         ('rapid_10', '10 min (Rapid)'),
+        ('rapid_10_5', '10+5 (Rapid)'),
         ('rapid_15', '15 min (Rapid)'),
+        ('rapid_15_10', '15+10 (Rapid)'),
         ('classical_30', '30 min (Classical)'),
+        ('classical_30_d10', '30 min, 10s delay (Classical)'),
+        ('classical_60', '60 min (Classical)'),
         ('unlimited', 'Unlimited'),
     )
     
@@ -204,6 +223,10 @@ class Game(models.Model):
     white_guest_name = models.CharField(max_length=50, blank=True, null=True)
     black_guest_name = models.CharField(max_length=50, blank=True, null=True)
     
+    # Computer opponent (see computer.py): the side it plays and its level
+    engine_color = models.CharField(max_length=5, blank=True, default='')
+    engine_level = models.PositiveSmallIntegerField(blank=True, null=True)
+    
     # Game settings
     time_control = models.CharField(
         max_length=20, 
@@ -212,10 +235,17 @@ class Game(models.Model):
     )
     is_rated = models.BooleanField(default=True)
     is_private = models.BooleanField(default=False)
+    tournament = models.ForeignKey(
+        'Tournament',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='games'
+    )
     
-    # timer tracking
-    white_time_remaining = models.IntegerField(default=300)
-    black_time_remaining = models.IntegerField(default=300)
+    # timer tracking (milliseconds)
+    white_time_ms = models.BigIntegerField(default=300_000)
+    black_time_ms = models.BigIntegerField(default=300_000)
     last_move_time = models.DateTimeField(null=True, blank=True)
     
     # NEW: Track when timer was last updated to prevent double-counting
@@ -245,12 +275,24 @@ class Game(models.Model):
         )
     )
     
-    # Move history
-    move_history = models.TextField(blank=True, default='[]')
+    # Pending draw offer (services.offer_draw): the side that made it, the
+    # move count it was made at and when it lapses
+    draw_offered_by = models.CharField(
+        max_length=5,
+        blank=True,
+        default='',
+        choices=(('white', 'White'), ('black', 'Black'))
+    )
+    draw_offer_ply = models.PositiveIntegerField(blank=True, null=True)
+    draw_offer_expires = models.DateTimeField(blank=True, null=True)
+    
+    # Moves from the starting position, two bytes each (see movecodec.py);
+    # SANs and captured pieces are derived from them
+    move_data = models.BinaryField(blank=True, default=b'')
     move_count = models.IntegerField(default=0)
     
-    # Captured pieces
-    captured_pieces = models.TextField(blank=True, default='{"white": [], "black": []}')
+    # Bumped on every save so pollers can cheaply tell whether anything changed
+    state_version = models.PositiveIntegerField(default=0)
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
@@ -270,6 +312,58 @@ class Game(models.Model):
     def __str__(self):
         return f"Game {self.code} - {self.status}"
     
+    def save(self, *args, **kwargs):
+        """
+        Save the game, bump its state version and refresh the state cache.
+
+        A game that already exists is written with save_changes(), so a
+        save from a stale instance raises StaleGameError instead of
+        overwriting newer moves.
+        """
+        if not self._state.adding and not kwargs.get('force_insert'):
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = [field.attname for field in self._meta.concrete_fields if not field.primary_key]
+            self.save_changes(tuple(update_fields))
+            return
+        self.state_version += 1
+        super().save(*args, **kwargs)
+        self._sync_on_commit()
+    
+    def _sync_on_commit(self):
+        """
+        Once the change is committed, write it through to the hot state
+        cache and re-schedule the flag-fall check for the running clock
+        """
+        saved = copy.copy(self)
+        
+        def sync():
+            game_cache.store(saved)
+            track_game_clock(saved)
+        transaction.on_commit(sync)
+    
+    def save_changes(self, fields):
+        """
+        Write only `fields` in a single UPDATE, guarded by the state version.
+
+        Raises StaleGameError if another request changed the game since it
+        was loaded (optimistic locking), in which case nothing is written.
+        """
+        expected_version = self.state_version
+        self.updated_at = timezone.now()
+        values = {field: getattr(self, field) for field in fields}
+        values['updated_at'] = self.updated_at
+        values['state_version'] = expected_version + 1
+        
+        updated = Game.objects.filter(
+            pk=self.pk, state_version=expected_version
+        ).update(**values)
+        if not updated:
+            raise StaleGameError(f"Game {self.code} was changed by another request")
+        
+        self.state_version = expected_version + 1
+        self._sync_on_commit()
+    
     def get_white_display_name(self):
         """Get display name for white player"""
         if self.white_player:
@@ -282,83 +376,128 @@ class Game(models.Model):
             return self.black_player.username
         return self.black_guest_name or 'Waiting...'
     
-    def mark_started(self):
-        """Mark game as started when second player joins"""
+    def get_player_color(self, user):
+        """Colour a user plays in this game (None for guests and spectators)"""
+        if user is not None and user.is_authenticated:
+            if self.white_player_id == user.id:
+                return 'white'
+            if self.black_player_id == user.id:
+                return 'black'
+        return None
+    
+    def mark_started(self, save=True):
+        """
+        Mark game as started when second player joins.
+        With save=False the game row is left for the caller to write.
+        """
         if not self.started_at:
             self.started_at = timezone.now()
             self.last_move_time = timezone.now()
             self.timer_last_updated = timezone.now()
             self.status = 'active'
-            self.save()
+            if save:
+                self.save()
+            stats.game_started(self)
     
-    def mark_completed(self, winner=None, reason=None):
-        """Mark game as completed and update player stats"""
+    def mark_completed(self, winner=None, reason=None, save=True):
+        """
+        Mark game as completed and update player stats.
+        With save=False the game row is left for the caller to write.
+
+        Only an active game can be completed: the result, rating and
+        tournament score of a finished game stand. Returns whether the
+        game was completed.
+        """
+        if self.status != 'active':
+            return False
         self.status = 'completed'
         self.completed_at = timezone.now()
         self.winner = winner
         self.result_reason = reason
-        self.save()
+        if save:
+            self.save()
+        stats.game_finished(self, True)
+        index_game(self)
+        queue_analysis(self)
+        if self.tournament_id:
+            record_game_result(self)
         
-        # Update player statistics if not guest game
-        if self.white_player and self.black_player and self.is_rated:
-            if winner == 'white':
-                self.white_player.update_stats('win')
-                self.black_player.update_stats('loss')
-            elif winner == 'black':
-                self.white_player.update_stats('loss')
-                self.black_player.update_stats('win')
-            elif winner == 'draw':
-                self.white_player.update_stats('draw')
-                self.black_player.update_stats('draw')
+        # Update player statistics and ratings if not guest game
+        if (self.white_player_id and self.black_player_id and self.is_rated
+                and self.white_player_id != self.black_player_id and winner in RESULTS):
+            self.white_player, self.black_player = record_result(self, winner)
+        return True
+    
+    def get_time_control(self):
+        """Base time, increment and delay (clocks.TimeControl) for this game"""
+        return get_time_control(self.time_control)
     
     def get_timer_state(self):
         """
         Get accurate timer state without modifying the database
-        This prevents timer from resetting on every poll
+        This prevents timer from resetting on every poll.
+        Times are given in milliseconds (*_ms) and whole seconds.
         """
+        white_ms = self.white_time_ms
+        black_ms = self.black_time_ms
+        
         if self.status != 'active' or not self.last_move_time:
             return {
-                'white_time': self.white_time_remaining,
-                'black_time': self.black_time_remaining,
+                'white_time': white_ms // 1000,
+                'black_time': black_ms // 1000,
+                'white_time_ms': white_ms,
+                'black_time_ms': black_ms,
                 'last_updated': self.timer_last_updated.isoformat() if self.timer_last_updated else None
             }
         
         # Calculate elapsed time since last move
         now = timezone.now()
-        elapsed = (now - self.last_move_time).total_seconds()
+        elapsed_ms = elapsed_ms_between(self.last_move_time, now)
         
         # Determine whose turn it is based on FEN
         current_turn = 'white' if 'w' in self.fen.split()[1] else 'black'
         
         # Calculate current time without saving to database
-        white_time = self.white_time_remaining
-        black_time = self.black_time_remaining
-        
         if current_turn == 'white':
-            white_time = max(0, self.white_time_remaining - int(elapsed))
+            white_ms = running_time(white_ms, elapsed_ms)
         else:
-            black_time = max(0, self.black_time_remaining - int(elapsed))
+            black_ms = running_time(black_ms, elapsed_ms)
         
         return {
-            'white_time': white_time,
-            'black_time': black_time,
+            'white_time': white_ms // 1000,
+            'black_time': black_ms // 1000,
+            'white_time_ms': white_ms,
+            'black_time_ms': black_ms,
             'current_turn': current_turn,
             'last_updated': now.isoformat()
         }
     
-    def update_timer_on_move(self):
+    def get_clock_deadline(self):
+        """Epoch time at which the player to move runs out of time (None if no clock is running)"""
+        if self.status != 'active' or not self.last_move_time or self.time_control == 'unlimited':
+            return None
+        current_turn = 'white' if 'w' in self.fen.split()[1] else 'black'
+        remaining_ms = self.white_time_ms if current_turn == 'white' else self.black_time_ms
+        return self.last_move_time.timestamp() + remaining_ms / 1000
+    
+    def update_timer_on_move(self, save=True):
         """
         Update timer when a move is made (not on every poll)
-        This is called only when a move is actually made
+        This is called only when a move is actually made.
+        Applies the time control's increment or delay and returns the
+        milliseconds the mover spent on the move.
+        With save=False the changes are left for the caller to write.
         """
         if not self.last_move_time or self.status != 'active':
             self.last_move_time = timezone.now()
             self.timer_last_updated = timezone.now()
-            self.save()
-            return
+            if save:
+                self.save()
+            return 0
         
         now = timezone.now()
-        elapsed = (now - self.last_move_time).total_seconds()
+        elapsed_ms = elapsed_ms_between(self.last_move_time, now)
+        time_control = self.get_time_control()
         
         # Determine who just moved (opposite of current turn in FEN)
         current_turn_in_fen = 'white' if 'w' in self.fen.split()[1] else 'black'
@@ -366,47 +505,112 @@ class Game(models.Model):
         
         # Deduct time from player who just moved
         if player_who_moved == 'white':
-            self.white_time_remaining = max(0, self.white_time_remaining - int(elapsed))
-            if self.white_time_remaining == 0:
-                self.mark_completed(winner='black', reason='timeout')
+            self.white_time_ms = charge_move(time_control, self.white_time_ms, elapsed_ms)
+            if self.white_time_ms == 0:
+                self.mark_completed(winner='black', reason='timeout', save=save)
         else:
-            self.black_time_remaining = max(0, self.black_time_remaining - int(elapsed))
-            if self.black_time_remaining == 0:
-                self.mark_completed(winner='white', reason='timeout')
+            self.black_time_ms = charge_move(time_control, self.black_time_ms, elapsed_ms)
+            if self.black_time_ms == 0:
+                self.mark_completed(winner='white', reason='timeout', save=save)
         
         self.last_move_time = now
         self.timer_last_updated = now
-        self.save()
-    
-    def get_time_control_seconds(self):
-        """Get initial time in seconds based on time control"""
-        time_map = {
-            'bullet_1': 60,
-            'bullet_2': 120,
-            'blitz_3': 180,
-            'blitz_5': 300,
-            'rapid_10': 600,
-            'rapid_15': 900,
-            'classical_30': 1800,
-            'classical_2_60': 3600,
-            'unlimited': 999999,           
-        }
-        return time_map.get(self.time_control, 300)
-    
-    def add_captured_piece(self, piece, color):
-        """Add a captured piece to the list"""
-        try:
-            captured = json.loads(self.captured_pieces)
-        except:
-            captured = {"white": [], "black": []}
+        if save:
+            self.save()
+        return elapsed_ms
+    
+    def log_move(self, san, uci, captured_piece=None, time_spent_ms=0):
+        """
+        Record the move just played (self.fen is the position after it).
+
+        The Move row is inserted in the caller's transaction, so it commits
+        or rolls back with the game's own update, and move_data is extended
+        by the move's two bytes.
+        """
+        player_color = 'black' if self.fen.split()[1] == 'w' else 'white'
+        clock_ms = self.white_time_ms if player_color == 'white' else self.black_time_ms
+        Move.objects.create(
+            game=self,
+            move_number=self.move_count,
+            player_color=player_color,
+            move_san=san,
+            move_from=uci[:2],
+            move_to=uci[2:4],
+            captured_piece=captured_piece,
+            fen_after=self.fen,
+            time_spent_ms=time_spent_ms,
+            clock_ms=clock_ms,
+        )
         
-        captured[color].append(piece)
-        self.captured_pieces = json.dumps(captured)
-        self.save()
+        self.move_data = append_move(self.move_data, uci)
+    
+    def rebuild_move_data(self):
+        """Recompute move_data from the Move rows"""
+        sans = self.moves.order_by('move_number').values_list('move_san', flat=True)
+        self.move_data = from_sans(sans)
+        return self.move_data
+    
+    def get_sans(self):
+        """The moves played, in SAN"""
+        return list(decode_moves(self.move_data).sans)
+    
+    def get_captured_pieces(self):
+        """Pieces each side has lost: {'white': ['p', ...], 'black': [...]}"""
+        return {color: list(pieces) for color, pieces in decode_moves(self.move_data).captured.items()}
+
+    def get_draw_offer(self, now=None):
+        """The pending draw offer as served to clients, or None"""
+        if self.status != 'active' or not self.draw_offered_by:
+            return None
+        if self.draw_offer_expires <= (now or timezone.now()):
+            return None
+        return {
+            'by': self.draw_offered_by,
+            'ply': self.draw_offer_ply,
+            'expires': self.draw_offer_expires.isoformat(),
+        }
+    
+    def clear_draw_offer(self):
+        """Drop the draw offer (the caller saves); True if there was one"""
+        had_offer = bool(self.draw_offered_by)
+        self.draw_offered_by = ''
+        self.draw_offer_ply = None
+        self.draw_offer_expires = None
+        return had_offer
+    
+    def get_state(self):
+        """Full game state as served by the state API and the WebSocket snapshot"""
+        timer_state = self.get_timer_state()
+        decoded = decode_moves(self.move_data)
+        return {
+            'code': self.code,
+            'version': self.state_version,
+            'fen': self.fen,
+            'status': self.status,
+            'white_player': self.get_white_display_name(),
+            'black_player': self.get_black_display_name(),
+            'engine_color': self.engine_color or None,
+            'white_time': timer_state['white_time'],
+            'black_time': timer_state['black_time'],
+            'white_time_ms': timer_state['white_time_ms'],
+            'black_time_ms': timer_state['black_time_ms'],
+            'winner': self.winner,
+            'result_reason': self.result_reason,
+            # JSON text, as when they were stored that way
+            'move_history': json.dumps(decoded.sans),
+            'move_count': self.move_count,
+            'captured_pieces': json.dumps(decoded.captured),
+            'draw_offer': self.get_draw_offer(),
+            'updated_at': self.updated_at.isoformat(),
+            'timer_last_updated': timer_state.get('last_updated'),
+        }
 
 
 class GameSession(models.Model):
     """Track active game sessions for reconnection"""
+    # Sessions seen within this window count as active
+    ACTIVE_WINDOW = timedelta(minutes=5)
+    
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     game = models.ForeignKey(Game, on_delete=models.CASCADE)
     session_key = models.CharField(max_length=40)
@@ -430,11 +634,233 @@ class Move(models.Model):
     move_to = models.CharField(max_length=2)
     captured_piece = models.CharField(max_length=1, blank=True, null=True)
     fen_after = models.CharField(max_length=100)
-    time_spent = models.IntegerField(default=0)
+    time_spent_ms = models.IntegerField(default=0)
+    clock_ms = models.BigIntegerField(
+        null=True,
+        blank=True,
+        help_text="Mover's clock (milliseconds) after the move"
+    )
     timestamp = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['move_number']
+        constraints = [
+            models.UniqueConstraint(fields=['game', 'move_number'], name='unique_move_number_per_game'),
+        ]
+    
+    def __str__(self):
+        return f"{self.game.code} - Move {self.move_number}: {self.move_san}"
+
+class PositionMove(models.Model):
+    """Opening explorer: results of a move played from a position (see explorer.py)"""
+    # Zobrist key of the position (Board.hash as a signed 64-bit integer)
+    position_key = models.BigIntegerField()
+    move_san = models.CharField(max_length=10)
+    white_wins = models.PositiveIntegerField(default=0)
+    draws = models.PositiveIntegerField(default=0)
+    black_wins = models.PositiveIntegerField(default=0)
+    # Sum and number of the rating points of the (registered) players of those games
+    rating_sum = models.BigIntegerField(default=0)
+    rated_players = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            # Also the index explorer lookups (by position_key) use
+            models.UniqueConstraint(fields=['position_key', 'move_san'], name='position_move_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.position_key} {self.move_san}: +{self.white_wins} ={self.draws} -{self.black_wins}"
+
+
+class PositionEval(models.Model):
+    """Engine evaluation of a position, shared by every game reaching it (see analysis.py)"""
+    # Zobrist key of the position (Board.hash as a signed 64-bit integer)
+    position_key = models.BigIntegerField(unique=True)
+    # Centipawns from white's point of view (search.MATE - n: mate in n plies)
+    score = models.IntegerField()
+    best_move = models.CharField(max_length=5, blank=True)
+    depth = models.PositiveSmallIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.position_key}: {self.score} ({self.best_move or '-'})"
+
+
+class GameAnalysis(models.Model):
+    """Post-game analysis of a game: the job queue entry and its result (see analysis.py)"""
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    
+    game = models.OneToOneField(Game, on_delete=models.CASCADE, related_name='analysis')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.CharField(max_length=200, blank=True)
+    
+    # Score of the position before each move and after the last (JSON list,
+    # as PositionEval.score), the best move in each (space-separated UCI)
+    # and one judgement character per move (analysis.JUDGEMENTS)
+    evaluations = models.TextField(blank=True, default='[]')
+    best_moves = models.TextField(blank=True, default='')
+    judgements = models.TextField(blank=True, default='')
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        indexes = [
+            # The worker takes the oldest queued job
+            models.Index(fields=['status', 'created_at'], name='analysis_queue_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Analysis of {self.game.code} ({self.status})"
+
+
+class GameReplay(models.Model):
+    """Replay store of a finished game: keyframes and move deltas (see replay.py)"""
+    game = models.OneToOneField(Game, on_delete=models.CASCADE, related_name='replay')
+    # FEN at every keyframe_interval-th ply from the start (newline-separated)
+    # and every move in UCI (space-separated)
+    keyframe_interval = models.PositiveSmallIntegerField()
+    keyframes = models.TextField()
+    moves = models.TextField(blank=True, default='')
+    # The whole replay as served by the replay API (gzip-compressed JSON)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Replay of {self.game.code}"
+
+
+class RatingHistory(models.Model):
+    """A player's rating after each rated game, for progress charts"""
+    # Indexed by the (user, recorded_at, rating) index below
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rating_history', db_index=False)
+    game = models.ForeignKey(Game, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    recorded_at = models.DateTimeField()
+    rating = models.IntegerField()
+    deviation = models.PositiveSmallIntegerField()
+    
+    class Meta:
+        ordering = ['recorded_at']
+        indexes = [
+            # Covers chart queries (user + time range -> rating) without table lookups
+            models.Index(fields=['user', 'recorded_at', 'rating'], name='rating_history_user_time'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username}: {self.rating} at {self.recorded_at:%Y-%m-%d %H:%M}"
+
+
+class Tournament(models.Model):
+    """A Swiss or round-robin tournament (pairing and standings in game/tournaments.py)"""
+    FORMAT_CHOICES = (
+        ('swiss', 'Swiss'),
+        ('round_robin', 'Round robin'),
+    )
+    STATUS_CHOICES = (
+        ('registration', 'Registration open'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+    )
+    
+    name = models.CharField(max_length=100)
+    format = models.CharField(max_length=20, choices=FORMAT_CHOICES, default='swiss')
+    time_control = models.CharField(max_length=20, choices=Game.TIME_CONTROL_CHOICES, default='rapid_10')
+    is_rated = models.BooleanField(default=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='registration')
+    rounds = models.PositiveSmallIntegerField(
+        default=5,
+        help_text='Number of rounds (set from the player count for round robins)'
+    )
+    current_round = models.PositiveSmallIntegerField(default=0)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.name} ({self.get_format_display()})"
+
+
+class TournamentRound(models.Model):
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE, related_name='round_set')
+    number = models.PositiveSmallIntegerField()
+    started_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['number']
+        constraints = [
+            models.UniqueConstraint(fields=['tournament', 'number'], name='unique_round_number'),
+        ]
+    
+    def __str__(self):
+        return f"{self.tournament.name} round {self.number}"
+
+
+class TournamentPlayer(models.Model):
+    """
+    A player's entry in a tournament. Score and tiebreaks are kept up to
+    date as results come in (tournaments.record_game_result).
+    """
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE, related_name='entries')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tournament_entries')
+    seed = models.PositiveIntegerField(default=0)
+    score = models.FloatField(default=0)
+    buchholz = models.FloatField(default=0)
+    sonneborn_berger = models.FloatField(default=0)
+    withdrawn = models.BooleanField(default=False)
+    joined_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-score', '-buchholz', '-sonneborn_berger', 'seed']
+        constraints = [
+            models.UniqueConstraint(fields=['tournament', 'user'], name='unique_tournament_player'),
+        ]
+        indexes = [
+            models.Index(fields=['tournament', '-score', '-buchholz', '-sonneborn_berger'],
+                         name='tournament_standings'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} in {self.tournament.name}"
+
+
+class Pairing(models.Model):
+    """One board of a round; a bye has no black player and no game"""
+    RESULT_CHOICES = (
+        ('', 'Pending'),
+        ('1-0', '1-0'),
+        ('0-1', '0-1'),
+        ('1/2-1/2', '½-½'),
+        ('0-0', 'Double forfeit'),
+        ('bye', 'Bye'),
+    )
+    
+    round = models.ForeignKey(TournamentRound, on_delete=models.CASCADE, related_name='pairings')
+    board = models.PositiveSmallIntegerField()
+    white = models.ForeignKey(TournamentPlayer, on_delete=models.CASCADE, related_name='+')
+    black = models.ForeignKey(TournamentPlayer, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    game = models.OneToOneField(Game, on_delete=models.SET_NULL, null=True, blank=True, related_name='pairing')
+    result = models.CharField(max_length=7, choices=RESULT_CHOICES, blank=True, default='')
+    
+    class Meta:
+        ordering = ['round', 'board']
+        indexes = [
+            # Finding a round's unfinished boards
+            models.Index(fields=['round', 'result'], name='pairing_round_result'),
+        ]
     
     def __str__(self):
-        return f"{self.game.code} - Move {self.move_number}: {self.move_san}"
\ No newline at end of file
+        black = self.black.user.username if self.black_id else 'bye'
+        return f"Board {self.board}: {self.white.user.username} - {black}"
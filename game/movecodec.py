@@ -0,0 +1,138 @@
+"""
+Compact move lists
+
+Game.move_data holds a game's moves from the starting position in two
+bytes per ply (big-endian):
+
+    from square | to square << 6 | promotion << 12
+
+with squares numbered a1 = 0 to h8 = 63 and the promotion 0 (none) or
+1-4 (knight, bishop, rook, queen). A move is appended as two more bytes;
+the list is never parsed or re-encoded to add one.
+
+UCI comes straight from the bits. SAN and captured pieces depend on the
+position, so decode() replays the moves - and remembers the result for
+the last DECODE_CACHE_SIZE move lists, keyed by their bytes. A list that
+is a cached one plus one move (the game after its latest move) is
+decoded by playing only that move from the cached final position.
+
+    >>> data = append(b'', 'e2e4')
+    >>> ucis(data)
+    ['e2e4']
+    >>> decode(data).sans
+    ('e4',)
+"""
+import struct
+import threading
+from collections import OrderedDict, namedtuple
+
+from .board import Board, START_FEN, move_to_uci
+
+DECODE_CACHE_SIZE = 1024
+
+FILES = 'abcdefgh'
+PROMOTIONS = ' nbrq'
+
+# A decoded move list: SANs, captured pieces by the side that lost them
+# ({'white': ('p', ...), 'black': (...)}) and the final position
+Decoded = namedtuple('Decoded', ['sans', 'captured', 'fen'])
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def encode_uci(uci):
+    """16-bit code of a UCI move ('e2e4', 'e7e8q')"""
+    frm = (int(uci[1]) - 1) * 8 + FILES.index(uci[0])
+    to = (int(uci[3]) - 1) * 8 + FILES.index(uci[2])
+    promotion = PROMOTIONS.index(uci[4]) if len(uci) > 4 else 0
+    return frm | to << 6 | promotion << 12
+
+
+def decode_uci(code):
+    frm, to, promotion = code & 63, (code >> 6) & 63, code >> 12
+    uci = f'{FILES[frm & 7]}{(frm >> 3) + 1}{FILES[to & 7]}{(to >> 3) + 1}'
+    return uci + PROMOTIONS[promotion] if promotion else uci
+
+
+def append(data, uci):
+    """A move list with one more move"""
+    return bytes(data) + struct.pack('>H', encode_uci(uci))
+
+
+def pack(uci_moves):
+    return struct.pack(f'>{len(uci_moves)}H', *map(encode_uci, uci_moves))
+
+
+def codes(data):
+    data = bytes(data)
+    return struct.unpack(f'>{len(data) // 2}H', data)
+
+
+def ucis(data):
+    """The moves as UCI strings (no board needed)"""
+    return [decode_uci(code) for code in codes(data)]
+
+
+def replay(data, board=None):
+    """
+    Yield (board, move) for each move of a list, with the board in the
+    position before it; the move is made when the caller resumes.
+    Raises IllegalMoveError on a move that doesn't fit the position.
+    """
+    board = Board() if board is None else board
+    for code in codes(data):
+        move = board.parse_uci(decode_uci(code))
+        yield board, move
+        board.push(move)
+
+
+def board_after(data):
+    """The Board after a move list (knowing the positions before it, for repetitions)"""
+    board = Board()
+    for code in codes(data):
+        board.push(board.parse_uci(decode_uci(code)))
+    return board
+
+
+def from_sans(sans):
+    """The move list of a game given in SAN; raises IllegalMoveError"""
+    board = Board()
+    moves = []
+    for san in sans:
+        move = board.parse_san(san)
+        moves.append(move_to_uci(move))
+        board.push(move)
+    return pack(moves)
+
+
+def _decode(data, start=None):
+    """Decoded of `data`, continuing from the Decoded of all but its last move"""
+    if start is None:
+        sans, captured, board, tail = [], {'white': [], 'black': []}, Board(START_FEN), data
+    else:
+        sans, board, tail = list(start.sans), Board(start.fen), data[-2:]
+        captured = {color: list(pieces) for color, pieces in start.captured.items()}
+    for board, move in replay(tail, board):
+        piece = board.captured_piece(move)
+        if piece:
+            captured['white' if piece.isupper() else 'black'].append(piece.lower())
+        sans.append(board.san(move))
+    return Decoded(tuple(sans), {color: tuple(pieces) for color, pieces in captured.items()}, board.fen())
+
+
+def decode(data):
+    """SANs, captured pieces and final position of a move list"""
+    data = bytes(data)
+    with _cache_lock:
+        decoded = _cache.get(data)
+        if decoded is not None:
+            _cache.move_to_end(data)
+            return decoded
+        start = _cache.get(data[:-2]) if data else None
+    decoded = _decode(data, start)
+    with _cache_lock:
+        _cache[data] = decoded
+        while len(_cache) > DECODE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return decoded
@@ -0,0 +1,384 @@
+"""
+PGN export and import
+
+    game_pgn(game)            one game as PGN text
+    export_pgn(games)         generator of PGN texts for a queryset
+    read_games(lines)         split a PGN file into (headers, movetext) pairs
+    parse_game(headers, text) replay one game into an ImportedGame
+    parse_games(batch)        parse_game for a batch, collecting the errors
+
+Headers come from the Game row (players, time control, start time, result
+and how it ended); every move gets a [%clk h:mm:ss] comment with the
+mover's clock after the move, from Move.clock_ms.
+
+export_pgn walks the games with QuerySet.iterator(), which streams rows
+(server-side cursors on PostgreSQL), and reads the moves of each chunk of
+games in one query, so exporting the whole database never holds it in
+memory. It is used by
+the download views and by python manage.py export_pgn.
+
+The import side never touches the database: movetext is tokenized with a
+single regex (comments, variations and NAGs are skipped, %clk comments
+kept) and the moves are replayed on the server Board, so an illegal or
+ambiguous move rejects the game. python manage.py import_pgn runs it,
+optionally in worker processes, and bulk-inserts the results.
+"""
+import re
+from collections import defaultdict, namedtuple
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db.models import Q
+
+from .board import START_FEN, Board, IllegalMoveError, move_to_uci
+from .clocks import TIME_CONTROLS
+from .movecodec import pack
+
+EXPORT_CHUNK_SIZE = 500
+LINE_LENGTH = 80
+
+RESULTS = {'white': '1-0', 'black': '0-1', 'draw': '1/2-1/2'}
+
+# Game.result_reason -> PGN Termination tag
+TERMINATIONS = {
+    'timeout': 'time forfeit',
+    'abandoned': 'abandoned',
+}
+TERMINATION_REASONS = {tag: reason for reason, tag in TERMINATIONS.items()}
+RESULT_WINNERS = {result: winner for winner, result in RESULTS.items()}
+
+# 'base+increment' (seconds) -> time control; delays don't survive export
+TIME_CONTROL_TAGS = {}
+for _name, _tc in TIME_CONTROLS.items():
+    if _name != 'unlimited' and not _tc.delay_ms:
+        TIME_CONTROL_TAGS['%d+%d' % (_tc.base_ms // 1000, _tc.increment_ms // 1000)] = _name
+
+HEADER_LINE = re.compile(r'\[(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+MOVETEXT_TOKEN = re.compile(r'''
+    (?P<comment>\{[^}]*\})
+  | (?P<line_comment>;[^\n]*)
+  | (?P<open>\()
+  | (?P<close>\))
+  | (?P<result>1-0|0-1|1/2-1/2|\*)
+  | (?P<skip>\d+\.+|\$\d+|[!?]+)
+  | (?P<move>[^\s{}();$.]+)
+''', re.VERBOSE)
+CLOCK_COMMENT = re.compile(r'\[%clk\s+(\d+):(\d+):(\d+(?:\.\d+)?)\]')
+
+# One replayed game, ready to be written: moves are
+# (san, from, to, captured piece, fen after, time spent ms, clock ms),
+# hashes the Board.hash before each move (for the opening explorer) and
+# move_data the moves as Game.move_data
+ImportedGame = namedtuple('ImportedGame', [
+    'headers', 'time_control', 'started_at', 'moves', 'hashes', 'fen', 'winner', 'result_reason',
+    'move_data', 'white_time_ms', 'black_time_ms',
+])
+
+
+class PGNError(ValueError):
+    """A game in a PGN file that can't be imported"""
+
+
+def _site():
+    config = getattr(settings, 'MTU_CHESS_CONFIG', {})
+    return ', '.join(filter(None, [config.get('UNIVERSITY_NAME'), config.get('LOCATION')])) or '?'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def format_clock(ms):
+    """Milliseconds as h:mm:ss (with tenths when not a whole second)"""
+    seconds, ms = divmod(max(0, ms), 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    clock = '%d:%02d:%02d' % (hours, minutes, seconds)
+    if ms >= 100:
+        clock += '.%d' % (ms // 100)
+    return clock
+
+
+def time_control_tag(game):
+    """PGN TimeControl value: base+increment in seconds, '-' when untimed"""
+    if game.time_control == 'unlimited':
+        return '-'
+    tc = game.get_time_control()
+    return '%d+%d' % (tc.base_ms // 1000, tc.increment_ms // 1000)
+
+
+def game_headers(game):
+    """Seven Tag Roster plus the extra tags, as (name, value) pairs"""
+    started = game.started_at or game.created_at
+    tournament = game.tournament if game.tournament_id else None
+    pairing = getattr(game, 'pairing', None) if tournament else None
+    headers = [
+        ('Event', tournament.name if tournament else ('Rated game' if game.is_rated else 'Casual game')),
+        ('Site', _site()),
+        ('Date', started.strftime('%Y.%m.%d') if started else '????.??.??'),
+        ('Round', str(pairing.round.number) if pairing else '-'),
+        ('White', game.get_white_display_name()),
+        ('Black', game.get_black_display_name()),
+        ('Result', RESULTS.get(game.winner, '*')),
+        ('TimeControl', time_control_tag(game)),
+    ]
+    if started:
+        headers.append(('UTCDate', started.strftime('%Y.%m.%d')))
+        headers.append(('UTCTime', started.strftime('%H:%M:%S')))
+    if game.status == 'completed' or game.result_reason:
+        headers.append(('Termination', TERMINATIONS.get(game.result_reason, 'normal')))
+    if game.result_reason:
+        headers.append(('ResultReason', game.get_result_reason_display()))
+    headers.append(('GameId', game.code))
+    return headers
+
+
+def movetext(moves, result):
+    """Numbered SAN moves with %clk comments, wrapped at 80 columns"""
+    tokens = []
+    for ply, (san, clock_ms) in enumerate(moves):
+        if ply % 2 == 0:
+            tokens.append('%d.' % (ply // 2 + 1))
+        tokens.append(san)
+        if clock_ms is not None:
+            tokens.append('{[%%clk %s]}' % format_clock(clock_ms))
+    tokens.append(result)
+
+    # Wrap without splitting a token (comments contain a space)
+    lines = []
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = f'{line} {token}' if line else token
+    lines.append(line)
+    return '\n'.join(lines)
+
+
+def _game_moves(game):
+    """(san, clock_ms) for each move; games without Move rows fall back to move_data"""
+    moves = [(move.move_san, move.clock_ms) for move in game.moves.all()]
+    if not moves and game.move_count:
+        try:
+            moves = [(san, None) for san in game.get_sans()]
+        except IllegalMoveError:
+            moves = []
+    return moves
+
+
+def game_pgn(game, moves=None):
+    """The game as PGN text; moves are (san, clock_ms) pairs, loaded if not given"""
+    if moves is None:
+        moves = _game_moves(game)
+    headers = ''.join('[%s "%s"]\n' % (name, _escape(value)) for name, value in game_headers(game))
+    return '%s\n%s\n' % (headers, movetext(moves, RESULTS.get(game.winner, '*')))
+
+
+def games_for_export(user=None, tournament=None, start=None, end=None, finished_only=True):
+    """Games to export: a user's, a tournament's and/or those started in a time range"""
+    from .models import Game
+
+    games = Game.objects.all()
+    if finished_only:
+        games = games.filter(status__in=['completed', 'abandoned'])
+    if user is not None:
+        games = games.filter(Q(white_player=user) | Q(black_player=user))
+    if tournament is not None:
+        games = games.filter(tournament=tournament)
+    if start is not None:
+        games = games.filter(started_at__gte=start)
+    if end is not None:
+        games = games.filter(started_at__lte=end)
+    return games
+
+
+def _export_chunk(games):
+    """PGN texts for a list of games, with all their moves read in one query"""
+    from .models import Move
+
+    moves = defaultdict(list)
+    rows = (
+        Move.objects.filter(game_id__in=[game.pk for game in games])
+        .order_by('game_id', 'move_number')
+        .values_list('game_id', 'move_san', 'clock_ms')
+    )
+    for game_id, san, clock_ms in rows:
+        moves[game_id].append((san, clock_ms))
+    for game in games:
+        yield game_pgn(game, moves.get(game.pk)) + '\n'
+
+
+def export_pgn(games, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the PGN text of every game in a queryset, streaming from the database"""
+    games = (
+        games.select_related('white_player', 'black_player', 'tournament', 'pairing__round')
+        .order_by('pk')
+    )
+    chunk = []
+    for game in games.iterator(chunk_size=chunk_size):
+        chunk.append(game)
+        if len(chunk) == chunk_size:
+            yield from _export_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield from _export_chunk(chunk)
+
+
+# ======================================================================
+# Import
+# ======================================================================
+
+def read_games(lines):
+    """Yield (headers dict, movetext) for each game in an iterable of PGN lines"""
+    headers = {}
+    movetext = []
+    for line in lines:
+        if line.startswith('['):
+            if movetext:
+                yield headers, '\n'.join(movetext)
+                headers, movetext = {}, []
+            match = HEADER_LINE.match(line)
+            if match:
+                headers[match.group(1)] = re.sub(r'\\(.)', r'\1', match.group(2))
+        elif not line.startswith('%'):
+            line = line.strip()
+            if line:
+                movetext.append(line)
+    if headers or movetext:
+        yield headers, '\n'.join(movetext)
+
+
+def _clock_ms(hours, minutes, seconds):
+    return (int(hours) * 3600 + int(minutes) * 60) * 1000 + round(float(seconds) * 1000)
+
+
+def parse_movetext(text):
+    """(SAN tokens, clock ms or None for each, result) from the main line of a movetext"""
+    sans = []
+    clocks = []
+    result = '*'
+    depth = 0
+    for match in MOVETEXT_TOKEN.finditer(text):
+        kind = match.lastgroup
+        if kind == 'move':
+            if not depth:
+                sans.append(match.group())
+                clocks.append(None)
+        elif kind == 'comment':
+            if not depth and sans:
+                clock = CLOCK_COMMENT.search(match.group())
+                if clock:
+                    clocks[-1] = _clock_ms(*clock.groups())
+        elif kind == 'open':
+            depth += 1
+        elif kind == 'close':
+            depth = max(0, depth - 1)
+        elif kind == 'result' and not depth:
+            result = match.group()
+    return sans, clocks, result
+
+
+def time_control_from_tag(tag):
+    """The time control matching a PGN TimeControl value ('unlimited' if none does)"""
+    return TIME_CONTROL_TAGS.get((tag or '').strip(), 'unlimited')
+
+
+def _header_datetime(headers):
+    """Start of the game (UTC) from the date/time tags, or None if unknown"""
+    date = headers.get('UTCDate') or headers.get('Date') or ''
+    time = headers.get('UTCTime') or headers.get('Time') or '00:00:00'
+    try:
+        return datetime.strptime(f'{date} {time}', '%Y.%m.%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    except ValueError:
+        try:
+            return datetime.strptime(date, '%Y.%m.%d').replace(tzinfo=timezone.utc)
+        except ValueError:
+            return None
+
+
+def _result_reason(board, winner, headers):
+    """How the game ended: from the final position, else the Termination tag"""
+    outcome = board.outcome(claim_draw=True)
+    if outcome and outcome[0] == winner:
+        return outcome[1]
+    reason = TERMINATION_REASONS.get(headers.get('Termination', '').lower())
+    if reason:
+        return reason
+    return 'agreement' if winner == 'draw' else 'resignation'
+
+
+def parse_game(headers, text):
+    """Replay a game from read_games() on the server Board; raises PGNError"""
+    if headers.get('SetUp') == '1' or headers.get('FEN', START_FEN) != START_FEN:
+        raise PGNError('games from a set-up position are not supported')
+    sans, clocks, result = parse_movetext(text)
+    if result == '*':
+        result = headers.get('Result', '*')
+
+    tag = headers.get('TimeControl', '')
+    time_control = time_control_from_tag(tag)
+    # Clocks are read from the tag itself: it may not be one of ours
+    base, _, increment = tag.partition('+')
+    try:
+        base_ms, increment_ms = int(base) * 1000, int(increment or 0) * 1000
+    except ValueError:
+        base_ms, increment_ms = TIME_CONTROLS[time_control].base_ms, None
+    remaining = [base_ms, base_ms]
+    board = Board()
+    moves = []
+    ucis = []
+    hashes = []
+    for ply, (token, clock_ms) in enumerate(zip(sans, clocks)):
+        try:
+            move = board.parse_san(token)
+        except IllegalMoveError as e:
+            raise PGNError('move %d%s %s' % (ply // 2 + 1, '.' if ply % 2 == 0 else '...', e))
+        san = board.san(move)
+        uci = move_to_uci(move)
+        ucis.append(uci)
+        captured = board.captured_piece(move)
+        if captured:
+            captured = captured.lower()
+        hashes.append(board.hash)
+        board.push(move)
+
+        time_spent_ms = 0
+        if clock_ms is not None:
+            side = ply % 2
+            if increment_ms is not None:
+                time_spent_ms = max(0, remaining[side] - clock_ms + increment_ms)
+            remaining[side] = clock_ms
+        moves.append((san, uci[:2], uci[2:4], captured, board.fen(), time_spent_ms, clock_ms))
+
+    winner = RESULT_WINNERS.get(result)
+    return ImportedGame(
+        headers=headers,
+        time_control=time_control,
+        started_at=_header_datetime(headers),
+        moves=moves,
+        hashes=hashes,
+        fen=board.fen(),
+        winner=winner,
+        result_reason=_result_reason(board, winner, headers) if winner else None,
+        move_data=pack(ucis),
+        white_time_ms=remaining[0],
+        black_time_ms=remaining[1],
+    )
+
+
+def parse_games(batch):
+    """
+    ([ImportedGame], [error message]) for a batch of (headers, movetext)
+    pairs. Only needs this module, so it can run in worker processes.
+    """
+    games = []
+    errors = []
+    for headers, text in batch:
+        try:
+            games.append(parse_game(headers, text))
+        except PGNError as e:
+            errors.append('%s - %s (%s): %s' % (
+                headers.get('White', '?'), headers.get('Black', '?'), headers.get('Date', '?'), e))
+    return games, errors
@@ -0,0 +1,166 @@
+"""
+Leaderboard ranking index
+
+An in-memory index of every rated player, sorted by rating, answers the
+leaderboard queries without sorting the user table:
+
+    ranking.top(10)
+    ranking.page(3, size=50, department='CSC')
+    ranking.around(user_id, radius=10, level=300)
+
+Each (sub)index is a sorted list of (-rating, user_id) keys, so a player's
+rank is one bisect and a page is a slice. Ties share a rank (1, 2, 2, 4).
+Department and level variants are built from the main index the first
+time they are asked for.
+
+The index is built from the database on first use, kept up to date when a
+User is saved in this process (once the transaction commits), and rebuilt
+after MTU_CHESS_CONFIG['RANKING_REBUILD_SECONDS'] so changes made by
+other server processes are picked up.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+DEFAULT_PAGE_SIZE = 50
+PLAYER_FIELDS = (
+    'id', 'username', 'matric_number', 'department', 'level', 'rating',
+    'total_games', 'wins', 'losses', 'draws',
+)
+
+
+def _player_row(values):
+    row = dict(zip(PLAYER_FIELDS, values))
+    row['win_rate'] = round((row['wins'] / row['total_games']) * 100, 1) if row['total_games'] else 0
+    return row
+
+
+class RankingIndex:
+    """Rated players sorted by rating, with optional department/level filters"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._players = None  # user id -> player row
+        self._indexes = {}    # (department, level) -> sorted [(-rating, id)]
+        self._built_at = 0.0
+
+    def _max_age(self):
+        return getattr(settings, 'MTU_CHESS_CONFIG', {}).get('RANKING_REBUILD_SECONDS', 300)
+
+    def rebuild(self):
+        """Reload every rated player from the database"""
+        from .models import User
+
+        rows = User.objects.filter(rating__isnull=False).values_list(*PLAYER_FIELDS)
+        players = {values[0]: _player_row(values) for values in rows}
+        with self._lock:
+            self._players = players
+            self._indexes = {(None, None): sorted((-p['rating'], p['id']) for p in players.values())}
+            self._built_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._players = None
+
+    def _index(self, department=None, level=None):
+        """Sorted keys for a filter, (re)building what's needed. Call with the lock held."""
+        if self._players is None or time.monotonic() - self._built_at > self._max_age():
+            self.rebuild()
+        key = (department or None, level or None)
+        index = self._indexes.get(key)
+        if index is None:
+            index = [
+                entry for entry in self._indexes[(None, None)]
+                if self._matches(self._players[entry[1]], *key)
+            ]
+            self._indexes[key] = index
+        return index
+
+    @staticmethod
+    def _matches(player, department, level):
+        return ((department is None or player['department'] == department)
+                and (level is None or player['level'] == level))
+
+    def _remove(self, user_id):
+        old = self._players.pop(user_id, None)
+        if old is not None:
+            for key, index in self._indexes.items():
+                if self._matches(old, *key):
+                    index.pop(bisect_left(index, (-old['rating'], old['id'])))
+
+    def update_player(self, user_id, player):
+        """Move a player to their new position (player=None removes them)"""
+        with self._lock:
+            if self._players is None or self._players.get(user_id) == player:
+                return
+            self._remove(user_id)
+            if player is None:
+                return
+            self._players[user_id] = player
+            for key, index in self._indexes.items():
+                if self._matches(player, *key):
+                    insort(index, (-player['rating'], user_id))
+
+    def _rows(self, index, start, stop):
+        """Player rows with their rank for index[start:stop]"""
+        rows = []
+        for entry in index[max(start, 0):stop]:
+            row = dict(self._players[entry[1]])
+            row['rank'] = bisect_left(index, (entry[0],)) + 1
+            rows.append(row)
+        return rows
+
+    def count(self, department=None, level=None):
+        with self._lock:
+            return len(self._index(department, level))
+
+    def top(self, n, department=None, level=None):
+        with self._lock:
+            return self._rows(self._index(department, level), 0, n)
+
+    def page(self, number, size=DEFAULT_PAGE_SIZE, department=None, level=None):
+        """Rows for a 1-based page number"""
+        start = (max(number, 1) - 1) * size
+        with self._lock:
+            return self._rows(self._index(department, level), start, start + size)
+
+    def rank(self, user_id, department=None, level=None):
+        """1-based rank of a player, or None if they are not ranked"""
+        with self._lock:
+            index = self._index(department, level)
+            player = self._players.get(user_id)
+            if player is None or not self._matches(player, department or None, level or None):
+                return None
+            return bisect_left(index, (-player['rating'],)) + 1
+
+    def around(self, user_id, radius=10, department=None, level=None):
+        """Rows for the players up to `radius` places above and below a player"""
+        with self._lock:
+            index = self._index(department, level)
+            player = self._players.get(user_id)
+            if player is None or not self._matches(player, department or None, level or None):
+                return []
+            position = bisect_left(index, (-player['rating'], user_id))
+            return self._rows(index, position - radius, position + radius + 1)
+
+
+ranking = RankingIndex()
+
+
+@receiver(post_save, sender='game.User')
+def _user_saved(sender, instance, **kwargs):
+    player = None
+    if instance.rating is not None:
+        player = _player_row([getattr(instance, field) for field in PLAYER_FIELDS])
+    transaction.on_commit(partial(ranking.update_player, instance.pk, player))
+
+
+@receiver(post_delete, sender='game.User')
+def _user_deleted(sender, instance, **kwargs):
+    transaction.on_commit(partial(ranking.update_player, instance.pk, None))
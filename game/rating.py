@@ -0,0 +1,245 @@
+"""
+Rating engine
+
+Two rating systems share one interface, chosen with
+MTU_CHESS_CONFIG['RATING_SYSTEM']:
+
+    elo      Classic Elo, K-factor by experience (40 for a player's first
+             30 games, 10 from 2400 up, 20 otherwise)
+    glicko2  Glicko-2 (Glickman), updated after every game, with the
+             rating deviation and volatility stored on the user
+
+A system's rate() works on plain Rating tuples, so the same code rates a
+single finished game (record_result) and replays the whole history
+(python manage.py recompute_ratings).
+
+Players are rated from their first game, but User.rating (what the site
+shows) stays empty until they have played MINIMUM_GAMES_FOR_RATING rated
+games.
+"""
+import math
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+
+INITIAL_RATING = 1000.0
+INITIAL_DEVIATION = 350.0
+INITIAL_VOLATILITY = 0.06
+
+Rating = namedtuple('Rating', ['points', 'deviation', 'volatility', 'games'])
+NEW_PLAYER = Rating(INITIAL_RATING, INITIAL_DEVIATION, INITIAL_VOLATILITY, 0)
+
+# Game.winner -> (white's score, white's result, black's result)
+RESULTS = {
+    'white': (1.0, 'win', 'loss'),
+    'black': (0.0, 'loss', 'win'),
+    'draw': (0.5, 'draw', 'draw'),
+}
+
+
+def _config(key, default):
+    return getattr(settings, 'MTU_CHESS_CONFIG', {}).get(key, default)
+
+
+class EloSystem:
+    name = 'elo'
+
+    @staticmethod
+    def k_factor(player):
+        if player.games < 30:
+            return 40
+        if player.points >= 2400:
+            return 10
+        return 20
+
+    def rate(self, white, black, white_score):
+        """New (white, black) ratings after a game"""
+        expected = 1.0 / (1.0 + 10 ** ((black.points - white.points) / 400.0))
+        white_change = self.k_factor(white) * (white_score - expected)
+        black_change = self.k_factor(black) * (expected - white_score)
+        return (
+            white._replace(points=white.points + white_change, games=white.games + 1),
+            black._replace(points=black.points + black_change, games=black.games + 1),
+        )
+
+
+class Glicko2System:
+    name = 'glicko2'
+
+    SCALE = 173.7178
+    TAU = 0.5               # constrains volatility changes
+    EPSILON = 0.000001      # volatility iteration tolerance
+    MIN_DEVIATION = 30.0
+    MAX_DEVIATION = INITIAL_DEVIATION
+
+    def _update(self, player, opponent, score):
+        """One player's Glicko-2 update for a single game"""
+        mu = (player.points - 1500.0) / self.SCALE
+        phi = player.deviation / self.SCALE
+        sigma = player.volatility
+        mu_j = (opponent.points - 1500.0) / self.SCALE
+        phi_j = opponent.deviation / self.SCALE
+
+        g = 1.0 / math.sqrt(1.0 + 3.0 * phi_j * phi_j / (math.pi * math.pi))
+        expected = 1.0 / (1.0 + math.exp(-g * (mu - mu_j)))
+        v = 1.0 / (g * g * expected * (1.0 - expected))
+        delta = v * g * (score - expected)
+
+        # New volatility (Illinois algorithm, step 5 of Glickman's paper)
+        a = math.log(sigma * sigma)
+        phi2 = phi * phi
+        tau2 = self.TAU * self.TAU
+
+        def f(x):
+            ex = math.exp(x)
+            d = phi2 + v + ex
+            return (ex * (delta * delta - phi2 - v - ex)) / (2.0 * d * d) - (x - a) / tau2
+
+        big_a = a
+        if delta * delta > phi2 + v:
+            big_b = math.log(delta * delta - phi2 - v)
+        else:
+            k = 1
+            while f(a - k * self.TAU) < 0:
+                k += 1
+            big_b = a - k * self.TAU
+        f_a, f_b = f(big_a), f(big_b)
+        while abs(big_b - big_a) > self.EPSILON:
+            big_c = big_a + (big_a - big_b) * f_a / (f_b - f_a)
+            f_c = f(big_c)
+            if f_c * f_b <= 0:
+                big_a, f_a = big_b, f_b
+            else:
+                f_a /= 2.0
+            big_b, f_b = big_c, f_c
+        new_sigma = math.exp(big_a / 2.0)
+
+        phi_star = math.sqrt(phi2 + new_sigma * new_sigma)
+        new_phi = 1.0 / math.sqrt(1.0 / (phi_star * phi_star) + 1.0 / v)
+        new_mu = mu + new_phi * new_phi * g * (score - expected)
+
+        deviation = min(self.MAX_DEVIATION, max(self.MIN_DEVIATION, new_phi * self.SCALE))
+        return Rating(new_mu * self.SCALE + 1500.0, deviation, new_sigma, player.games + 1)
+
+    def rate(self, white, black, white_score):
+        """New (white, black) ratings after a game"""
+        return (
+            self._update(white, black, white_score),
+            self._update(black, white, 1.0 - white_score),
+        )
+
+
+RATING_SYSTEMS = {system.name: system for system in (EloSystem(), Glicko2System())}
+
+
+def get_rating_system(name=None):
+    """The configured rating system (or the one named)"""
+    return RATING_SYSTEMS[name or _config('RATING_SYSTEM', 'glicko2')]
+
+
+def published_rating(rating):
+    """Value for User.rating: None until enough games have been played"""
+    if rating.games < _config('MINIMUM_GAMES_FOR_RATING', 5):
+        return None
+    return int(round(rating.points))
+
+
+# ============================================
+# USERS
+# ============================================
+
+RESULT_FIELDS = [
+    'total_games', 'wins', 'losses', 'draws', 'current_win_streak', 'longest_win_streak',
+    'achievements', 'rating', 'rating_assigned', 'rating_points', 'rating_deviation',
+    'rating_volatility',
+]
+
+
+def user_rating(user):
+    return Rating(user.rating_points, user.rating_deviation, user.rating_volatility, user.total_games)
+
+
+def set_user_rating(user, rating):
+    user.rating_points = rating.points
+    user.rating_deviation = rating.deviation
+    user.rating_volatility = rating.volatility
+    user.rating = published_rating(rating)
+    user.rating_assigned = user.rating is not None
+
+
+def history_entry(user_id, game_id, recorded_at, rating):
+    """Unsaved RatingHistory row for a rating reached after a game"""
+    from .models import RatingHistory
+
+    return RatingHistory(
+        user_id=user_id, game_id=game_id, recorded_at=recorded_at,
+        rating=int(round(rating.points)), deviation=int(round(rating.deviation)),
+    )
+
+
+def record_result(game, winner):
+    """
+    Update both players' stats and ratings for a finished rated game.
+
+    Both user rows are locked and saved in one transaction, with a
+    RatingHistory row for each. Returns the updated (white, black) users.
+    """
+    from .models import RatingHistory, User
+
+    white_score, white_result, black_result = RESULTS[winner]
+    with transaction.atomic():
+        users = User.objects.select_for_update().in_bulk([game.white_player_id, game.black_player_id])
+        white, black = users[game.white_player_id], users[game.black_player_id]
+
+        new_white, new_black = get_rating_system().rate(user_rating(white), user_rating(black), white_score)
+        for user, rating, result in ((white, new_white, white_result), (black, new_black, black_result)):
+            set_user_rating(user, rating)
+            user.update_stats(result, save=False)
+            user.save(update_fields=RESULT_FIELDS)
+        RatingHistory.objects.bulk_create([
+            history_entry(white.pk, game.pk, game.completed_at, new_white),
+            history_entry(black.pk, game.pk, game.completed_at, new_black),
+        ])
+    return white, black
+
+
+# ============================================
+# HISTORY
+# ============================================
+
+def downsample(points, max_points):
+    """
+    Reduce a time-ordered [(time, rating)] series to at most max_points.
+
+    The range is split into equal-count buckets; each bucket keeps its
+    lowest and highest rating (in time order) so peaks and dips survive,
+    and the last point is always kept.
+    """
+    if len(points) <= max_points:
+        return points
+    buckets = max(1, max_points // 2)
+    size = len(points) / buckets
+    result = []
+    for i in range(buckets):
+        bucket = points[int(i * size):int((i + 1) * size)]
+        if not bucket:
+            continue
+        low = min(bucket, key=lambda point: point[1])
+        high = max(bucket, key=lambda point: point[1])
+        result.extend(sorted({low, high}))
+    if result[-1] != points[-1]:
+        result[-1] = points[-1]
+    return result
+
+
+def rating_series(user, start=None, end=None, max_points=200):
+    """A user's (recorded_at, rating) history between two datetimes, downsampled"""
+    from .models import RatingHistory
+
+    history = RatingHistory.objects.filter(user=user)
+    if start:
+        history = history.filter(recorded_at__gte=start)
+    if end:
+        history = history.filter(recorded_at__lte=end)
+    return downsample(list(history.order_by('recorded_at').values_list('recorded_at', 'rating')), max_points)
@@ -0,0 +1,117 @@
+"""
+Live game updates (publish/subscribe)
+
+Views publish small "delta" messages for a game code and every browser
+watching that game (both players and spectators) receives them over the
+WebSocket served from lan_chess/asgi.py. Publishing is safe to call from
+normal synchronous Django views.
+"""
+import asyncio
+import logging
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class LocalChannelLayer:
+    """
+    In-process fan-out of game messages.
+
+    Every subscriber is an asyncio.Queue that lives on the event loop of the
+    connection that created it, so messages are handed over with
+    call_soon_threadsafe. This only reaches clients connected to the same
+    worker process; a shared layer (e.g. Redis pub/sub) with the same
+    subscribe/unsubscribe/publish methods can be plugged in through
+    MTU_CHESS_CONFIG['REALTIME_LAYER'] when running several workers.
+    """
+
+    def __init__(self):
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, code):
+        """Create a queue receiving every message for a game (call from the event loop)"""
+        queue = asyncio.Queue()
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._groups.setdefault(code, set()).add(subscriber)
+        return queue
+
+    def unsubscribe(self, code, queue):
+        """Stop delivering messages to a queue"""
+        with self._lock:
+            subscribers = self._groups.get(code)
+            if not subscribers:
+                return
+            subscribers.difference_update({s for s in subscribers if s[1] is queue})
+            if not subscribers:
+                del self._groups[code]
+
+    def publish(self, code, message):
+        """Send a message to every subscriber of a game (thread safe)"""
+        with self._lock:
+            subscribers = list(self._groups.get(code, ()))
+
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+            except RuntimeError:
+                # Event loop already closed - connection is gone
+                self.unsubscribe(code, queue)
+
+    def subscriber_count(self, code):
+        with self._lock:
+            return len(self._groups.get(code, ()))
+
+
+_layer = None
+_layer_lock = threading.Lock()
+
+
+def get_channel_layer():
+    """Return the configured channel layer (created once per process)"""
+    global _layer
+    if _layer is None:
+        with _layer_lock:
+            if _layer is None:
+                path = getattr(settings, 'MTU_CHESS_CONFIG', {}).get(
+                    'REALTIME_LAYER', 'game.realtime.LocalChannelLayer'
+                )
+                _layer = import_string(path)()
+    return _layer
+
+
+def publish_game_event(game, event, **fields):
+    """
+    Publish a compact delta for a game.
+
+    Only what changed is sent: the event name, the new FEN, status, clocks,
+    the pending draw offer and any extra fields (e.g. the SAN of the last move).
+    """
+    timer_state = game.get_timer_state()
+    message = {
+        'type': event,
+        'code': game.code,
+        'version': game.state_version,
+        'fen': game.fen,
+        'status': game.status,
+        'move_count': game.move_count,
+        'white_time': timer_state['white_time'],
+        'black_time': timer_state['black_time'],
+        'white_time_ms': timer_state['white_time_ms'],
+        'black_time_ms': timer_state['black_time_ms'],
+        'draw_offer': game.get_draw_offer(),
+    }
+    if game.status == 'completed':
+        message['winner'] = game.winner
+        message['result_reason'] = game.result_reason
+    message.update(fields)
+
+    try:
+        get_channel_layer().publish(game.code, message)
+    except Exception:
+        # Live updates are best effort; clients fall back to polling
+        logger.exception("Failed to publish %s for game %s", event, game.code)
@@ -0,0 +1,122 @@
+"""
+Repetition and fifty-move tracking for live games
+
+The FEN of a game carries its half-move clock, but not the positions
+before it, so a Board loaded from it can't see a repetition. Each live
+game has a PositionHistory here instead: how often each position since
+the last capture or pawn move occurred (no earlier position can occur
+again), keyed by Zobrist hash. commit_move() adds the hash Board.push
+computed incrementally after every move, so a repetition check is one
+dict lookup and nothing rescans the game's moves.
+
+    history = position_histories.get(game, board)   # before the move
+    board.push(move)
+    occurrences = history.push(board)
+
+Fivefold repetition and the seventy-five-move rule end a game by
+themselves; after threefold repetition or fifty moves either player may
+claim a draw (claimable(), services.claim_draw).
+
+A history is rebuilt from Game.move_data when this process hasn't seen
+the game or the history is out of step with it (a move committed by
+another process, or rolled back after the history was updated), which
+it notices from the ply and hash it is at. Finished games are dropped.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .board import Board
+from .movecodec import codes, decode_uci
+
+CLAIM_REPETITIONS = 3
+CLAIM_HALFMOVES = 100
+
+
+class PositionHistory:
+    """Occurrences of each position since the last irreversible move of a game"""
+    __slots__ = ('ply', 'hash', 'halfmove_clock', 'counts')
+
+    def __init__(self, board=None):
+        board = Board() if board is None else board
+        self.ply = 0
+        self.hash = board.hash
+        self.halfmove_clock = board.halfmove_clock
+        self.counts = {board.hash: 1}
+
+    def push(self, board):
+        """Record the position after a move; returns how often it has occurred"""
+        if board.halfmove_clock == 0:
+            # A capture or pawn move: nothing before it can repeat
+            self.counts = {}
+        occurrences = self.counts.get(board.hash, 0) + 1
+        self.counts[board.hash] = occurrences
+        self.ply += 1
+        self.hash = board.hash
+        self.halfmove_clock = board.halfmove_clock
+        return occurrences
+
+    def occurrences(self):
+        """How often the current position has occurred"""
+        return self.counts.get(self.hash, 0)
+
+    def claimable(self):
+        """'repetition' or 'fifty_move' if a draw can be claimed now, else None"""
+        if self.occurrences() >= CLAIM_REPETITIONS:
+            return 'repetition'
+        if self.halfmove_clock >= CLAIM_HALFMOVES:
+            return 'fifty_move'
+        return None
+
+    @classmethod
+    def replay(cls, move_data):
+        """History of a game from its moves"""
+        board = Board()
+        history = cls(board)
+        for code in codes(move_data):
+            board.push(board.parse_uci(decode_uci(code)))
+            history.push(board)
+        return history
+
+
+class PositionHistoryStore:
+    """Game code -> PositionHistory of the live games this process has seen"""
+
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = getattr(settings, 'MTU_CHESS_CONFIG', {}).get('GAME_CACHE_SIZE', 1000)
+        self.max_size = max_size
+        self._histories = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, game, board=None):
+        """
+        The history of a game at its current position (rebuilt if missing
+        or out of step). `board` is the game's position if already loaded.
+        Call with the game row locked.
+        """
+        board_hash = (Board(game.fen) if board is None else board).hash
+        with self._lock:
+            history = self._histories.get(game.code)
+            if history is not None and history.ply == game.move_count and history.hash == board_hash:
+                self._histories.move_to_end(game.code)
+                return history
+        history = PositionHistory.replay(game.move_data)
+        with self._lock:
+            self._histories[game.code] = history
+            self._histories.move_to_end(game.code)
+            while len(self._histories) > self.max_size:
+                self._histories.popitem(last=False)
+        return history
+
+    def discard(self, code):
+        with self._lock:
+            self._histories.pop(code, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._histories)
+
+
+position_histories = PositionHistoryStore()
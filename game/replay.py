@@ -0,0 +1,132 @@
+"""
+Game replay
+
+A finished game never changes, so the first request for its replay
+builds a GameReplay row once: the FEN at every REPLAY_KEYFRAME_PLIES-th
+ply, every move as UCI, and the whole replay as one gzip-compressed JSON
+document. Move rows keep their fen_after, but nothing here reads them;
+seeking to a ply loads the last keyframe before it and plays at most
+REPLAY_KEYFRAME_PLIES moves, whatever the length of the game.
+
+    position_at(replay, ply)   FEN after `ply` plies and the move played
+    get_replay(game)           the game's replay, built on first use
+
+The replay document (replay_document) carries the keyframes and moves,
+so a client can scrub through the game the same way without asking the
+server again.
+"""
+import gzip
+import json
+
+from django.conf import settings
+from django.db import IntegrityError
+
+from .board import Board, move_to_uci
+from .movecodec import replay
+
+DEFAULT_KEYFRAME_PLIES = 16
+FINISHED = ('completed', 'abandoned')
+
+
+def _keyframe_plies():
+    return max(1, getattr(settings, 'MTU_CHESS_CONFIG', {}).get('REPLAY_KEYFRAME_PLIES', DEFAULT_KEYFRAME_PLIES))
+
+
+def is_finished(game):
+    return game.status in FINISHED
+
+
+def replay_document(game, interval, keyframes, moves, sans, clocks):
+    """The replay as served to clients"""
+    return {
+        'code': game.code,
+        'white_player': game.get_white_display_name(),
+        'black_player': game.get_black_display_name(),
+        'winner': game.winner,
+        'result_reason': game.result_reason,
+        'keyframe_interval': interval,
+        'keyframes': keyframes,
+        'moves': moves,
+        'sans': sans,
+        'clocks': clocks,
+    }
+
+
+def build_replay(game):
+    """An unsaved GameReplay for a finished game"""
+    from .models import GameReplay, Move
+
+    interval = _keyframe_plies()
+    board = Board()
+    keyframes, moves, sans = [], [], []
+    for ply, (board, move) in enumerate(replay(game.move_data, board)):
+        if ply % interval == 0:
+            keyframes.append(board.fen())
+        moves.append(move_to_uci(move))
+        sans.append(board.san(move))
+    if len(moves) % interval == 0:
+        keyframes.append(board.fen())
+
+    # Clocks are only known for games played here (not every import)
+    clocks = list(Move.objects.filter(game=game).order_by('move_number').values_list('clock_ms', flat=True))
+    if len(clocks) != len(sans):
+        clocks = None
+
+    document = replay_document(game, interval, keyframes, moves, sans, clocks)
+    data = gzip.compress(json.dumps(document, separators=(',', ':')).encode(), mtime=0)
+    return GameReplay(
+        game=game, keyframe_interval=interval,
+        keyframes='\n'.join(keyframes), moves=' '.join(moves), data=data,
+    )
+
+
+def get_replay(game, with_data=False):
+    """
+    A finished game's GameReplay, building and storing it on first use.
+    Without with_data the compressed document isn't loaded.
+    """
+    from .models import GameReplay
+
+    replays = GameReplay.objects.all() if with_data else GameReplay.objects.defer('data')
+    replay = replays.filter(game=game).first()
+    if replay is not None:
+        return replay
+    replay = build_replay(game)
+    try:
+        replay.save()
+    except IntegrityError:
+        # Built by a concurrent request meanwhile
+        replay = replays.get(game=game)
+    return replay
+
+
+def position_at(replay, ply):
+    """
+    (FEN after `ply` plies, (SAN, UCI) of the move that led to it or None),
+    from the last keyframe before that move. Raises IndexError if the game
+    is shorter.
+    """
+    if ply < 0:
+        raise IndexError(ply)
+    if ply == 0:
+        return replay.keyframes.split('\n', 1)[0], None
+    interval = replay.keyframe_interval
+    index = (ply - 1) // interval
+    # Only the keyframe needed and the moves after it are split out
+    keyframe = replay.keyframes.split('\n', index + 1)[index]
+    moves = replay.moves.split()[index * interval:ply]
+    if len(moves) != ply - index * interval:
+        raise IndexError(ply)
+
+    board = Board(keyframe)
+    for uci in moves[:-1]:
+        board.push(board.parse_uci(uci))
+    last = board.parse_uci(moves[-1])
+    san = board.san(last)
+    board.push(last)
+    return board.fen(), (san, moves[-1])
+
+
+def decompressed(replay):
+    """The replay document as JSON text, for clients that don't accept gzip"""
+    return gzip.decompress(bytes(replay.data))
@@ -0,0 +1,167 @@
+"""
+Background deadline scheduler
+
+A single daemon thread runs callbacks at given times. Entries live in a
+heap keyed by deadline, so scheduling or moving a deadline is O(log n);
+replaced or cancelled entries are skipped lazily when they reach the top.
+
+Its main job is the game clocks: every committed change to an active game
+re-schedules that game's flag-fall deadline, and when it passes the game
+is completed on time even if the player never moves again.
+
+It also runs the periodic stale game sweep (game/sweeper.py), and on
+start restarts computer opponent searches and analysis jobs a restart
+interrupted.
+
+The scheduler is started by lan_chess/wsgi.py and lan_chess/asgi.py when
+MTU_CHESS_CONFIG['ENABLE_CLOCK_SCHEDULER'] is on, so management commands
+don't run it.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """Run callbacks at (epoch) deadlines from one background thread"""
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, key, when, callback):
+        """Run callback at `when` (epoch seconds), replacing any entry with the same key"""
+        with self._cond:
+            self._entries[key] = (when, callback)
+            heapq.heappush(self._heap, (when, next(self._counter), key))
+            if self._heap[0][2] == key:
+                self._cond.notify()
+            # Drop stale heap items once they dominate
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._heap = [item for item in self._heap
+                              if self._entries.get(item[2], (None,))[0] == item[0]]
+                heapq.heapify(self._heap)
+
+    def cancel(self, key):
+        with self._cond:
+            self._entries.pop(key, None)
+
+    def deadline(self, key):
+        with self._cond:
+            entry = self._entries.get(key)
+            return entry[0] if entry else None
+
+    def __len__(self):
+        with self._cond:
+            return len(self._entries)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, on_start=None):
+        """Start the background thread (once per process)"""
+        with self._cond:
+            if self.running:
+                return
+            self._thread = threading.Thread(
+                target=self._run, args=(on_start,), name='game-scheduler', daemon=True
+            )
+            self._thread.start()
+
+    def _next_due(self):
+        """Block until an entry is due, then remove and return its callback"""
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                when, _, key = self._heap[0]
+                entry = self._entries.get(key)
+                if entry is None or entry[0] != when:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = when - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                del self._entries[key]
+                return entry[1]
+
+    def _run(self, on_start):
+        if on_start is not None:
+            self._call(on_start)
+        while True:
+            self._call(self._next_due())
+
+    def _call(self, callback):
+        close_old_connections()
+        try:
+            callback()
+        except Exception:
+            logger.exception("Scheduled task %r failed", callback)
+        finally:
+            close_old_connections()
+
+
+scheduler = DeadlineScheduler()
+
+
+# ============================================
+# GAME CLOCKS
+# ============================================
+
+def _flag_fall_due(code):
+    from .services import flag_if_out_of_time
+
+    game = flag_if_out_of_time(code)
+    if game is not None and game.status == 'active':
+        # Clock moved on (e.g. a move arrived just in time); track the new deadline
+        track_game_clock(game)
+
+
+def track_game_clock(game):
+    """Schedule (or cancel) the flag-fall check for a game's running clock"""
+    key = ('clock', game.code)
+    deadline = game.get_clock_deadline()
+    if deadline is None:
+        scheduler.cancel(key)
+    else:
+        scheduler.schedule(key, deadline, partial(_flag_fall_due, game.code))
+
+
+def _load_active_clocks():
+    """Pick up the clocks of games that were active before a restart"""
+    from .models import Game
+
+    for game in Game.objects.filter(status='active').iterator():
+        track_game_clock(game)
+
+
+def _on_start():
+    from .analysis import resume_analysis
+    from .computer import resume_engine_games
+    from .sweeper import schedule_sweeps
+
+    _load_active_clocks()
+    resume_engine_games()
+    resume_analysis()
+    schedule_sweeps()
+
+
+def start_scheduler():
+    """Start the scheduler if enabled in MTU_CHESS_CONFIG"""
+    if getattr(settings, 'MTU_CHESS_CONFIG', {}).get('ENABLE_CLOCK_SCHEDULER', True):
+        scheduler.start(on_start=_on_start)
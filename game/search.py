@@ -0,0 +1,476 @@
+"""
+Computer opponent search
+
+A pure-Python alpha-beta searcher over the server Board:
+
+- iterative deepening, principal variation search and check extensions
+- a transposition table keyed by the Zobrist hash
+- move ordering: table move, captures by MVV-LVA, two killer moves per
+  ply, then quiet moves by the history heuristic
+- quiescence search over captures and promotions
+- material + piece-square evaluation, updated incrementally per move
+
+A search stops at its depth, node or time budget, whichever comes first,
+and plays the best move of the last completed iteration. LEVELS are the
+budgets behind the "play vs computer" strength levels (see computer.py,
+which runs searches in a process pool); evaluate_positions() scores the
+positions of finished games for analysis.py.
+
+    >>> result = Searcher(Board()).search(depth=3)
+    >>> result.san, result.score
+"""
+import time
+from collections import namedtuple
+
+from .board import (
+    BISHOP, BLACK, CASTLE, EN_PASSANT, KING, KNIGHT, PAWN, QUEEN, ROOK, SQUARES, WHITE, Board,
+    move_to_uci,
+)
+from .movecodec import board_after
+
+MAX_PLY = 64
+MATE = 100_000
+MATE_BOUND = MATE - MAX_PLY
+INFINITY = 1_000_000
+NODE_CHECK_INTERVAL = 1024
+TT_MAX_ENTRIES = 1_000_000
+
+# Transposition table entry bounds
+EXACT, LOWER, UPPER = 0, 1, 2
+
+Limits = namedtuple('Limits', ['depth', 'nodes', 'time_ms'])
+
+# Strength levels: the search stops at whichever budget runs out first
+LEVELS = {
+    1: Limits(depth=1, nodes=500, time_ms=200),
+    2: Limits(depth=2, nodes=3_000, time_ms=500),
+    3: Limits(depth=3, nodes=15_000, time_ms=1_500),
+    4: Limits(depth=5, nodes=60_000, time_ms=4_000),
+    5: Limits(depth=MAX_PLY, nodes=250_000, time_ms=10_000),
+}
+DEFAULT_LEVEL = 3
+
+# score is in centipawns for the side to move; pv is a list of SAN
+SearchResult = namedtuple('SearchResult', ['uci', 'san', 'score', 'depth', 'nodes', 'time_ms', 'pv'])
+
+PIECE_VALUES = {PAWN: 100, KNIGHT: 320, BISHOP: 330, ROOK: 500, QUEEN: 900, KING: 0}
+# For MVV-LVA ordering (index by piece type; 0 = empty)
+ORDER_VALUES = (0, 1, 3, 3, 5, 9, 20)
+
+# Piece-square tables from white's side, a8..h8 first
+_PST = {
+    PAWN: (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ),
+    KNIGHT: (
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50,
+    ),
+    BISHOP: (
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20,
+    ),
+    ROOK: (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0,
+    ),
+    QUEEN: (
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20,
+    ),
+}
+_KING_MIDDLEGAME = (
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20, 0, 0, 0, 0, 20, 20,
+    20, 30, 10, 0, 0, 10, 30, 20,
+)
+_KING_ENDGAME = (
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+)
+
+
+def _build_tables(king_table):
+    """
+    Material + position value of every piece on every 0x88 square, from
+    white's point of view (black pieces count negative)
+    """
+    tables = [[0] * 128 for _ in range(24)]
+    for kind, value in PIECE_VALUES.items():
+        pst = king_table if kind == KING else _PST[kind]
+        for sq in SQUARES:
+            rank, file = sq >> 4, sq & 7
+            tables[WHITE | kind][sq] = value + pst[(7 - rank) * 8 + file]
+            tables[BLACK | kind][sq] = -(value + pst[rank * 8 + file])
+    return tables
+
+
+MIDDLEGAME_TABLES = _build_tables(_KING_MIDDLEGAME)
+ENDGAME_TABLES = _build_tables(_KING_ENDGAME)
+
+
+class SearchAborted(Exception):
+    """The node or time budget ran out in the middle of an iteration"""
+
+
+class Searcher:
+    """Searches one position; the transposition table may be shared between searches"""
+
+    def __init__(self, board, tt=None):
+        self.board = board
+        self.tt = {} if tt is None else tt
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = [0] * (24 * 128)
+        self.nodes = 0
+        self.node_limit = None
+        self.deadline = None
+        self.tables = MIDDLEGAME_TABLES
+
+    # ------------------------------------------------------------------
+    # Evaluation
+    # ------------------------------------------------------------------
+
+    def _is_endgame(self):
+        """No queens left, or little else besides them (rooks count as two minor pieces)"""
+        squares = self.board.squares
+        queens = minors = 0
+        for sq in SQUARES:
+            kind = squares[sq] & 7
+            if kind == QUEEN:
+                queens += 1
+            elif kind == ROOK:
+                minors += 2
+            elif kind == KNIGHT or kind == BISHOP:
+                minors += 1
+        return queens == 0 or minors <= 2
+
+    def evaluate(self):
+        """Static evaluation from white's point of view, computed from scratch"""
+        squares = self.board.squares
+        tables = self.tables
+        return sum(tables[squares[sq]][sq] for sq in SQUARES if squares[sq])
+
+    def _delta(self, move):
+        """Change of the white-side evaluation made by a move (before pushing it)"""
+        tables = self.tables
+        squares = self.board.squares
+        frm = move & 127
+        to = (move >> 7) & 127
+        promotion = (move >> 14) & 7
+        flag = move >> 17
+        piece = squares[frm]
+        placed = (piece & 24) | promotion if promotion else piece
+        delta = tables[placed][to] - tables[piece][frm]
+        captured = squares[to]
+        if captured:
+            delta -= tables[captured][to]
+        elif flag == EN_PASSANT:
+            cap_sq = to - 16 if piece & 24 == WHITE else to + 16
+            delta -= tables[squares[cap_sq]][cap_sq]
+        elif flag == CASTLE:
+            rook_from, rook_to = (frm + 3, frm + 1) if to > frm else (frm - 4, frm - 1)
+            rook = squares[rook_from]
+            delta += tables[rook][rook_to] - tables[rook][rook_from]
+        return delta
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+
+    def _count_node(self):
+        self.nodes += 1
+        if self.nodes % NODE_CHECK_INTERVAL == 0:
+            if self.node_limit is not None and self.nodes >= self.node_limit:
+                raise SearchAborted
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                raise SearchAborted
+
+    def _ordered(self, moves, tt_move, ply):
+        """Moves best-first: table move, captures (MVV-LVA), killers, history"""
+        squares = self.board.squares
+        killer1, killer2 = self.killers[ply]
+        history = self.history
+        scored = []
+        for move in moves:
+            if move == tt_move:
+                scored.append((1 << 30, move))
+                continue
+            victim = squares[(move >> 7) & 127]
+            promotion = (move >> 14) & 7
+            if victim or promotion or move >> 17 == EN_PASSANT:
+                score = (1 << 24) + ORDER_VALUES[victim & 7] * 16 - ORDER_VALUES[squares[move & 127] & 7]
+                score += ORDER_VALUES[promotion] * 16
+            elif move == killer1:
+                score = 1 << 23
+            elif move == killer2:
+                score = (1 << 23) - 1
+            else:
+                score = history[squares[move & 127] * 128 + ((move >> 7) & 127)]
+            scored.append((score, move))
+        scored.sort(reverse=True)
+        return [move for _, move in scored]
+
+    def _quiesce(self, alpha, beta, ply, evaluation):
+        self._count_node()
+        board = self.board
+        us = board.turn
+        stand_pat = evaluation if us == WHITE else -evaluation
+        if stand_pat >= beta or ply >= MAX_PLY:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        squares = board.squares
+        captures = [
+            move for move in board.pseudo_legal_moves()
+            if squares[(move >> 7) & 127] or (move >> 14) & 7 or move >> 17 == EN_PASSANT
+        ]
+        them = us ^ 24
+        for move in self._ordered(captures, 0, ply):
+            delta = self._delta(move)
+            board.push(move)
+            if board.is_attacked(board.king_squares[us], them):
+                board.pop()
+                continue
+            score = -self._quiesce(-beta, -alpha, ply + 1, evaluation + delta)
+            board.pop()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def _negamax(self, depth, alpha, beta, ply, evaluation):
+        self._count_node()
+        board = self.board
+        if ply:
+            if board.halfmove_clock >= 100 or board.repetitions.get(board.hash, 0) > 1:
+                return 0
+            if ply >= MAX_PLY:
+                return evaluation if board.turn == WHITE else -evaluation
+
+        in_check = board.in_check()
+        if in_check:
+            depth += 1
+        if depth <= 0:
+            return self._quiesce(alpha, beta, ply, evaluation)
+
+        original_alpha = alpha
+        tt_move = 0
+        entry = self.tt.get(board.hash)
+        if entry is not None:
+            entry_depth, bound, score, tt_move = entry
+            if ply and entry_depth >= depth:
+                if score > MATE_BOUND:
+                    score -= ply
+                elif score < -MATE_BOUND:
+                    score += ply
+                if bound == EXACT:
+                    return score
+                if bound == LOWER and score >= beta:
+                    return score
+                if bound == UPPER and score <= alpha:
+                    return score
+
+        us = board.turn
+        them = us ^ 24
+        squares = board.squares
+        best_score = -INFINITY
+        best_move = 0
+        legal = 0
+        for move in self._ordered(board.pseudo_legal_moves(), tt_move, ply):
+            delta = self._delta(move)
+            quiet = not squares[(move >> 7) & 127] and not (move >> 14) & 7 and move >> 17 != EN_PASSANT
+            piece = squares[move & 127]
+            board.push(move)
+            if board.is_attacked(board.king_squares[us], them):
+                board.pop()
+                continue
+            legal += 1
+            child = evaluation + delta
+            if legal == 1:
+                score = -self._negamax(depth - 1, -beta, -alpha, ply + 1, child)
+            else:
+                # Null window first; re-search only if the move might be better
+                score = -self._negamax(depth - 1, -alpha - 1, -alpha, ply + 1, child)
+                if alpha < score < beta:
+                    score = -self._negamax(depth - 1, -beta, -alpha, ply + 1, child)
+            board.pop()
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if ply == 0:
+                    self.root_best = (move, score)
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if quiet:
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1] = killers[0]
+                                killers[0] = move
+                            self.history[piece * 128 + ((move >> 7) & 127)] += depth * depth
+                        break
+
+        if not legal:
+            return -MATE + ply if in_check else 0
+
+        if best_score <= original_alpha:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        stored = best_score
+        if stored > MATE_BOUND:
+            stored += ply
+        elif stored < -MATE_BOUND:
+            stored -= ply
+        if len(self.tt) >= TT_MAX_ENTRIES:
+            self.tt.clear()
+        self.tt[board.hash] = (depth, bound, stored, best_move)
+        return best_score
+
+    def _principal_variation(self, first_move, length):
+        """SAN of the best line, following the transposition table"""
+        board = self.board
+        pv = []
+        move = first_move
+        while move and len(pv) < length:
+            if move not in board.legal_moves():
+                break
+            pv.append(board.san(move))
+            board.push(move)
+            entry = self.tt.get(board.hash)
+            move = entry[3] if entry else 0
+        for _ in pv:
+            board.pop()
+        return pv
+
+    def search(self, depth=MAX_PLY, nodes=None, time_ms=None, analyse=False):
+        """
+        Best move by iterative deepening within the budgets (a SearchResult,
+        uci None if there is no legal move). With analyse, a forced move is
+        searched too, for its score.
+        """
+        start = time.perf_counter()
+        board = self.board
+        self.nodes = 0
+        self.node_limit = nodes
+        self.deadline = start + time_ms / 1000 if time_ms else None
+        self.tables = ENDGAME_TABLES if self._is_endgame() else MIDDLEGAME_TABLES
+        evaluation = self.evaluate()
+
+        root_moves = board.legal_moves()
+        best = None
+        completed = 0
+        if root_moves:
+            best = (self._ordered(root_moves, 0, 0)[0], 0)
+        stack_size = len(board.stack)
+        for iteration in range(1, min(depth, MAX_PLY) + 1):
+            if not root_moves or (len(root_moves) == 1 and not analyse):
+                break
+            self.root_best = None
+            try:
+                score = self._negamax(iteration, -INFINITY, INFINITY, 0, evaluation)
+            except SearchAborted:
+                while len(board.stack) > stack_size:
+                    board.pop()
+                # A move that beat the previous best in the unfinished
+                # iteration is still an improvement
+                if self.root_best is not None:
+                    best = self.root_best
+                break
+            best = (self.root_best[0], score)
+            completed = iteration
+            if abs(score) > MATE_BOUND:
+                break
+            # Another iteration would take several times as long as this one
+            if self.deadline is not None and time.perf_counter() - start > (self.deadline - start) / 2:
+                break
+
+        elapsed_ms = int((time.perf_counter() - start) * 1000)
+        if best is None:
+            return SearchResult(None, None, 0, 0, self.nodes, elapsed_ms, [])
+        move, score = best
+        return SearchResult(
+            uci=move_to_uci(move),
+            san=board.san(move),
+            score=score,
+            depth=completed,
+            nodes=self.nodes,
+            time_ms=elapsed_ms,
+            pv=self._principal_variation(move, max(completed, 1)),
+        )
+
+
+def best_move(move_data, depth=MAX_PLY, nodes=None, time_ms=None):
+    """
+    Search the position after a game's moves (Game.move_data, replayed
+    from the start so repetitions are known). Runs in the engine worker
+    processes.
+    """
+    return Searcher(board_after(move_data)).search(depth=depth, nodes=nodes, time_ms=time_ms)
+
+
+def evaluate_positions(fens, depth=MAX_PLY, nodes=None):
+    """
+    (score from white's point of view, best move UCI, depth) for each
+    position, for game analysis; a mated side scores -MATE. Each position
+    is searched from its FEN alone, so the result doesn't depend on the
+    game that reached it, while one transposition table is shared between
+    them. Runs in the analysis worker processes.
+    """
+    tt = {}
+    results = []
+    for fen in fens:
+        board = Board(fen)
+        result = Searcher(board, tt).search(depth=depth, nodes=nodes, analyse=True)
+        score = result.score
+        if result.uci is None and board.in_check():
+            score = -MATE
+        results.append((score if board.turn == WHITE else -score, result.uci, result.depth))
+    return results
@@ -0,0 +1,457 @@
+"""
+Game write services
+
+commit_move() is the single write path for a move: it validates the move
+against the stored position and applies the new FEN, clocks and (if
+the game ended) the result in one transaction with a single UPDATE of
+the changed Game columns, together with the INSERT of the Move row.
+
+Resignation, draw offers, acceptances and claims go through the same
+kind of locked, version-checked update (resign, offer_draw, accept_draw,
+cancel_draw_offer, claim_draw), so a game is only ever completed once
+and a draw can only be agreed while an offer is pending.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from .board import Board, IllegalMoveError, WHITE, move_to_uci
+from .clocks import get_time_control
+from .computer import engine_name, request_engine_move
+from .models import Game, GameSession, START_FEN, StaleGameError
+from .realtime import publish_game_event
+from .repetition import position_histories
+
+# Columns a move can change
+MOVE_FIELDS = (
+    'fen', 'move_count', 'move_data',
+    'white_time_ms', 'black_time_ms',
+    'last_move_time', 'timer_last_updated',
+)
+COMPLETION_FIELDS = ('status', 'completed_at', 'winner', 'result_reason')
+START_FIELDS = ('status', 'started_at', 'last_move_time', 'timer_last_updated')
+DRAW_OFFER_FIELDS = ('draw_offered_by', 'draw_offer_ply', 'draw_offer_expires')
+
+DEFAULT_DRAW_OFFER_SECONDS = 60
+
+
+def new_game_codes(count):
+    """`count` random unused 6-character game codes (one query per attempt)"""
+    codes = set()
+    while len(codes) < count:
+        candidates = {get_random_string(6).upper() for _ in range(count - len(codes))} - codes
+        taken = set(Game.objects.filter(code__in=candidates).values_list('code', flat=True))
+        codes |= candidates - taken
+    return list(codes)
+
+
+def new_game_code():
+    """Random unused 6-character game code"""
+    return new_game_codes(1)[0]
+
+
+def create_matched_game(white_id, black_id, time_control, white_session='', black_session='', confirm=None):
+    """
+    Create an active game between two users, with both GameSession rows,
+    in one transaction (used by matchmaking). confirm(game), if given, is
+    called once the rows are written; if it returns False the transaction
+    is rolled back and None returned.
+    """
+    now = timezone.now()
+    initial_ms = get_time_control(time_control).base_ms
+    # Pick the code first so the transaction starts with its first write
+    code = new_game_code()
+    with transaction.atomic():
+        game = Game.objects.create(
+            code=code,
+            fen=START_FEN,
+            status='active',
+            time_control=time_control,
+            is_rated=True,
+            white_player_id=white_id,
+            black_player_id=black_id,
+            white_time_ms=initial_ms,
+            black_time_ms=initial_ms,
+            started_at=now,
+            last_move_time=now,
+            timer_last_updated=now,
+        )
+        GameSession.objects.bulk_create([
+            # Session keys are unique per game: fall back to one per user
+            GameSession(user_id=white_id, game=game, session_key=white_session or f'user:{white_id}', color='white'),
+            GameSession(user_id=black_id, game=game, session_key=black_session or f'user:{black_id}', color='black'),
+        ])
+        if confirm is not None and not confirm(game):
+            transaction.set_rollback(True)
+            return None
+    return game
+
+
+def create_computer_game(color, level, time_control, user=None, guest_name=None, session_key=''):
+    """
+    Create an active, unrated game against the computer: the player has
+    `color`, the engine the other side at `level`. If the engine has
+    white, its first search starts when the game is committed.
+    """
+    now = timezone.now()
+    initial_ms = get_time_control(time_control).base_ms
+    engine_color = 'black' if color == 'white' else 'white'
+    player = user if user is not None and user.is_authenticated else None
+    code = new_game_code()
+    with transaction.atomic():
+        game = Game.objects.create(
+            code=code,
+            fen=START_FEN,
+            status='active',
+            time_control=time_control,
+            is_rated=False,
+            engine_color=engine_color,
+            engine_level=level,
+            white_time_ms=initial_ms,
+            black_time_ms=initial_ms,
+            started_at=now,
+            last_move_time=now,
+            timer_last_updated=now,
+            **{
+                f'{color}_player': player,
+                f'{color}_guest_name': None if player else guest_name or 'Guest',
+                f'{engine_color}_guest_name': engine_name(level),
+            },
+        )
+        if player:
+            GameSession.objects.create(user=player, game=game, session_key=session_key or f'user:{player.pk}',
+                                       color=color)
+        request_engine_move(game)
+    return game
+
+
+def flag_if_out_of_time(code):
+    """
+    Complete a game on time if the player to move has run out.
+
+    Called by the clock scheduler when a deadline passes and when a client
+    reports a flag fall. Returns the game (None if it doesn't exist).
+    """
+    try:
+        with transaction.atomic():
+            game = Game.objects.select_for_update().filter(code=code).first()
+            if game is None or game.status != 'active':
+                return game
+            deadline = game.get_clock_deadline()
+            if deadline is None or deadline > timezone.now().timestamp():
+                return game
+
+            timer_state = game.get_timer_state()
+            if timer_state.get('current_turn') == 'white':
+                game.white_time_ms = 0
+                game.mark_completed(winner='black', reason='timeout', save=False)
+            else:
+                game.black_time_ms = 0
+                game.mark_completed(winner='white', reason='timeout', save=False)
+            game.save_changes(('white_time_ms', 'black_time_ms') + COMPLETION_FIELDS)
+    except StaleGameError:
+        # A move landed at the same moment; the caller looks at the new state
+        return Game.objects.filter(code=code).first()
+
+    publish_game_event(game, 'timeout')
+    return game
+
+
+class MoveRejected(Exception):
+    """A move that can't be played (illegal, out of turn, game over...)"""
+
+    def __init__(self, message, status=400, game=None):
+        super().__init__(message)
+        self.status = status
+        self.game = game
+
+
+def commit_move(code, uci=None, san=None, user=None, ply=None):
+    """
+    Play a move in a game and return (game, move info).
+
+    `user` is the requester (AnonymousUser for a guest); user=None is the
+    server itself (the engine, imports). A signed-in user can only play
+    their own side, and a guest only a side no registered player or
+    engine holds. With `ply`, the move is only played if the game still has that
+    many moves (so a search that finished late can't play into a newer
+    position).
+
+    The game row is locked (select_for_update) and the final write only
+    succeeds if nobody else changed the game in between (state_version
+    check), so two simultaneous requests can't interleave.
+    """
+    try:
+        with transaction.atomic():
+            game = Game.objects.select_for_update().get(code=code)
+            if game.status != 'active':
+                raise MoveRejected('Game is not in progress', game=game)
+            if ply is not None and game.move_count != ply:
+                raise MoveRejected('The position has changed', status=409, game=game)
+
+            board = Board(game.fen)
+            to_move = 'white' if board.turn == WHITE else 'black'
+            if user is not None:
+                player_color = game.get_player_color(user)
+                if user.is_authenticated and player_color is None:
+                    raise MoveRejected('You are not playing in this game', status=403, game=game)
+                seat_taken = game.engine_color == to_move or (
+                    game.white_player_id if to_move == 'white' else game.black_player_id)
+                if player_color != to_move and (player_color is not None or seat_taken):
+                    raise MoveRejected('Not your turn', game=game)
+
+            try:
+                move = board.parse_uci(uci) if uci else board.parse_san(san)
+            except IllegalMoveError as e:
+                raise MoveRejected(str(e), game=game)
+
+            # A move withdraws the mover's own draw offer
+            fields = MOVE_FIELDS
+            if game.draw_offered_by == to_move:
+                game.clear_draw_offer()
+                fields += DRAW_OFFER_FIELDS
+
+            history = position_histories.get(game, board)
+            move_san = board.san(move)
+            move_uci = move_to_uci(move)
+            captured_symbol = board.captured_piece(move)
+            board.push(move)
+            # Board.outcome() sees the repetitions the FEN can't tell it
+            board.repetitions[board.hash] = history.push(board)
+
+            game.fen = board.fen()
+            game.move_count += 1
+
+            captured = None
+            if captured_symbol:
+                captured = {
+                    'color': 'white' if captured_symbol.isupper() else 'black',
+                    'piece': captured_symbol.lower(),
+                }
+
+            time_spent_ms = game.update_timer_on_move(save=False)
+            game.log_move(
+                move_san, move_uci,
+                captured_piece=captured['piece'] if captured else None,
+                time_spent_ms=time_spent_ms,
+            )
+
+            # Check for game end (the clock may already have ended it on time)
+            if game.status == 'active':
+                outcome = board.outcome()
+                if outcome:
+                    winner, reason = outcome
+                    game.mark_completed(winner=winner, reason=reason, save=False)
+
+            if game.status == 'completed':
+                fields += COMPLETION_FIELDS
+            game.save_changes(fields)
+    except StaleGameError:
+        raise MoveRejected('The game changed, please retry', status=409,
+                           game=Game.objects.filter(code=code).first())
+
+    if game.status == 'active':
+        draw_claim = history.claimable()
+    else:
+        draw_claim = None
+        position_histories.discard(code)
+    move_info = {'san': move_san, 'uci': move_uci, 'captured': captured, 'draw_claim': draw_claim}
+    publish_game_event(game, 'move', **move_info)
+    request_engine_move(game)
+    return game, move_info
+
+
+def claim_draw(code, color):
+    """
+    End a game drawn by threefold repetition or the fifty-move rule on
+    behalf of `color`, if its current position allows the claim
+    (repetition.PositionHistory). Returns the game; raises MoveRejected if
+    there is no draw to claim.
+    """
+    try:
+        with transaction.atomic():
+            game = Game.objects.select_for_update().get(code=code)
+            if game.status != 'active':
+                raise MoveRejected('Game is not in progress', game=game)
+            reason = position_histories.get(game).claimable()
+            if reason is None:
+                raise MoveRejected('No draw to claim', game=game)
+            game.mark_completed(winner='draw', reason=reason, save=False)
+            game.save_changes(COMPLETION_FIELDS)
+    except StaleGameError:
+        raise MoveRejected('The game changed, please retry', status=409,
+                           game=Game.objects.filter(code=code).first())
+
+    position_histories.discard(code)
+    publish_game_event(game, 'draw_claimed', reason=reason, color=color)
+    return game
+
+
+def abandon_game(code, idle_before):
+    """
+    Abandon a waiting or active game nobody has touched since
+    `idle_before`, scoring its tournament pairing (a double forfeit) if it
+    has one. Used by the sweeper for games with side effects; returns the
+    game, or None if it was left alone.
+    """
+    from . import stats
+    from .tournaments import record_game_result
+
+    try:
+        with transaction.atomic():
+            game = Game.objects.select_for_update().filter(code=code).first()
+            if game is None or game.status not in ('waiting', 'active') or game.updated_at >= idle_before:
+                return None
+            was_active = game.status == 'active'
+            game.status = 'abandoned'
+            game.result_reason = 'abandoned'
+            game.completed_at = timezone.now()
+            game.clear_draw_offer()
+            game.save_changes(COMPLETION_FIELDS + DRAW_OFFER_FIELDS)
+            stats.game_finished(game, was_active)
+            if game.tournament_id:
+                record_game_result(game)
+    except StaleGameError:
+        # A move landed at the same moment: the game isn't idle
+        return None
+
+    position_histories.discard(code)
+    publish_game_event(game, 'abandoned')
+    return game
+
+
+def join_game(code, user=None, guest_name='Guest', session_key=''):
+    """Take the black seat of a waiting game and start it; returns the game"""
+    try:
+        with transaction.atomic():
+            game = Game.objects.select_for_update().get(code=code)
+            if game.status != 'waiting':
+                raise MoveRejected('Game already has two players', game=game)
+            if user is not None and user.is_authenticated:
+                game.black_player = user
+            else:
+                game.black_guest_name = guest_name
+            game.mark_started(save=False)
+            game.save_changes(('black_player', 'black_guest_name') + START_FIELDS)
+            if user is not None and user.is_authenticated:
+                GameSession.objects.create(user=user, game=game, session_key=session_key or 'guest', color='black')
+    except StaleGameError:
+        raise MoveRejected('The game changed, please retry', status=409,
+                           game=Game.objects.filter(code=code).first())
+
+    publish_game_event(
+        game, 'join',
+        white_player=game.get_white_display_name(),
+        black_player=game.get_black_display_name(),
+    )
+    return game
+
+
+def resign(code, color):
+    """Complete an active game as lost by `color`; returns the game"""
+    try:
+        with transaction.atomic():
+            game = _locked_active_game(code)
+            game.clear_draw_offer()
+            game.mark_completed(winner='black' if color == 'white' else 'white', reason='resignation', save=False)
+            game.save_changes(DRAW_OFFER_FIELDS + COMPLETION_FIELDS)
+    except StaleGameError:
+        raise MoveRejected('The game changed, please retry', status=409,
+                           game=Game.objects.filter(code=code).first())
+
+    position_histories.discard(code)
+    publish_game_event(game, 'resign', color=color)
+    return game
+
+
+def _draw_offer_seconds():
+    return getattr(settings, 'MTU_CHESS_CONFIG', {}).get('DRAW_OFFER_SECONDS', DEFAULT_DRAW_OFFER_SECONDS)
+
+
+def _locked_active_game(code):
+    game = Game.objects.select_for_update().get(code=code)
+    if game.status != 'active':
+        raise MoveRejected('Game is not in progress', game=game)
+    return game
+
+
+def offer_draw(code, color):
+    """
+    Offer a draw on behalf of `color`. The offer stands until the opponent
+    answers it, the offering side moves or DRAW_OFFER_SECONDS pass; an
+    offer made while the opponent's own offer is pending accepts it.
+    Returns the game (completed if it was accepted).
+    """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            game = _locked_active_game(code)
+            if game.engine_color:
+                raise MoveRejected('The computer does not accept draw offers', game=game)
+            offer = game.get_draw_offer(now)
+            if offer is not None and offer['by'] != color:
+                _agree_draw(game)
+            elif offer is None:
+                game.draw_offered_by = color
+                game.draw_offer_ply = game.move_count
+                game.draw_offer_expires = now + timedelta(seconds=_draw_offer_seconds())
+                game.save_changes(DRAW_OFFER_FIELDS)
+    except StaleGameError:
+        raise MoveRejected('The game changed, please retry', status=409,
+                           game=Game.objects.filter(code=code).first())
+
+    if game.status == 'completed':
+        publish_game_event(game, 'draw_accepted')
+    elif offer is None:
+        publish_game_event(game, 'draw_offer', color=color)
+    return game
+
+
+def accept_draw(code, color):
+    """End a game drawn by agreement if the opponent of `color` has a draw offer pending"""
+    try:
+        with transaction.atomic():
+            game = _locked_active_game(code)
+            offer = game.get_draw_offer()
+            if offer is None or offer['by'] == color:
+                raise MoveRejected('No draw offer to accept', status=409, game=game)
+            _agree_draw(game)
+    except StaleGameError:
+        raise MoveRejected('The game changed, please retry', status=409,
+                           game=Game.objects.filter(code=code).first())
+
+    publish_game_event(game, 'draw_accepted')
+    return game
+
+
+def _agree_draw(game):
+    """Complete a locked game as drawn by agreement"""
+    game.clear_draw_offer()
+    game.mark_completed(winner='draw', reason='agreement', save=False)
+    game.save_changes(DRAW_OFFER_FIELDS + COMPLETION_FIELDS)
+    position_histories.discard(game.code)
+
+
+def cancel_draw_offer(code, color):
+    """
+    Withdraw `color`'s own pending draw offer, or decline the opponent's.
+    Returns (game, 'draw_withdrawn' or 'draw_declined').
+    """
+    try:
+        with transaction.atomic():
+            game = _locked_active_game(code)
+            offer = game.get_draw_offer()
+            if offer is None:
+                raise MoveRejected('No draw offer pending', status=409, game=game)
+            event = 'draw_withdrawn' if offer['by'] == color else 'draw_declined'
+            game.clear_draw_offer()
+            game.save_changes(DRAW_OFFER_FIELDS)
+    except StaleGameError:
+        raise MoveRejected('The game changed, please retry', status=409,
+                           game=Game.objects.filter(code=code).first())
+
+    publish_game_event(game, event, color=color)
+    return game, event
@@ -0,0 +1,226 @@
+"""
+Live game fan-out
+
+Every WebSocket watching a game - spectators and players alike - is served
+by one GameBroadcast per game in this process:
+
+- it holds a single subscription to the channel layer, however many
+  connections watch the game;
+- each delta is JSON-encoded once and kept in a ring buffer of the last
+  RING_SIZE messages;
+- the snapshot is loaded from the database once, kept current by applying
+  the deltas and re-encoded every SNAPSHOT_INTERVAL of them, so a late
+  joiner gets the shared snapshot plus the tail of deltas after it without
+  a query;
+- each connection has its own sender with a cursor into the ring. The
+  broadcaster only appends and wakes the senders, it never waits on a
+  socket: a slow client falls behind on its own, and once it is further
+  behind than the ring reaches it skips ahead to the snapshot rather than
+  queueing messages without bound.
+
+A client that reconnects with ?since=<version> only gets the deltas it
+missed, when the ring still has them.
+"""
+import asyncio
+import json
+import time
+from collections import deque, namedtuple
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from .realtime import get_channel_layer
+
+RING_SIZE = 64
+SNAPSHOT_INTERVAL = 16
+
+# Snapshot fields a delta carries the new value of
+STATE_FIELDS = (
+    'version', 'fen', 'status', 'move_count',
+    'white_time', 'black_time', 'white_time_ms', 'black_time_ms',
+    'winner', 'result_reason', 'white_player', 'black_player', 'draw_offer',
+)
+
+# A message as sent: seq is its position in the broadcast (a snapshot has
+# the seq of the last delta it includes), at is when it was current
+Entry = namedtuple('Entry', ['seq', 'version', 'text', 'message', 'at'])
+
+
+def _load_snapshot(code):
+    """Full game state for the first viewer of a game (None if there is no such game)"""
+    from .models import Game
+
+    close_old_connections()
+    try:
+        game = Game.objects.select_related('white_player', 'black_player').get(code=code)
+    except Game.DoesNotExist:
+        return None
+    finally:
+        close_old_connections()
+    snapshot = game.get_state()
+    snapshot['type'] = 'snapshot'
+    return snapshot
+
+
+def _fresh_clock(entry):
+    """
+    Text of a message with the running clock brought up to now, for the
+    last message of a catch-up (the shared copy has the clocks of when it
+    was published)
+    """
+    message = entry.message
+    if message.get('status') != 'active' or 'white_time_ms' not in message:
+        return entry.text
+    elapsed_ms = int((time.monotonic() - entry.at) * 1000)
+    side = 'white' if message['fen'].split()[1] == 'w' else 'black'
+    remaining = max(0, message[f'{side}_time_ms'] - elapsed_ms)
+    return json.dumps(dict(message, **{f'{side}_time_ms': remaining, f'{side}_time': remaining // 1000}))
+
+
+class GameBroadcast:
+    """Shared upstream subscription, ring buffer and snapshot of one game"""
+
+    def __init__(self, code):
+        self.code = code
+        self.viewers = 0
+        self.seq = 0
+        self.ring = deque(maxlen=RING_SIZE)
+        self.snapshot = None
+        self.snapshot_entry = None
+        self._changed = asyncio.Event()
+        self._layer = get_channel_layer()
+        self._upstream = None
+        self._pump = None
+        self.ready = asyncio.ensure_future(self._start())
+
+    async def _start(self):
+        """Subscribe, then load the snapshot; False if the game doesn't exist"""
+        # Subscribe first so no delta can slip in between
+        self._upstream = self._layer.subscribe(self.code)
+        snapshot = await sync_to_async(_load_snapshot)(self.code)
+        if snapshot is None:
+            return False
+        self.snapshot = snapshot
+        self._encode_snapshot(time.monotonic())
+        self._pump = asyncio.ensure_future(self._run())
+        return True
+
+    def close(self):
+        self.ready.cancel()
+        if self._pump is not None:
+            self._pump.cancel()
+        if self._upstream is not None:
+            self._layer.unsubscribe(self.code, self._upstream)
+
+    def _encode_snapshot(self, at):
+        # A copy: the live snapshot keeps changing under the encoded one
+        snapshot = dict(self.snapshot)
+        self.snapshot_entry = Entry(self.seq, snapshot['version'], json.dumps(snapshot), snapshot, at)
+
+    async def _run(self):
+        while True:
+            self.add(await self._upstream.get())
+
+    def add(self, message):
+        """Apply a delta to the snapshot, append it to the ring and wake the senders"""
+        snapshot = self.snapshot
+        # Published before the snapshot was read (already part of it)
+        if message.get('version', 0) < snapshot['version']:
+            return
+
+        if message.get('type') == 'move' and message.get('move_count', 0) > snapshot['move_count']:
+            history = json.loads(snapshot['move_history'] or '[]')
+            history.append(message.get('san'))
+            snapshot['move_history'] = json.dumps(history)
+            captured = message.get('captured')
+            if captured:
+                pieces = json.loads(snapshot['captured_pieces'])
+                pieces[captured['color']].append(captured['piece'])
+                snapshot['captured_pieces'] = json.dumps(pieces)
+        for field in STATE_FIELDS:
+            if field in message:
+                snapshot[field] = message[field]
+
+        now = time.monotonic()
+        self.seq += 1
+        self.ring.append(Entry(self.seq, message.get('version', 0), json.dumps(message), message, now))
+        if self.seq - self.snapshot_entry.seq >= SNAPSHOT_INTERVAL:
+            self._encode_snapshot(now)
+
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def catch_up(self, since=None):
+        """
+        Entries bringing a new (or lagging) viewer up to date: only the
+        deltas after `since` if the ring still has them all, otherwise the
+        snapshot and the deltas after it
+        """
+        ring = self.ring
+        # The ring must reach back to the delta right after `since`
+        if since is not None and ring and ring[0].version - 1 <= since <= self.snapshot['version']:
+            return [entry for entry in ring if entry.version > since]
+        snapshot = self.snapshot_entry
+        return [snapshot] + [entry for entry in ring if entry.seq > snapshot.seq]
+
+    async def serve(self, send, since=None):
+        """Send this game's messages to one connection until cancelled"""
+        entries = self.catch_up(since)
+        cursor = self.seq
+        for index, entry in enumerate(entries):
+            text = _fresh_clock(entry) if index == len(entries) - 1 else entry.text
+            await send({'type': 'websocket.send', 'text': text})
+
+        while True:
+            if cursor == self.seq:
+                await self._changed.wait()
+                continue
+            first = self.ring[0].seq
+            if first > cursor + 1:
+                # Too far behind: skip to the snapshot
+                entries = self.catch_up()
+                cursor = self.seq
+                for entry in entries:
+                    await send({'type': 'websocket.send', 'text': entry.text})
+                continue
+            # One at a time, so a slow client that falls behind while
+            # sending notices it before sending what is already stale
+            cursor += 1
+            await send({'type': 'websocket.send', 'text': self.ring[cursor - first].text})
+
+
+class SpectatorHub:
+    """The GameBroadcasts of this process (one event loop), by game code"""
+
+    def __init__(self):
+        self._broadcasts = {}
+
+    async def join(self, code):
+        """The broadcast of a game with this viewer counted (None if there is no such game)"""
+        broadcast = self._broadcasts.get(code)
+        if broadcast is None:
+            broadcast = self._broadcasts[code] = GameBroadcast(code)
+        broadcast.viewers += 1
+        try:
+            found = await asyncio.shield(broadcast.ready)
+        except BaseException:
+            self.leave(broadcast)
+            raise
+        if not found:
+            self.leave(broadcast)
+            return None
+        return broadcast
+
+    def leave(self, broadcast):
+        broadcast.viewers -= 1
+        if broadcast.viewers == 0:
+            broadcast.close()
+            if self._broadcasts.get(broadcast.code) is broadcast:
+                del self._broadcasts[broadcast.code]
+
+    def viewer_count(self, code):
+        broadcast = self._broadcasts.get(code)
+        return broadcast.viewers if broadcast else 0
+
+
+hub = SpectatorHub()
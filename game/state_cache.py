@@ -0,0 +1,155 @@
+"""
+In-memory cache of hot game state
+
+Polling clients ask for the state of the same handful of games every
+second. Instead of hitting SQLite for each request, the latest state of
+every game is kept here, keyed by code. Game.save() writes through to the
+cache once the surrounding transaction commits, so the polling read path
+never needs the database for a game that has been seen by this process.
+
+Waiting and active games are always kept. Finished games move to an LRU
+list and are evicted once it grows past MTU_CHESS_CONFIG['GAME_CACHE_SIZE'].
+
+Each worker process has its own cache, like the channel layer in
+realtime.py, so it can't see writes made by another process (a move
+served by another worker, manage.py sweep_games, the admin). A live
+game's entry is therefore trusted for GAME_CACHE_TTL_SECONDS at most;
+after that current() compares its version with the row's state_version
+(one indexed single-column read) and reloads the game if they differ.
+Finished games don't change and are never re-checked.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+LIVE_STATUSES = ('waiting', 'active')
+DEFAULT_TTL_SECONDS = 2
+
+
+class CachedGame:
+    """Detached copy of a game with its serialized state"""
+    __slots__ = ('game', 'state', 'checked_at')
+
+    def __init__(self, game):
+        self.game = game
+        self.state = game.get_state()
+        # When the entry was last known to match the database
+        self.checked_at = time.monotonic()
+
+    @property
+    def version(self):
+        return self.state['version']
+
+    def get_state(self):
+        """Cached state with the clocks brought up to date"""
+        state = dict(self.state)
+        if self.game.status == 'active':
+            timer_state = self.game.get_timer_state()
+            state['white_time'] = timer_state['white_time']
+            state['black_time'] = timer_state['black_time']
+            state['white_time_ms'] = timer_state['white_time_ms']
+            state['black_time_ms'] = timer_state['black_time_ms']
+            state['timer_last_updated'] = timer_state.get('last_updated')
+        if state['draw_offer'] is not None:
+            # Lapses without a save
+            state['draw_offer'] = self.game.get_draw_offer()
+        return state
+
+
+class GameStateCache:
+    """Code -> CachedGame map with LRU eviction of finished games"""
+
+    def __init__(self, max_finished=None, ttl=None):
+        config = getattr(settings, 'MTU_CHESS_CONFIG', {})
+        if max_finished is None:
+            max_finished = config.get('GAME_CACHE_SIZE', 1000)
+        if ttl is None:
+            ttl = config.get('GAME_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS)
+        self.max_finished = max_finished
+        self.ttl = ttl
+        self._live = {}
+        self._finished = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, code):
+        """Return the CachedGame for a code, or None on a miss"""
+        with self._lock:
+            entry = self._live.get(code)
+            if entry is None:
+                entry = self._finished.get(code)
+                if entry is not None:
+                    self._finished.move_to_end(code)
+            return entry
+
+    def is_current(self, entry):
+        """True if an entry can be served without asking the database"""
+        return (entry.game.status not in LIVE_STATUSES
+                or time.monotonic() - entry.checked_at < self.ttl)
+
+    def current(self, code):
+        """
+        The CachedGame for a code, loading it on a miss and re-checking a
+        live game's version once its entry is older than the TTL. None if
+        there is no such game. Runs queries: call from sync code.
+        """
+        from .models import Game
+
+        entry = self.get(code)
+        if entry is not None and self.is_current(entry):
+            return entry
+        if entry is not None:
+            version = Game.objects.filter(code=code).values_list('state_version', flat=True).first()
+            if version == entry.version:
+                entry.checked_at = time.monotonic()
+                return entry
+        try:
+            game = Game.objects.select_related('white_player', 'black_player').get(code=code)
+        except Game.DoesNotExist:
+            self.evict(code)
+            return None
+        self.store(game)
+        return self.get(code)
+
+    def get_state(self, code):
+        entry = self.get(code)
+        return entry.get_state() if entry is not None else None
+
+    def get_version(self, code):
+        entry = self.get(code)
+        return entry.version if entry is not None else None
+
+    def store(self, game):
+        """Cache the current state of a game (older versions are ignored)"""
+        entry = CachedGame(copy.copy(game))
+        with self._lock:
+            current = self._live.get(game.code) or self._finished.get(game.code)
+            if current is not None and current.version > entry.version:
+                return
+            self._live.pop(game.code, None)
+            self._finished.pop(game.code, None)
+            if game.status in LIVE_STATUSES:
+                self._live[game.code] = entry
+            else:
+                self._finished[game.code] = entry
+                while len(self._finished) > self.max_finished:
+                    self._finished.popitem(last=False)
+
+    def evict(self, code):
+        with self._lock:
+            self._live.pop(code, None)
+            self._finished.pop(code, None)
+
+    def clear(self):
+        with self._lock:
+            self._live.clear()
+            self._finished.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._live) + len(self._finished)
+
+
+game_cache = GameStateCache()
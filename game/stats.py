@@ -0,0 +1,164 @@
+"""
+Site statistics cache
+
+The home page counters (games played, games in progress, registered users)
+and the dashboard game lists are kept in Django's cache instead of being
+queried on every page view.
+
+Counters are adjusted in place when games are created, started or
+finished and when users register; cached lists are dropped when a game
+they could contain changes. All updates happen after the transaction
+commits. Every entry also expires after
+MTU_CHESS_CONFIG['STATS_CACHE_SECONDS'], which bounds any drift (e.g. with
+a per-process cache and several server processes, or after bulk updates
+that bypass the hooks).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+KEY_PREFIX = 'mtu_stats:'
+COUNTERS = ('total_games', 'active_games', 'total_users')
+LIVE_GAMES_CACHED = 20
+USER_GAMES_CACHED = 5
+
+
+def _ttl():
+    return getattr(settings, 'MTU_CHESS_CONFIG', {}).get('STATS_CACHE_SECONDS', 300)
+
+
+def _count(name):
+    from .models import Game, User
+
+    if name == 'total_games':
+        return Game.objects.count()
+    if name == 'active_games':
+        return Game.objects.filter(status='active').count()
+    return User.objects.count()
+
+
+def _cached_list(key, load):
+    value = cache.get(key)
+    if value is None:
+        value = list(load())
+        cache.set(key, value, _ttl())
+    return value
+
+
+def _user_games_key(user_id):
+    return f'{KEY_PREFIX}user_games:{user_id}'
+
+
+# ============================================
+# READS
+# ============================================
+
+def get_counters():
+    """Return {'total_games', 'active_games', 'total_users'}, counting only what isn't cached"""
+    keys = {KEY_PREFIX + name: name for name in COUNTERS}
+    found = cache.get_many(keys)
+    counters = {}
+    for key, name in keys.items():
+        if key in found:
+            counters[name] = found[key]
+        else:
+            counters[name] = _count(name)
+            cache.set(key, counters[name], _ttl())
+    return counters
+
+
+def get_live_games():
+    """Most recently started active games, players included"""
+    from .models import Game
+
+    return _cached_list(
+        KEY_PREFIX + 'live_games',
+        lambda: Game.objects.filter(status='active')
+        .select_related('white_player', 'black_player')
+        .order_by('-started_at')[:LIVE_GAMES_CACHED],
+    )
+
+
+def get_user_games(user):
+    """A user's most recent games, players included"""
+    from .models import Game
+
+    return _cached_list(
+        _user_games_key(user.pk),
+        lambda: Game.objects.filter(Q(white_player=user) | Q(black_player=user))
+        .select_related('white_player', 'black_player')
+        .order_by('-created_at')[:USER_GAMES_CACHED],
+    )
+
+
+# ============================================
+# UPDATES
+# ============================================
+
+def _adjust(name, delta):
+    try:
+        cache.incr(KEY_PREFIX + name, delta)
+    except ValueError:
+        # Not cached; it is counted on the next read
+        pass
+
+
+def adjust_counter(name, delta):
+    transaction.on_commit(lambda: _adjust(name, delta))
+
+
+def invalidate(*names):
+    """Drop cached counters/lists (by name) once the transaction commits"""
+    transaction.on_commit(lambda: cache.delete_many([KEY_PREFIX + name for name in names]))
+
+
+def invalidate_user_games(*user_ids):
+    keys = [_user_games_key(user_id) for user_id in user_ids if user_id]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def game_started(game):
+    """Called by Game.mark_started"""
+    adjust_counter('active_games', 1)
+    invalidate('live_games')
+    invalidate_user_games(game.white_player_id, game.black_player_id)
+
+
+def game_finished(game, was_active):
+    """Called by Game.mark_completed"""
+    if was_active:
+        adjust_counter('active_games', -1)
+        invalidate('live_games')
+    invalidate_user_games(game.white_player_id, game.black_player_id)
+
+
+@receiver(post_save, sender='game.Game')
+def _game_saved(sender, instance, created, **kwargs):
+    if created:
+        adjust_counter('total_games', 1)
+        if instance.status == 'active':
+            adjust_counter('active_games', 1)
+            invalidate('live_games')
+    invalidate_user_games(instance.white_player_id, instance.black_player_id)
+
+
+@receiver(post_delete, sender='game.Game')
+def _game_deleted(sender, instance, **kwargs):
+    invalidate('total_games', 'active_games', 'live_games')
+    invalidate_user_games(instance.white_player_id, instance.black_player_id)
+
+
+@receiver(post_save, sender='game.User')
+def _user_saved(sender, instance, created, **kwargs):
+    if created:
+        adjust_counter('total_users', 1)
+
+
+@receiver(post_delete, sender='game.User')
+def _user_deleted(sender, instance, **kwargs):
+    adjust_counter('total_users', -1)
+    invalidate_user_games(instance.pk)
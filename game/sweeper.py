@@ -0,0 +1,176 @@
+"""
+Stale game sweeper
+
+Marks games nobody has touched for MTU_CHESS_CONFIG['GAME_TIMEOUT_MINUTES']
+as abandoned and deletes the GameSession rows of finished games once they
+are past the session activity window.
+
+Work is done in primary-key batches, each its own short UPDATE or DELETE,
+so a sweep over a large table never holds a long lock. Rows are updated
+with QuerySet.update(), so the site statistics are invalidated for every
+game touched; the update bumps state_version, which is how the state
+cache of every web process notices the change (state_cache.py).
+Tournament games are abandoned one at a time through
+services.abandon_game instead, so their pairings are scored.
+
+Run it with `python manage.py sweep_games`, or let the clock scheduler run
+it every MTU_CHESS_CONFIG['SWEEP_INTERVAL_MINUTES'] (0 turns it off).
+"""
+import logging
+import time
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import stats
+from .models import Game, GameSession
+from .repetition import position_histories
+from .scheduler import scheduler
+from .state_cache import game_cache
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ('completed', 'abandoned')
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _config(key, default):
+    return getattr(settings, 'MTU_CHESS_CONFIG', {}).get(key, default)
+
+
+def _pk_batches(queryset, batch_size, fields=('pk',)):
+    """Yield lists of value tuples from queryset in ascending pk batches"""
+    last_pk = 0
+    while True:
+        batch = list(
+            queryset.filter(pk__gt=last_pk).order_by('pk').values_list(*fields)[:batch_size]
+        )
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1][0]
+
+
+def abandon_stale_games(timeout_minutes=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Abandon waiting/active games idle for longer than the timeout.
+
+    Active games whose clock is still running are left alone; ones whose
+    clock has run out are completed on time instead of abandoned.
+    Returns (abandoned, timed_out).
+    """
+    from .services import abandon_game, flag_if_out_of_time
+
+    if timeout_minutes is None:
+        timeout_minutes = _config('GAME_TIMEOUT_MINUTES', 30)
+    now = timezone.now()
+    cutoff = now - timedelta(minutes=timeout_minutes)
+    stale = Game.objects.filter(status__in=('waiting', 'active'), updated_at__lt=cutoff)
+    abandoned = 0
+    timed_out = 0
+
+    fields = ('pk', 'code', 'status', 'tournament_id', 'white_player_id', 'black_player_id')
+    for batch in _pk_batches(stale, batch_size, fields=fields):
+        to_abandon = [(row[0], row[1]) for row in batch if row[2] == 'waiting']
+
+        abandons_active = False
+        active_pks = [row[0] for row in batch if row[2] == 'active']
+        if active_pks:
+            games = Game.objects.filter(pk__in=active_pks).only(
+                'code', 'status', 'fen', 'time_control', 'last_move_time',
+                'white_time_ms', 'black_time_ms',
+            )
+            for game in games:
+                deadline = game.get_clock_deadline()
+                if deadline is None:
+                    to_abandon.append((game.pk, game.code))
+                    abandons_active = True
+                elif deadline <= now.timestamp():
+                    flagged = flag_if_out_of_time(game.code)
+                    if flagged is not None and flagged.status == 'completed':
+                        timed_out += 1
+
+        # Tournament games need their pairing scored: one at a time
+        in_tournament = {row[1] for row in batch if row[3]}
+        for pk, code in to_abandon:
+            if code in in_tournament and abandon_game(code, cutoff) is not None:
+                abandoned += 1
+        to_abandon = [(pk, code) for pk, code in to_abandon if code not in in_tournament]
+
+        if to_abandon:
+            # Re-check the conditions in the UPDATE so a move that landed
+            # since the batch was read keeps its game alive
+            abandoned += Game.objects.filter(
+                pk__in=[pk for pk, code in to_abandon],
+                status__in=('waiting', 'active'),
+                updated_at__lt=cutoff,
+            ).update(
+                status='abandoned',
+                result_reason='abandoned',
+                completed_at=now,
+                updated_at=now,
+                draw_offered_by='',
+                draw_offer_ply=None,
+                draw_offer_expires=None,
+                state_version=F('state_version') + 1,
+            )
+            for pk, code in to_abandon:
+                game_cache.evict(code)
+                position_histories.discard(code)
+                scheduler.cancel(('clock', code))
+            if abandons_active:
+                stats.invalidate('active_games', 'live_games')
+            abandoned_pks = {pk for pk, code in to_abandon}
+            stats.invalidate_user_games(*{
+                user_id for row in batch if row[0] in abandoned_pks for user_id in row[4:]
+            })
+
+    return abandoned, timed_out
+
+
+def prune_sessions(batch_size=DEFAULT_BATCH_SIZE):
+    """Delete sessions of finished games not seen within the activity window"""
+    cutoff = timezone.now() - GameSession.ACTIVE_WINDOW
+    expired = GameSession.objects.filter(last_seen__lt=cutoff, game__status__in=FINISHED_STATUSES)
+    deleted = 0
+    for batch in _pk_batches(expired, batch_size):
+        deleted += GameSession.objects.filter(pk__in=[row[0] for row in batch]).delete()[0]
+    return deleted
+
+
+def sweep(timeout_minutes=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Run a full sweep and return counts of what was done"""
+    start = time.monotonic()
+    abandoned, timed_out = abandon_stale_games(timeout_minutes, batch_size)
+    sessions = prune_sessions(batch_size)
+    return {
+        'abandoned': abandoned,
+        'timed_out': timed_out,
+        'sessions_deleted': sessions,
+        'seconds': round(time.monotonic() - start, 3),
+    }
+
+
+# ============================================
+# PERIODIC SWEEP
+# ============================================
+
+def _periodic_sweep(interval):
+    try:
+        result = sweep()
+        if result['abandoned'] or result['timed_out'] or result['sessions_deleted']:
+            logger.info("Game sweep: %s", result)
+    finally:
+        schedule_sweeps(interval)
+
+
+def schedule_sweeps(interval=None):
+    """Schedule the next sweep on the background scheduler"""
+    if interval is None:
+        interval = _config('SWEEP_INTERVAL_MINUTES', 5)
+    if interval:
+        scheduler.schedule(('sweep',), time.time() + interval * 60,
+                           partial(_periodic_sweep, interval))
@@ -1,3 +1,921 @@
-from django.test import TestCase
+import asyncio
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import analysis, computer, stats
+from .board import Board, START_FEN
+from .clocks import TIME_CONTROLS, charge_move
+from .consumers import game_websocket
+from .matchmaking import MatchmakingPool, Seek
+from .models import Game, GameAnalysis, GameSession, Pairing, PositionEval, PositionMove, RatingHistory, StaleGameError, Tournament, TournamentPlayer, User
+from .movecodec import append, decode, decode_uci, encode_uci, from_sans, pack, ucis
+from .pgn import game_pgn, parse_game, read_games
+from .ranking import ranking
+from .rating import NEW_PLAYER, Glicko2System, Rating
+from .replay import get_replay, position_at
+from .scheduler import DeadlineScheduler
+from .search import MATE_BOUND, best_move, evaluate_positions
+from .services import (MoveRejected, accept_draw, cancel_draw_offer, claim_draw, commit_move, create_computer_game,
+                       join_game, offer_draw, resign)
+from .spectators import RING_SIZE, SNAPSHOT_INTERVAL, GameBroadcast, hub
+from .state_cache import GameStateCache, game_cache
+from .sweeper import abandon_stale_games
+from .tournaments import PairingPlayer, record_game_result, start_tournament, swiss_pairings
+
+
+# No background analysis or clock threads while tests run
+TEST_CONFIG = dict(settings.MTU_CHESS_CONFIG, ANALYSIS_WORKERS=0, ENABLE_CLOCK_SCHEDULER=False)
+
+
+@override_settings(MTU_CHESS_CONFIG=TEST_CONFIG)
+class GameTestCase(TestCase):
+    pass
+
+
+def make_user(username, matric_number):
+    return User.objects.create_user(username, f'{username}@example.com', 'pw', matric_number=matric_number)
+
+
+def make_game(code, **fields):
+    fields.setdefault('status', 'active')
+    return Game.objects.create(code=code, **fields)
+
+
+def post_json(client, url, data):
+    return client.post(url, json.dumps(data), content_type='application/json')
+
+
+class ResignTests(GameTestCase):
+    def setUp(self):
+        self.white = make_user('white', '10000000001')
+        self.black = make_user('black', '10000000002')
+        self.game = make_game('RES001', white_player=self.white, black_player=self.black)
+
+    def test_finished_game_is_not_completed_again(self):
+        resign('RES001', 'white')
+        with self.assertRaises(MoveRejected):
+            resign('RES001', 'black')
+        game = Game.objects.get(code='RES001')
+        self.assertEqual((game.winner, game.result_reason), ('black', 'resignation'))
+        self.assertEqual(RatingHistory.objects.count(), 2)
+        self.white.refresh_from_db()
+        self.assertEqual(self.white.total_games, 1)
+
+    def test_mark_completed_only_completes_active_games(self):
+        self.assertTrue(self.game.mark_completed(winner='white', reason='checkmate', save=False))
+        self.assertFalse(self.game.mark_completed(winner='black', reason='timeout', save=False))
+        self.assertEqual(self.game.winner, 'white')
+
+    def test_only_players_can_resign(self):
+        spectator = Client()
+        response = post_json(spectator, '/api/game/RES001/resign/', {'color': 'white'})
+        self.assertEqual(response.status_code, 403)
+
+        client = Client()
+        client.force_login(self.black)
+        response = post_json(client, '/api/game/RES001/resign/', {'color': 'white'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Game.objects.get(code='RES001').winner, 'white')
+        self.assertEqual(post_json(client, '/api/game/RES001/resign/', {}).status_code, 400)
+
+
+class WriteConflictTests(GameTestCase):
+    def test_stale_save_does_not_undo_a_move(self):
+        stale = make_game('CON001')
+        commit_move('CON001', uci='e2e4')
+        stale.result_reason = 'resignation'
+        with self.assertRaises(StaleGameError):
+            stale.save()
+        game = Game.objects.get(code='CON001')
+        self.assertEqual((game.move_count, ucis(game.move_data)), (1, ['e2e4']))
+        self.assertIsNone(game.result_reason)
+
+    def test_resign_after_a_move_keeps_the_move_and_bumps_the_version(self):
+        make_game('CON002')
+        game, _ = commit_move('CON002', uci='e2e4')
+        resigned = resign('CON002', 'white')
+        self.assertEqual(resigned.state_version, game.state_version + 1)
+        stored = Game.objects.get(code='CON002')
+        self.assertEqual((stored.status, stored.move_count), ('completed', 1))
+
+    def test_move_row_commits_with_the_move(self):
+        make_game('CON005')
+        commit_move('CON005', uci='e2e4')
+        with self.assertRaises(MoveRejected):
+            commit_move('CON005', uci='e2e4')
+        game = Game.objects.get(code='CON005')
+        self.assertEqual(list(game.moves.values_list('move_number', 'move_san')), [(1, 'e4')])
+
+    def test_ply_guard_rejects_a_late_move(self):
+        make_game('CON003')
+        commit_move('CON003', uci='e2e4')
+        with self.assertRaises(MoveRejected) as raised:
+            commit_move('CON003', uci='e7e5', ply=0)
+        self.assertEqual(raised.exception.status, 409)
+
+    def test_join_starts_a_waiting_game_once(self):
+        host = make_user('host', '30000000001')
+        guest = make_user('guest', '30000000002')
+        make_game('CON004', status='waiting', white_player=host)
+        game = join_game('CON004', user=guest, session_key='abc')
+        self.assertEqual((game.status, game.black_player_id), ('active', guest.pk))
+        self.assertTrue(GameSession.objects.filter(game=game, user=guest, color='black').exists())
+        with self.assertRaises(MoveRejected):
+            join_game('CON004', guest_name='Late')
+        self.assertEqual(Game.objects.get(code='CON004').black_player_id, guest.pk)
+
+
+class MoveApiTests(GameTestCase):
+    def test_malformed_requests_are_rejected(self):
+        make_game('API001')
+        client = Client()
+        for body in ('[]', '"x"', '{"uci": 123}', '{"move_san": ["e4"]}', '{"uci": {"from": "e2"}}', 'nope'):
+            with self.subTest(body=body):
+                response = client.post('/api/game/API001/move/', body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+        response = post_json(client, '/api/game/API001/move/', {'uci': 'e2e5'})
+        self.assertEqual(response.status_code, 400)
+        response = post_json(client, '/api/game/API001/move/', {'uci': 'e2e4'})
+        self.assertEqual(response.json()['san'], 'e4')
+
+
+class MoveAuthorityTests(GameTestCase):
+    def setUp(self):
+        self.white = make_user('rva', '80000000001')
+        self.black = make_user('rvb', '80000000002')
+        self.outsider = make_user('rvc', '80000000003')
+        make_game('AUT001', white_player=self.white, black_player=self.black, is_rated=True)
+
+    def post_move(self, user, uci):
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        return post_json(client, '/api/game/AUT001/move/', {'uci': uci})
+
+    def test_only_the_player_to_move_can_move(self):
+        self.assertEqual(self.post_move(self.outsider, 'e2e4').status_code, 403)
+        self.assertEqual(self.post_move(None, 'e2e4').status_code, 400)
+        self.assertEqual(self.post_move(self.black, 'e2e4').status_code, 400)
+        self.assertEqual(Game.objects.get(code='AUT001').move_count, 0)
+        self.assertEqual(self.post_move(self.white, 'e2e4').status_code, 200)
+        self.assertEqual(self.post_move(self.outsider, 'e7e5').status_code, 403)
+        self.assertEqual(self.post_move(self.black, 'e7e5').status_code, 200)
+
+    def test_guest_plays_only_the_guest_seat(self):
+        make_game('AUT002', white_player=self.white, black_guest_name='Visitor')
+        with self.assertRaises(MoveRejected):
+            commit_move('AUT002', uci='e2e4', user=AnonymousUser())
+        commit_move('AUT002', uci='e2e4', user=self.white)
+        game, _ = commit_move('AUT002', uci='e7e5', user=AnonymousUser())
+        self.assertEqual(game.move_count, 2)
+        with self.assertRaises(MoveRejected) as raised:
+            commit_move('AUT002', uci='g1f3', user=self.outsider)
+        self.assertEqual(raised.exception.status, 403)
+
+
+class TournamentScoringTests(GameTestCase):
+    def setUp(self):
+        self.tournament = Tournament.objects.create(name='Club', format='swiss', rounds=3)
+        for number in range(4):
+            user = make_user(f'player{number}', f'2000000000{number}')
+            TournamentPlayer.objects.create(tournament=self.tournament, user=user)
+        start_tournament(self.tournament)
+
+    def test_pairing_is_scored_once(self):
+        pairing = Pairing.objects.exclude(game=None).select_related('game').first()
+        game = pairing.game
+        game.mark_completed(winner='white', reason='checkmate', save=False)
+        game.save_changes(('status', 'completed_at', 'winner', 'result_reason'))
+        self.assertIsNone(record_game_result(game))
+        self.assertIsNone(record_game_result(game))
+
+        entries = TournamentPlayer.objects.in_bulk()
+        self.assertEqual(entries[pairing.white_id].score, 1)
+        self.assertEqual(entries[pairing.black_id].score, 0)
+        self.assertEqual(sum(entry.buchholz for entry in entries.values()), 1)
+
+    def test_abandoned_game_scores_its_pairing(self):
+        pairing = Pairing.objects.exclude(game=None).first()
+        stale = timezone.now() - timedelta(hours=2)
+        Game.objects.filter(pk=pairing.game_id).update(time_control='unlimited', updated_at=stale)
+        self.assertEqual(abandon_stale_games(timeout_minutes=30), (1, 0))
+        pairing.refresh_from_db()
+        self.assertEqual((pairing.result, pairing.game.status), ('0-0', 'abandoned'))
+
+    def test_repeat_resignation_scores_once(self):
+        pairing = Pairing.objects.exclude(game=None).select_related('game').first()
+        resign(pairing.game.code, 'black')
+        with self.assertRaises(MoveRejected):
+            resign(pairing.game.code, 'white')
+        pairing.refresh_from_db()
+        self.assertEqual(pairing.result, '1-0')
+        self.assertEqual(TournamentPlayer.objects.get(pk=pairing.white_id).score, 1)
+
+
+class ExplorerTests(GameTestCase):
+    def test_finished_game_is_indexed_once(self):
+        make_game('EXP001', move_data=pack(['e2e4', 'e7e5', 'g1f3']), move_count=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            resign('EXP001', 'black')
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(MoveRejected):
+                resign('EXP001', 'white')
+            Game.objects.get(code='EXP001').mark_completed(winner='black', reason='timeout', save=False)
+        self.assertEqual(PositionMove.objects.count(), 3)
+        self.assertEqual(sorted(PositionMove.objects.values_list('white_wins', flat=True)), [1, 1, 1])
+
+    def test_malformed_fen_is_rejected(self):
+        for fen in (
+            'rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+            'rnbqkbnr/pppppppp/8p/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+            'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq - 0 1',
+            'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkx - 0 1',
+            'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq e3 0 1',
+        ):
+            with self.subTest(fen=fen):
+                with self.assertRaises(ValueError):
+                    Board(fen)
+                response = Client().get('/api/explorer/', {'fen': fen})
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(Client().get('/api/explorer/', {'fen': START_FEN}).status_code, 200)
+
+
+class StateCacheTests(GameTestCase):
+    def test_live_entry_is_rechecked_after_the_ttl(self):
+        make_game('CAC001')
+        cache = GameStateCache(ttl=60)
+        self.assertEqual(cache.current('CAC001').state['status'], 'active')
+
+        # Another process finishes the game
+        game = Game.objects.get(code='CAC001')
+        game.status = 'completed'
+        game.save(update_fields=['status'])
+        self.assertEqual(cache.current('CAC001').state['status'], 'active')
+
+        cache.ttl = 0
+        entry = cache.current('CAC001')
+        self.assertEqual((entry.state['status'], entry.version), ('completed', game.state_version))
+
+    def test_deleted_game_is_evicted(self):
+        make_game('CAC002')
+        cache = GameStateCache(ttl=0)
+        self.assertIsNotNone(cache.current('CAC002'))
+        Game.objects.filter(code='CAC002').delete()
+        self.assertIsNone(cache.current('CAC002'))
+        self.assertEqual(len(cache), 0)
+
+
+class GameStateApiTests(GameTestCase):
+    def test_known_version_gets_not_modified(self):
+        make_game('STA001')
+        client = Client()
+        response = client.get('/api/game/STA001/state/')
+        version = response.json()['version']
+        self.assertEqual(response['ETag'], '"%d"' % version)
+        self.assertEqual(client.get('/api/game/STA001/state/', HTTP_IF_NONE_MATCH='W/"%d"' % version).status_code, 304)
+        self.assertEqual(client.get('/api/game/STA001/state/', {'since': version}).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            commit_move('STA001', uci='e2e4')
+        response = client.get('/api/game/STA001/state/', {'since': version})
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.json()['version'], version)
+
+    async def test_long_poll_returns_when_a_move_is_published(self):
+        await sync_to_async(make_game)('STA002')
+        client = AsyncClient()
+        version = (await client.get('/api/game/STA002/state/')).json()['version']
+        # The move's cache write-through waits for a commit that never comes in a TestCase
+        with mock.patch.object(game_cache, 'ttl', 0):
+            poll = asyncio.create_task(client.get('/api/game/STA002/state/', {'since': version, 'wait': 20}))
+            await asyncio.sleep(0.2)
+            self.assertFalse(poll.done())
+            await sync_to_async(commit_move)('STA002', uci='e2e4')
+            response = await asyncio.wait_for(poll, timeout=5)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['move_count'], 1)
+
+
+class GameWebSocketTests(GameTestCase):
+    def connect(self, path, query_string=b''):
+        incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+        incoming.put_nowait({'type': 'websocket.connect'})
+        scope = {'type': 'websocket', 'path': path, 'query_string': query_string}
+        connection = asyncio.ensure_future(game_websocket(scope, incoming.get, outgoing.put))
+        return incoming, outgoing, connection
+
+    async def receive_json(self, outgoing):
+        return json.loads((await asyncio.wait_for(outgoing.get(), timeout=5))['text'])
+
+    async def test_snapshot_then_deltas(self):
+        await sync_to_async(make_game)('WSK001')
+        incoming, outgoing, connection = self.connect('/ws/game/wsk001/')
+        self.assertEqual((await outgoing.get())['type'], 'websocket.accept')
+        snapshot = await self.receive_json(outgoing)
+        self.assertEqual((snapshot['type'], snapshot['move_count']), ('snapshot', 0))
+
+        await sync_to_async(commit_move)('WSK001', uci='e2e4')
+        delta = await self.receive_json(outgoing)
+        self.assertEqual((delta['type'], delta['san'], delta['move_count']), ('move', 'e4', 1))
+
+        # A reconnect that says what it has seen only gets what it missed
+        _, missed, reconnection = self.connect('/ws/game/WSK001/', b'since=%d' % snapshot['version'])
+        await missed.get()
+        self.assertEqual((await self.receive_json(missed))['type'], 'move')
+        self.assertEqual(hub.viewer_count('WSK001'), 2)
+
+        reconnection.cancel()
+        await incoming.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(connection, timeout=5)
+        await asyncio.gather(reconnection, return_exceptions=True)
+        self.assertEqual(hub.viewer_count('WSK001'), 0)
+
+    async def test_unknown_game_is_refused(self):
+        for path in ('/ws/game/NOPE01/', '/ws/lobby/'):
+            with self.subTest(path=path):
+                _, outgoing, connection = self.connect(path)
+                await asyncio.wait_for(connection, timeout=5)
+                self.assertEqual(outgoing.get_nowait(), {'type': 'websocket.close', 'code': 4404})
+
+
+class StatsCacheTests(GameTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_counters_follow_games_and_users(self):
+        self.assertEqual(stats.get_counters(), {'total_games': 0, 'active_games': 0, 'total_users': 0})
+        with self.captureOnCommitCallbacks(execute=True):
+            make_user('counted', '90000000001')
+            make_game('STS001')
+            make_game('STS002', status='waiting')
+        with self.assertNumQueries(0):
+            self.assertEqual(stats.get_counters(), {'total_games': 2, 'active_games': 1, 'total_users': 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resign('STS001', 'white')
+        with self.assertNumQueries(0):
+            self.assertEqual(stats.get_counters()['active_games'], 0)
+
+    def test_lists_are_dropped_when_a_game_starts(self):
+        host = make_user('lister', '90000000002')
+        make_game('STS003', status='waiting', white_player=host)
+        self.assertEqual(stats.get_live_games(), [])
+        self.assertEqual([game.status for game in stats.get_user_games(host)], ['waiting'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            join_game('STS003', guest_name='Visitor')
+        with self.assertNumQueries(2):
+            self.assertEqual([game.code for game in stats.get_live_games()], ['STS003'])
+            self.assertEqual([game.status for game in stats.get_user_games(host)], ['active'])
+        with self.assertNumQueries(0):
+            stats.get_live_games()
+
+
+class RankingIndexTests(GameTestCase):
+    def setUp(self):
+        ranking.invalidate()
+        self.addCleanup(ranking.invalidate)
+        self.players = {}
+        for index, (name, rating, department, level) in enumerate([
+            ('rk_top', 1600, 'CSC', 100), ('rk_csc', 1500, 'CSC', 100),
+            ('rk_mth', 1500, 'MTH', 100), ('rk_low', 1400, 'CSC', 200), ('rk_new', None, 'CSC', 100),
+        ]):
+            user = make_user(name, '9100000000%d' % index)
+            User.objects.filter(pk=user.pk).update(rating=rating, department=department, level=level)
+            self.players[name] = user.pk
+
+    def test_ties_share_a_rank(self):
+        self.assertEqual([(row['username'], row['rank']) for row in ranking.top(10)],
+                         [('rk_top', 1), ('rk_csc', 2), ('rk_mth', 2), ('rk_low', 4)])
+        self.assertEqual([row['username'] for row in ranking.page(2, size=2)], ['rk_mth', 'rk_low'])
+        self.assertEqual([row['rank'] for row in ranking.top(10, department='CSC')], [1, 2, 3])
+        self.assertEqual(ranking.count(level=200), 1)
+        self.assertEqual(ranking.rank(self.players['rk_low']), 4)
+        self.assertIsNone(ranking.rank(self.players['rk_new']))
+        self.assertIsNone(ranking.rank(self.players['rk_mth'], department='CSC'))
+        self.assertEqual([row['username'] for row in ranking.around(self.players['rk_mth'], radius=1)],
+                         ['rk_csc', 'rk_mth', 'rk_low'])
+
+    def test_saved_rating_moves_the_player(self):
+        self.assertEqual(ranking.rank(self.players['rk_low'], department='CSC'), 3)
+        user = User.objects.get(pk=self.players['rk_low'])
+        user.rating = 1700
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(ranking.top(1)[0]['username'], 'rk_low')
+            self.assertEqual(ranking.rank(self.players['rk_top'], department='CSC'), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.delete()
+        self.assertEqual(ranking.count(), 3)
+
+
+class RatingHistoryApiTests(GameTestCase):
+    def setUp(self):
+        self.player = make_user('charted', '92000000001')
+        first = timezone.make_aware(datetime(2025, 6, 1, 12))
+        RatingHistory.objects.bulk_create([
+            RatingHistory(user=self.player, recorded_at=first + timedelta(days=day), rating=1500 + day, deviation=100)
+            for day in range(40)
+        ])
+
+    def get(self, **params):
+        return Client().get('/api/user/charted/rating-history/', params)
+
+    def test_date_range_includes_the_last_day(self):
+        points = self.get(**{'from': '2025-06-29', 'to': '2025-06-30'}).json()['points']
+        self.assertEqual([rating for _, rating in points], [1528, 1529])
+        points = self.get(**{'from': '2025-07-10T00:00:00+01:00'}).json()['points']
+        self.assertEqual([rating for _, rating in points], [1539])
+
+    def test_downsampling_keeps_the_last_point(self):
+        points = self.get(points=6).json()['points']
+        self.assertLessEqual(len(points), 6)
+        self.assertEqual(points[0][1], 1500)
+        self.assertEqual(points[-1][1], 1539)
+        self.assertEqual(len(self.get(points='lots').json()['points']), 40)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.get(**{'from': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.get(to='2025-02-30').status_code, 400)
+        self.assertEqual(Client().get('/api/user/nobody/rating-history/').status_code, 404)
+
+
+class InlinePool:
+    """Stands in for the engine process pool: searches as soon as asked"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+class ComputerOpponentTests(GameTestCase):
+    def test_search_finds_mate_in_one(self):
+        moves = from_sans(['e4', 'e5', 'Bc4', 'Nc6', 'Qh5', 'Nf6'])
+        result = best_move(moves, depth=3)
+        self.assertEqual((result.uci, result.san), ('h5f7', 'Qxf7#'))
+        self.assertGreater(result.score, MATE_BOUND)
+        self.assertIsNone(best_move(moves + pack(['h5f7'])).uci)
+
+    def test_engine_answers_the_players_move(self):
+        pool = InlinePool()
+        with mock.patch('game.computer._get_pool', return_value=pool):
+            with self.captureOnCommitCallbacks(execute=True):
+                code = create_computer_game('white', 1, 'blitz_5').code
+            self.assertEqual(pool.submitted, [])
+            with self.captureOnCommitCallbacks(execute=True):
+                commit_move(code, uci='e2e4')
+        game = Game.objects.get(code=code)
+        self.assertEqual(len(pool.submitted), 1)
+        self.assertEqual((game.move_count, game.fen.split()[1]), (2, 'w'))
+
+        with mock.patch('game.computer._get_pool', return_value=pool):
+            with self.captureOnCommitCallbacks(execute=True):
+                code = create_computer_game('black', 1, 'blitz_5').code
+        self.assertEqual(Game.objects.get(code=code).move_count, 1)
+
+    def test_search_for_an_old_position_is_not_played(self):
+        make_game('CPU001', engine_color='black', engine_level=1)
+        commit_move('CPU001', uci='e2e4')
+        pool = InlinePool()
+        late = pool.submit(best_move, pack(['e2e4']), 1)
+        commit_move('CPU001', uci='d7d5')
+        with self.assertLogs('game.computer', 'INFO'):
+            computer._play('CPU001', 1, pool, late)
+        self.assertEqual(ucis(Game.objects.get(code='CPU001').move_data), ['e2e4', 'd7d5'])
+
+
+class AnalysisJudgementTests(SimpleTestCase):
+    def test_thresholds(self):
+        for loss, mark in ((49, '-'), (50, 'i'), (99, 'i'), (100, 'm'), (299, 'm'), (300, 'b')):
+            with self.subTest(loss=loss):
+                self.assertEqual(analysis.judge([0, -loss]), mark)
+                self.assertEqual(analysis.judge([0, 0, loss]), '-' + mark)
+
+    def test_clamped_scores_and_gains(self):
+        # A won position that stays won isn't a mistake, and a gain is fine
+        self.assertEqual(analysis.judge([0, 0, 60, -50, 1500, 1200, 900]), '-imb--')
+        self.assertEqual(analysis.move_losses([0, 40, 1500, 3000]), [-40, 960, 0])
+
+
+class AnalysisCacheTests(GameTestCase):
+    def finish_game(self, code, moves):
+        make_game(code)
+        for uci in moves:
+            commit_move(code, uci=uci)
+        resign(code, 'black')
+        job = analysis.claim_job()
+        self.assertEqual(job.game.code, code)
+        with self.assertNumQueries(1):
+            job_plan = analysis.plan(job)
+        return job, job_plan
+
+    def test_positions_are_searched_once(self):
+        job, job_plan = self.finish_game('ANA001', ['e2e4', 'e7e5'])
+        self.assertEqual((len(job_plan.keys), len(job_plan.missing_fens)), (3, 3))
+        analysis.finish(job, job_plan, evaluate_positions(job_plan.missing_fens, depth=1, nodes=200))
+        job = GameAnalysis.objects.get(pk=job.pk)
+        self.assertEqual((job.status, len(job.judgements)), ('done', 2))
+        self.assertEqual(len(analysis.analysed_moves(job, ['e4', 'e5'])), 2)
+        self.assertEqual(PositionEval.objects.count(), 3)
+
+        # Same opening, one new position
+        job, job_plan = self.finish_game('ANA002', ['e2e4', 'e7e5', 'g1f3'])
+        self.assertEqual((len(job_plan.cached), len(job_plan.missing_fens)), (3, 1))
+        analysis.finish(job, job_plan, evaluate_positions(job_plan.missing_fens, depth=1, nodes=200))
+        self.assertEqual(PositionEval.objects.count(), 4)
+        self.assertIsNone(analysis.claim_job())
+
+
+class GameBroadcastTests(GameTestCase):
+    async def open_broadcast(self, code):
+        await sync_to_async(make_game)(code)
+        broadcast = GameBroadcast(code)
+        self.addCleanup(broadcast.close)
+        self.assertTrue(await broadcast.ready)
+        return broadcast, broadcast.snapshot['version']
+
+    def publish(self, broadcast, count):
+        for _ in range(count):
+            version = broadcast.snapshot['version'] + 1
+            broadcast.add({'type': 'draw_offer', 'code': broadcast.code, 'version': version, 'draw_offer': None})
+
+    async def test_catch_up_before_the_ring_wraps(self):
+        broadcast, start = await self.open_broadcast('SPC001')
+        self.publish(broadcast, 5)
+        versions = lambda entries: [entry.version for entry in entries]
+        self.assertEqual(versions(broadcast.catch_up(start + 2)), [start + 3, start + 4, start + 5])
+        self.assertEqual(versions(broadcast.catch_up(start)), [start + 1, start + 2, start + 3, start + 4, start + 5])
+        self.assertEqual(broadcast.catch_up(start + 5), [])
+        # Unknown versions get the snapshot and every delta after it
+        for since in (None, start - 1, start + 6):
+            with self.subTest(since=since):
+                entries = broadcast.catch_up(since)
+                self.assertEqual(entries[0].message['type'], 'snapshot')
+                self.assertEqual(versions(entries), [start] + [start + n for n in range(1, 6)])
+
+    async def test_catch_up_after_the_ring_wraps(self):
+        broadcast, start = await self.open_broadcast('SPC002')
+        self.publish(broadcast, RING_SIZE + 10)
+        last = start + RING_SIZE + 10
+        self.assertEqual(len(broadcast.catch_up(last - 4)), 4)
+        # Fell out of the ring: the latest snapshot and the deltas after it
+        entries = broadcast.catch_up(start + 5)
+        snapshot_seq = (RING_SIZE + 10) // SNAPSHOT_INTERVAL * SNAPSHOT_INTERVAL
+        self.assertEqual((entries[0].message['type'], entries[0].version), ('snapshot', start + snapshot_seq))
+        self.assertEqual([entry.version for entry in entries[1:]], list(range(start + snapshot_seq + 1, last + 1)))
+
+    async def test_lagging_sender_skips_to_the_snapshot(self):
+        broadcast, start = await self.open_broadcast('SPC003')
+        sent = []
+
+        async def send(message):
+            sent.append(json.loads(message['text']))
+        sender = asyncio.ensure_future(broadcast.serve(send))
+        await asyncio.sleep(0)
+        # More deltas than the ring holds before the sender gets to run
+        self.publish(broadcast, RING_SIZE + 5)
+        await asyncio.sleep(0.05)
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        self.assertEqual([message['type'] for message in sent[:2]], ['snapshot', 'snapshot'])
+        self.assertEqual(sent[-1]['version'], start + RING_SIZE + 5)
+        self.assertLess(len(sent), SNAPSHOT_INTERVAL + 2)
+
+
+RUY_LOPEZ = ('e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6 e1g1 f8e7 '
+             'f1e1 b7b5 a4b3 d7d6 c2c3 e8g8 h2h3 c6a5 b3c2 c7c5').split()
+
+
+@override_settings(MTU_CHESS_CONFIG=dict(TEST_CONFIG, REPLAY_KEYFRAME_PLIES=4))
+class ReplayTests(GameTestCase):
+    def test_every_ply_matches_a_full_replay(self):
+        # 20 plies end on a keyframe, 18 don't
+        for code, length, keyframes in (('RPL001', 20, 6), ('RPL002', 18, 5)):
+            moves = RUY_LOPEZ[:length]
+            make_game(code, status='completed', move_data=pack(moves), move_count=length)
+            replay = get_replay(Game.objects.get(code=code))
+            self.assertEqual((replay.keyframe_interval, len(replay.keyframes.split('\n'))), (4, keyframes))
+            self.assertEqual(position_at(replay, 0), (START_FEN, None))
+            board = Board()
+            for ply, uci in enumerate(moves, 1):
+                move = board.parse_uci(uci)
+                san = board.san(move)
+                board.push(move)
+                with self.subTest(code=code, ply=ply):
+                    self.assertEqual(position_at(replay, ply), (board.fen(), (san, uci)))
+            for ply in (-1, length + 1):
+                with self.subTest(code=code, ply=ply), self.assertRaises(IndexError):
+                    position_at(replay, ply)
+
+
+class ExportTests(GameTestCase):
+    def setUp(self):
+        self.player = make_user('ada', '40000000001')
+        started = timezone.make_aware(timezone.datetime(2025, 6, 30, 18, 0))
+        make_game('PGN001', status='completed', white_player=self.player, started_at=started,
+                  move_data=pack(['e2e4', 'e7e5']), move_count=2, winner='white', result_reason='resignation')
+
+    def test_date_range_alone_is_for_staff(self):
+        response = Client().get('/api/pgn/export/', {'from': '1970-01-01'})
+        self.assertEqual(response.status_code, 403)
+
+        staff = make_user('staff', '40000000002')
+        staff.is_staff = True
+        staff.save()
+        client = Client()
+        client.force_login(staff)
+        response = client.get('/api/pgn/export/', {'from': '1970-01-01'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_to_date_includes_the_whole_day(self):
+        response = Client().get('/api/pgn/export/', {'user': 'ada', 'to': '2025-06-30'})
+        self.assertIn('[Site ', b''.join(response.streaming_content).decode())
+        response = Client().get('/api/pgn/export/', {'user': 'ada', 'to': '2025-06-29'})
+        self.assertEqual(b''.join(response.streaming_content), b'')
+        response = Client().get('/api/pgn/export/', {'user': 'ada', 'to': '2025-13-01'})
+        self.assertEqual(response.status_code, 400)
+
+
+class MatchmakingTests(GameTestCase):
+    def setUp(self):
+        self.pool = MatchmakingPool()
+        self.first = make_user('seeker1', '50000000001')
+        self.second = make_user('seeker2', '50000000002')
+
+    def test_close_ratings_are_paired(self):
+        self.assertIsNone(self.pool.seek(self.first, '5+0'))
+        match = self.pool.seek(self.second, '5+0')
+        self.assertEqual(match['opponent'], 'seeker1')
+        self.assertTrue(Game.objects.filter(code=match['code'], status='active').exists())
+        self.assertFalse(self.pool.cancel(self.first.pk))
+
+    def test_seek_cancelled_while_pairing_gets_no_game(self):
+        self.pool.seek(self.first, '5+0')
+        waiting = self.pool._seeks[self.first.pk]
+        arriving = Seek(self.second, '5+0', '', -1, waiting.created)
+        with self.pool._lock:
+            self.pool._take(waiting, arriving)
+        self.assertTrue(self.pool.cancel(self.second.pk))
+
+        self.assertIsNone(self.pool._pair(waiting, arriving))
+        self.assertFalse(Game.objects.exists())
+        self.assertEqual(self.pool.status(self.first.pk)['status'], 'waiting')
+        self.assertEqual(self.pool.status(self.second.pk)['status'], 'idle')
+
+    def test_malformed_seek_is_rejected(self):
+        client = Client()
+        client.force_login(self.first)
+        for body in ('nope', '[]', '{"time_control": ["5+0"]}', '{"time_control": "9+9"}'):
+            with self.subTest(body=body):
+                response = client.post('/api/matchmaking/seek/', body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+
+
+class ClockTests(SimpleTestCase):
+    def test_increment_is_added_after_the_move(self):
+        self.assertEqual(charge_move(TIME_CONTROLS['blitz_3_2'], 180_000, 4_250), 177_750)
+
+    def test_delay_gives_back_time_used_up_to_the_delay(self):
+        tc = TIME_CONTROLS['blitz_5_d3']
+        self.assertEqual(charge_move(tc, 300_000, 1_200), 300_000)
+        self.assertEqual(charge_move(tc, 300_000, 7_000), 296_000)
+
+    def test_flag_fall_gets_no_credit(self):
+        self.assertEqual(charge_move(TIME_CONTROLS['blitz_3_2'], 1_000, 1_000), 0)
+        self.assertEqual(charge_move(TIME_CONTROLS['blitz_5_d3'], 1_000, 2_500), 0)
+
+
+class DeadlineSchedulerTests(SimpleTestCase):
+    def test_callbacks_run_in_deadline_order(self):
+        ran = []
+        done = threading.Event()
+        scheduler = DeadlineScheduler()
+        now = time.time()
+        scheduler.schedule('late', now + 0.3, lambda: (ran.append('late'), done.set()))
+        scheduler.schedule('early', now + 0.1, lambda: ran.append('early'))
+        scheduler.schedule('moved', now + 0.05, lambda: ran.append('not moved'))
+        scheduler.schedule('moved', now + 0.2, lambda: ran.append('moved'))
+        scheduler.schedule('cancelled', now + 0.05, lambda: ran.append('cancelled'))
+        scheduler.cancel('cancelled')
+        scheduler.schedule('broken', now, lambda: 1 / 0)
+        self.assertEqual((len(scheduler), scheduler.deadline('moved')), (4, now + 0.2))
+
+        with self.assertLogs('game.scheduler', 'ERROR'):
+            scheduler.start()
+            self.assertTrue(done.wait(5))
+        self.assertEqual(ran, ['early', 'moved', 'late'])
+        self.assertEqual(len(scheduler), 0)
+
+    def test_rescheduling_does_not_grow_the_heap(self):
+        scheduler = DeadlineScheduler()
+        later = time.time() + 3600
+        for step in range(1000):
+            scheduler.schedule(('clock', 'G1'), later + step, print)
+        self.assertEqual(len(scheduler), 1)
+        self.assertLess(len(scheduler._heap), 100)
+
+
+class DrawRuleTests(GameTestCase):
+    KNIGHT_DANCE = ['g1f3', 'g8f6', 'f3g1', 'f6g8']
+
+    def test_fifty_move_rule(self):
+        board = Board('8/8/4k3/8/8/4K3/4R3/8 w - - 99 80')
+        self.assertIsNone(board.outcome(claim_draw=True))
+        board.push(board.parse_uci('e2d2'))
+        self.assertIsNone(board.outcome())
+        self.assertEqual(board.outcome(claim_draw=True), ('draw', 'fifty_move'))
+        self.assertEqual(Board('8/8/4k3/8/8/4K3/4R3/8 w - - 150 100').outcome(), ('draw', 'fifty_move'))
+
+    def test_threefold_repetition_can_be_claimed(self):
+        make_game('REP001')
+        for uci in self.KNIGHT_DANCE:
+            commit_move('REP001', uci=uci)
+        with self.assertRaises(MoveRejected):
+            claim_draw('REP001', 'white')
+        for uci in self.KNIGHT_DANCE:
+            commit_move('REP001', uci=uci)
+        game = claim_draw('REP001', 'white')
+        self.assertEqual((game.winner, game.result_reason), ('draw', 'repetition'))
+
+    def test_only_players_can_claim(self):
+        white = make_user('claimer', '70000000001')
+        make_game('REP003', white_player=white, black_guest_name='Guest')
+        for uci in self.KNIGHT_DANCE * 2:
+            commit_move('REP003', uci=uci)
+
+        stranger = Client()
+        for body in ({'action': 'claim'}, {'action': 'claim', 'color': 'white'}):
+            response = post_json(stranger, '/api/game/REP003/draw/', body)
+            self.assertEqual(response.status_code, 403)
+        self.assertEqual(Game.objects.get(code='REP003').status, 'active')
+
+        client = Client()
+        client.force_login(white)
+        response = post_json(client, '/api/game/REP003/draw/', {'action': 'claim'})
+        self.assertEqual(response.json()['reason'], 'repetition')
+
+    def test_fivefold_repetition_ends_the_game(self):
+        make_game('REP002')
+        for uci in self.KNIGHT_DANCE * 4:
+            game, _ = commit_move('REP002', uci=uci)
+        self.assertEqual((game.status, game.result_reason), ('completed', 'repetition'))
+
+
+class DrawOfferTests(GameTestCase):
+    def setUp(self):
+        make_game('DRW001')
+
+    def test_opponent_accepts(self):
+        offer_draw('DRW001', 'white')
+        with self.assertRaises(MoveRejected):
+            accept_draw('DRW001', 'white')
+        game = accept_draw('DRW001', 'black')
+        self.assertEqual((game.status, game.winner, game.result_reason), ('completed', 'draw', 'agreement'))
+
+    def test_crossing_offers_agree_a_draw(self):
+        offer_draw('DRW001', 'white')
+        self.assertEqual(offer_draw('DRW001', 'black').result_reason, 'agreement')
+
+    def test_withdraw_and_decline(self):
+        offer_draw('DRW001', 'white')
+        self.assertEqual(cancel_draw_offer('DRW001', 'white')[1], 'draw_withdrawn')
+        offer_draw('DRW001', 'white')
+        self.assertEqual(cancel_draw_offer('DRW001', 'black')[1], 'draw_declined')
+        with self.assertRaises(MoveRejected):
+            cancel_draw_offer('DRW001', 'black')
+
+    def test_offering_side_moving_withdraws_the_offer(self):
+        offer_draw('DRW001', 'white')
+        game, _ = commit_move('DRW001', uci='e2e4')
+        self.assertIsNone(game.get_draw_offer())
+        with self.assertRaises(MoveRejected):
+            accept_draw('DRW001', 'black')
+
+    def test_offer_expires(self):
+        game = offer_draw('DRW001', 'white')
+        self.assertIsNone(game.get_draw_offer(game.draw_offer_expires))
+        Game.objects.filter(code='DRW001').update(draw_offer_expires=timezone.now())
+        with self.assertRaises(MoveRejected):
+            accept_draw('DRW001', 'black')
+
+    def test_abandoned_game_drops_the_offer(self):
+        offer_draw('DRW001', 'white')
+        stale = timezone.now() - timedelta(hours=2)
+        Game.objects.filter(code='DRW001').update(time_control='unlimited', updated_at=stale)
+        self.assertEqual(abandon_stale_games(timeout_minutes=30), (1, 0))
+        game = Game.objects.get(code='DRW001')
+        self.assertEqual(game.status, 'abandoned')
+        self.assertEqual((game.draw_offered_by, game.draw_offer_ply, game.draw_offer_expires), ('', None, None))
+
+
+class Glicko2Tests(SimpleTestCase):
+    system = Glicko2System()
+
+    def test_single_game_matches_the_formulas(self):
+        # Worked by hand from Glickman's paper: 1500/200 beats 1400/30
+        winner, loser = self.system.rate(Rating(1500, 200, 0.06, 5), Rating(1400, 30, 0.06, 5), 1.0)
+        self.assertAlmostEqual(winner.points, 1563.6, places=1)
+        self.assertAlmostEqual(winner.deviation, 175.4, places=1)
+        self.assertAlmostEqual(winner.volatility, 0.06, places=4)
+        self.assertEqual(winner.games, 6)
+        self.assertLess(loser.points, 1400)
+
+    def test_new_players(self):
+        white, black = self.system.rate(NEW_PLAYER, NEW_PLAYER, 0.5)
+        self.assertEqual((white.points, black.points), (NEW_PLAYER.points, NEW_PLAYER.points))
+        self.assertLess(white.deviation, NEW_PLAYER.deviation)
+        white, black = self.system.rate(NEW_PLAYER, NEW_PLAYER, 1.0)
+        self.assertAlmostEqual(white.points - NEW_PLAYER.points, NEW_PLAYER.points - black.points)
+        self.assertGreater(white.points, NEW_PLAYER.points)
+
+
+class SwissPairingTests(SimpleTestCase):
+    def test_no_rematches_and_one_bye_each(self):
+        rng = random.Random(7)
+        for count in (8, 9, 12):
+            players = [PairingPlayer(id=number, seed=number) for number in range(count)]
+            for round_number in range(5):
+                with self.subTest(players=count, round=round_number + 1):
+                    boards, bye = swiss_pairings(players)
+                    paired = [player.id for pair in boards for player in pair]
+                    self.assertEqual(len(paired), len(set(paired)))
+                    self.assertEqual(len(paired) + (bye is not None), count)
+                    for white, black in boards:
+                        self.assertNotIn(black.id, white.opponents)
+                    if bye is not None:
+                        self.assertFalse(bye.had_bye)
+
+                # Play the round out and carry the results into the next
+                updated = {}
+                for white, black in boards:
+                    score = rng.choice((0.0, 0.5, 1.0))
+                    updated[white.id] = PairingPlayer(white.id, white.seed, white.score + score, white.colours + 'w',
+                                                      white.opponents | {black.id}, white.had_bye)
+                    updated[black.id] = PairingPlayer(black.id, black.seed, black.score + 1 - score,
+                                                      black.colours + 'b', black.opponents | {white.id},
+                                                      black.had_bye)
+                if bye is not None:
+                    updated[bye.id] = PairingPlayer(bye.id, bye.seed, bye.score + 1, bye.colours, bye.opponents, True)
+                players = list(updated.values())
+
+
+class PGNRoundTripTests(GameTestCase):
+    def test_exported_game_imports_unchanged(self):
+        white = make_user('pgnwhite', '60000000001')
+        game = make_game('PGN002', white_player=white, black_guest_name='Visitor', time_control='blitz_3_2',
+                         started_at=timezone.now())
+        for uci in ('e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1b5', 'a7a6', 'b5c6', 'd7c6', 'e1g1'):
+            game, _ = commit_move('PGN002', uci=uci)
+        game = resign('PGN002', 'black')
+
+        (headers, text), = read_games(game_pgn(game).splitlines())
+        imported = parse_game(headers, text)
+        self.assertEqual(bytes(imported.move_data), bytes(game.move_data))
+        self.assertEqual(imported.fen, game.fen)
+        self.assertEqual((imported.winner, imported.time_control), ('white', 'blitz_3_2'))
+        self.assertEqual([move[0] for move in imported.moves][-3:], ['Bxc6', 'dxc6', 'O-O'])
+        self.assertEqual((headers['White'], headers['Black'], headers['GameId']), ('pgnwhite', 'Visitor', 'PGN002'))
+
+
+class MoveCodecTests(SimpleTestCase):
+    def test_codes_round_trip(self):
+        for uci in ('a1h8', 'h8a1', 'e2e4', 'e7e8q', 'b2a1n', 'g7g8r', 'c2c1b'):
+            with self.subTest(uci=uci):
+                self.assertEqual(decode_uci(encode_uci(uci)), uci)
+                self.assertLess(encode_uci(uci), 1 << 15)
+
+    def test_two_bytes_per_ply(self):
+        data = pack(['e2e4', 'e7e5'])
+        self.assertEqual(len(data), 4)
+        self.assertEqual(append(data, 'g1f3'), pack(['e2e4', 'e7e5', 'g1f3']))
+        self.assertEqual(ucis(append(data, 'g1f3')), ['e2e4', 'e7e5', 'g1f3'])
+
+    def test_decode_gives_sans_captures_and_position(self):
+        sans = ['e4', 'd5', 'exd5', 'Qxd5', 'Nc3', 'Qa5', 'd4', 'c6', 'Nf3', 'Bg4', 'h3', 'Bxf3', 'Qxf3']
+        data = from_sans(sans)
+        decoded = decode(data)
+        self.assertEqual(list(decoded.sans), sans)
+        self.assertEqual(decoded.captured, {'white': ('p', 'n'), 'black': ('p', 'b')})
+        self.assertEqual(decoded.fen, 'rn2kbnr/pp2pppp/2p5/q7/3P4/2N2Q1P/PPP2PP1/R1B1KB1R b KQkq - 0 7')
+        # One more move continues from the cached decode
+        self.assertEqual(decode(append(data, 'e8d7')).sans[-1], 'Kd7')
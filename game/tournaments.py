@@ -0,0 +1,504 @@
+"""
+Tournaments
+
+Two formats, chosen per Tournament:
+
+    swiss        Players meet opponents on the same score. Each round the
+                 field is sorted by (score, seed) and split into score
+                 groups; each group is paired top half against bottom half,
+                 avoiding rematches and giving colours by balance. Players
+                 that can't be paired in their group float down to the next
+                 one. Runs in well under a second for 500 players.
+    round_robin  Everyone plays everyone, scheduled with Berger tables.
+
+Starting a round creates all of its games (and the players' game sessions)
+in a few bulk queries. The games start straight away, so a player who
+doesn't turn up loses on time.
+
+Standings are kept on TournamentPlayer and updated incrementally as each
+game finishes (record_game_result, called from Game.mark_completed):
+
+    score             1 per win (and bye), 1/2 per draw
+    buchholz          sum of the opponents' scores
+    sonneborn_berger  sum of the scores of beaten opponents, plus half the
+                      scores of drawn opponents
+
+A result only touches the two players and their earlier opponents, so no
+game is ever re-read to rebuild the table. When the last game of a round
+finishes the next round is paired.
+"""
+import logging
+from collections import defaultdict
+from functools import partial
+from itertools import groupby
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+BYE_POINTS = 1.0
+
+# Pairing.result -> (white's points, black's points)
+POINTS = {
+    '1-0': (1.0, 0.0),
+    '0-1': (0.0, 1.0),
+    '1/2-1/2': (0.5, 0.5),
+    '0-0': (0.0, 0.0),
+}
+
+# Game.winner -> Pairing.result (anything else, e.g. abandoned, is a double forfeit)
+GAME_RESULTS = {'white': '1-0', 'black': '0-1', 'draw': '1/2-1/2'}
+
+TIEBREAK_FIELDS = ['score', 'buchholz', 'sonneborn_berger']
+
+# Largest group of players re-paired by exhaustive search when the
+# greedy pass leaves players over at the bottom of the field
+MAX_REPAIR_PLAYERS = 16
+REPAIR_BUDGET = 50_000
+
+
+class TournamentError(Exception):
+    """A tournament action that isn't allowed in the tournament's current state"""
+
+
+# ============================================
+# SWISS PAIRING
+# ============================================
+
+class PairingPlayer:
+    """What the pairing engine needs to know about a player"""
+    __slots__ = ('id', 'seed', 'score', 'colours', 'opponents', 'had_bye', 'preference')
+
+    def __init__(self, id, seed, score=0.0, colours='', opponents=(), had_bye=False):
+        self.id = id
+        self.seed = seed
+        self.score = score
+        self.colours = colours        # colours played so far, e.g. 'wbw'
+        self.opponents = set(opponents)
+        self.had_bye = had_bye
+        self.preference = self._colour_preference()
+
+    def _colour_preference(self):
+        """+2/-2: must have white/black, +1/-1: would like white/black, 0: no preference"""
+        played = self.colours
+        if not played:
+            return 0
+        balance = played.count('w') - played.count('b')
+        if balance <= -2 or played[-2:] == 'bb':
+            return 2
+        if balance >= 2 or played[-2:] == 'ww':
+            return -2
+        if balance:
+            return 1 if balance < 0 else -1
+        return 1 if played[-1] == 'b' else -1
+
+    def __repr__(self):
+        return f'<PairingPlayer {self.id} seed={self.seed} score={self.score}>'
+
+
+def _compatible(a, b, colours=True):
+    """Can a and b be paired? (no rematch; not both needing the same colour)"""
+    if b.id in a.opponents:
+        return False
+    return not (colours and a.preference == b.preference and abs(a.preference) == 2)
+
+
+def _allocate_colours(higher, lower, board):
+    """(white, black) for a pair, `higher` being the better placed player"""
+    if higher.preference == lower.preference:
+        if higher.preference == 0:
+            # Nobody has a preference (e.g. round one): alternate down the boards
+            return (higher, lower) if board % 2 else (lower, higher)
+        # Same wish: the better placed player gets it
+        return (higher, lower) if higher.preference > 0 else (lower, higher)
+    return (higher, lower) if higher.preference > lower.preference else (lower, higher)
+
+
+def _pair_bracket(bracket):
+    """
+    Pair a score group, top half against bottom half. Returns
+    (pairs, floaters): players left unpaired float down to the next group.
+    """
+    half = len(bracket) // 2
+    top, bottom = bracket[:half], bracket[half:]
+    paired = set()
+    pairs = []
+    for i, player in enumerate(top):
+        # The natural opponent first, then the rest of the bottom half, then
+        # the players further down the top half
+        candidates = bottom[i:] + bottom[i - 1::-1] if i else bottom
+        for other in candidates + top[i + 1:]:
+            if other.id not in paired and _compatible(player, other):
+                pairs.append((player, other))
+                paired.update((player.id, other.id))
+                break
+    left = [player for player in bottom if player.id not in paired]
+    for i, player in enumerate(left):
+        if player.id in paired:
+            continue
+        for other in left[i + 1:]:
+            if other.id not in paired and _compatible(player, other):
+                pairs.append((player, other))
+                paired.update((player.id, other.id))
+                break
+    floaters = [player for player in bracket if player.id not in paired]
+    return pairs, floaters
+
+
+def _match(players, colours, budget):
+    """
+    Pair every player (depth-first search), or None. budget is a one-item
+    list counting the search steps left.
+    """
+    if not players:
+        return []
+    first, rest = players[0], players[1:]
+    for i, other in enumerate(rest):
+        budget[0] -= 1
+        if budget[0] < 0:
+            return None
+        if _compatible(first, other, colours):
+            pairs = _match(rest[:i] + rest[i + 1:], colours, budget)
+            if pairs is not None:
+                return [(first, other)] + pairs
+    return None
+
+
+def _repair_tail(pairs, floaters, rank):
+    """
+    Pair the players the greedy pass left over by undoing the lowest pairs
+    one at a time and searching for a complete pairing of the tail. Colour
+    rules are given up before rematches are allowed.
+    """
+    for colours in (True, False):
+        for undo in range(len(pairs) + 1):
+            tail = floaters + [player for pair in pairs[len(pairs) - undo:] for player in pair]
+            if len(tail) > MAX_REPAIR_PLAYERS:
+                break
+            tail.sort(key=rank)
+            repaired = _match(tail, colours, [REPAIR_BUDGET])
+            if repaired is not None:
+                return pairs[:len(pairs) - undo] + repaired
+    # Unavoidable rematches (tiny or nearly exhausted field)
+    floaters = sorted(floaters, key=rank)
+    return pairs + list(zip(floaters[::2], floaters[1::2]))
+
+
+def swiss_pairings(players):
+    """
+    Pair a Swiss round. Returns ([(white, black)], bye) with PairingPlayer
+    objects in board order; bye is None for an even field.
+    """
+    rank = lambda player: (-player.score, player.seed)
+    ranked = sorted(players, key=rank)
+
+    bye = None
+    if len(ranked) % 2:
+        # Lowest placed player who hasn't had a bye yet
+        bye = next((player for player in reversed(ranked) if not player.had_bye), ranked[-1])
+        ranked.remove(bye)
+
+    pairs = []
+    floaters = []
+    for _, group in groupby(ranked, key=lambda player: player.score):
+        bracket_pairs, floaters = _pair_bracket(floaters + list(group))
+        pairs.extend(bracket_pairs)
+    if floaters:
+        pairs = _repair_tail(pairs, floaters, rank)
+
+    pairs.sort(key=lambda pair: min(rank(pair[0]), rank(pair[1])))
+    boards = []
+    for board, (a, b) in enumerate(pairs, 1):
+        higher, lower = (a, b) if rank(a) < rank(b) else (b, a)
+        boards.append(_allocate_colours(higher, lower, board))
+    return boards, bye
+
+
+# ============================================
+# ROUND ROBIN
+# ============================================
+
+def berger_rounds(count):
+    """
+    Round-robin schedule (Berger tables) for `count` players numbered
+    0..count-1 by seed: a list of rounds, each a list of (white, black)
+    pairs. With an odd count the player paired with None has the bye.
+    """
+    n = count + count % 2
+    last = n - 1
+    rounds = []
+    for r in range(last):
+        pairs = [(r, last) if r % 2 == 0 else (last, r)]
+        for i in range(1, n // 2):
+            a, b = (r + i) % last, (r - i) % last
+            pairs.append((a, b) if i % 2 else (b, a))
+        if n != count:
+            pairs = [tuple(None if player == last else player for player in pair) for pair in pairs]
+        rounds.append(pairs)
+    return rounds
+
+
+# ============================================
+# STANDINGS
+# ============================================
+
+def _opponents(rows):
+    """Entry id -> [(opponent id, opponent's points or None if pending)] from (white, black, result) rows"""
+    opponents = defaultdict(list)
+    for white_id, black_id, result in rows:
+        if black_id is None:
+            continue
+        points = POINTS.get(result)
+        opponents[white_id].append((black_id, points[1] if points else None))
+        opponents[black_id].append((white_id, points[0] if points else None))
+    return opponents
+
+
+def _add_score(entries, opponents, entry_id, points):
+    """Give a player points and carry the change into their opponents' tiebreaks"""
+    if not points:
+        return
+    entries[entry_id].score += points
+    for opponent_id, opponent_points in opponents.get(entry_id, ()):
+        opponent = entries[opponent_id]
+        opponent.buchholz += points
+        if opponent_points is not None:
+            opponent.sonneborn_berger += opponent_points * points
+
+
+def standings(tournament):
+    """Entries in standings order, with their rank"""
+    entries = list(tournament.entries.select_related('user'))
+    for rank, entry in enumerate(entries, 1):
+        entry.rank = rank
+    return entries
+
+
+def record_game_result(game):
+    """
+    Score a finished tournament game (called by Game.mark_completed).
+
+    Updates the two players' scores and the tiebreaks of everyone they
+    have played, and pairs the next round once this one is complete.
+    A pairing is only ever scored once, however often this is called.
+    """
+    from .models import Pairing, TournamentPlayer
+
+    if game.status not in ('completed', 'abandoned'):
+        return None
+    result = GAME_RESULTS.get(game.winner, '0-0')
+    with transaction.atomic():
+        pairing = Pairing.objects.select_for_update().select_related('round').filter(game_id=game.pk).first()
+        if pairing is None or pairing.result:
+            return None
+
+        players = (pairing.white_id, pairing.black_id)
+        opponents = _opponents(
+            Pairing.objects.filter(round__tournament_id=pairing.round.tournament_id)
+            .filter(Q(white_id__in=players) | Q(black_id__in=players))
+            .values_list('white_id', 'black_id', 'result')
+        )
+        affected = set(players)
+        for player_id in players:
+            affected.update(opponent_id for opponent_id, _ in opponents[player_id])
+        entries = TournamentPlayer.objects.select_for_update().in_bulk(affected)
+
+        # Claim the pairing before scoring it (select_for_update is a no-op
+        # on SQLite): only the call that sets the result goes on
+        if not Pairing.objects.filter(pk=pairing.pk, result='').update(result=result):
+            return None
+        pairing.result = result
+
+        white_points, black_points = POINTS[result]
+        _add_score(entries, opponents, pairing.white_id, white_points)
+        _add_score(entries, opponents, pairing.black_id, black_points)
+        white, black = entries[pairing.white_id], entries[pairing.black_id]
+        white.sonneborn_berger += white_points * black.score
+        black.sonneborn_berger += black_points * white.score
+        TournamentPlayer.objects.bulk_update(entries.values(), TIEBREAK_FIELDS)
+
+        if not Pairing.objects.filter(round_id=pairing.round_id, result='').exists():
+            transaction.on_commit(partial(finish_round, pairing.round_id), robust=True)
+    return pairing
+
+
+# ============================================
+# ROUNDS
+# ============================================
+
+def _pairing_players(tournament, entries):
+    """PairingPlayer objects for the active entries, with their colour and opponent history"""
+    from .models import Pairing
+
+    colours = defaultdict(str)
+    opponents = defaultdict(set)
+    byes = set()
+    rows = (
+        Pairing.objects.filter(round__tournament=tournament)
+        .order_by('round__number', 'board')
+        .values_list('white_id', 'black_id')
+    )
+    for white_id, black_id in rows:
+        if black_id is None:
+            byes.add(white_id)
+            continue
+        colours[white_id] += 'w'
+        colours[black_id] += 'b'
+        opponents[white_id].add(black_id)
+        opponents[black_id].add(white_id)
+    return [
+        PairingPlayer(entry.pk, entry.seed, entry.score, colours[entry.pk], opponents[entry.pk], entry.pk in byes)
+        for entry in entries.values() if not entry.withdrawn
+    ]
+
+
+def _round_pairs(tournament, number, entries):
+    """[(white entry id, black entry id or None for a bye)] for the next round"""
+    if tournament.format == 'round_robin':
+        by_seed = sorted(entries.values(), key=lambda entry: entry.seed)
+        pairs = []
+        for white, black in berger_rounds(len(by_seed))[number - 1]:
+            white = by_seed[white] if white is not None else None
+            black = by_seed[black] if black is not None else None
+            # A withdrawn player's opponent gets the point as a bye
+            players = [entry for entry in (white, black) if entry is not None and not entry.withdrawn]
+            if len(players) == 2:
+                pairs.append((white.pk, black.pk))
+            elif players:
+                pairs.append((players[0].pk, None))
+        return pairs
+
+    boards, bye = swiss_pairings(_pairing_players(tournament, entries))
+    pairs = [(white.id, black.id) for white, black in boards]
+    if bye is not None:
+        pairs.append((bye.id, None))
+    return pairs
+
+
+def start_next_round(tournament):
+    """
+    Pair the next round and create all of its games. Call inside a
+    transaction with the tournament row locked.
+    """
+    from . import stats
+    from .clocks import get_time_control
+    from .models import Game, GameSession, Pairing, START_FEN, TournamentPlayer, TournamentRound
+    from .services import new_game_codes
+
+    number = tournament.current_round + 1
+    entries = TournamentPlayer.objects.select_for_update().select_related('user').in_bulk(
+        list(tournament.entries.values_list('pk', flat=True))
+    )
+    pairs = _round_pairs(tournament, number, entries)
+    games = [(white_id, black_id) for white_id, black_id in pairs if black_id is not None]
+
+    new_round = TournamentRound.objects.create(tournament=tournament, number=number)
+    now = timezone.now()
+    initial_ms = get_time_control(tournament.time_control).base_ms
+    created = Game.objects.bulk_create([
+        Game(
+            code=code, fen=START_FEN, status='active', time_control=tournament.time_control,
+            is_rated=tournament.is_rated, tournament=tournament,
+            white_player=entries[white_id].user, black_player=entries[black_id].user,
+            white_time_ms=initial_ms, black_time_ms=initial_ms,
+            started_at=now, last_move_time=now, timer_last_updated=now, state_version=1,
+        )
+        for code, (white_id, black_id) in zip(new_game_codes(len(games)), games)
+    ])
+    GameSession.objects.bulk_create([
+        GameSession(user_id=user_id, game=game, session_key=f'user:{user_id}', color=color)
+        for game in created
+        for user_id, color in ((game.white_player_id, 'white'), (game.black_player_id, 'black'))
+    ])
+
+    pairings = []
+    game_iter = iter(created)
+    for board, (white_id, black_id) in enumerate(pairs, 1):
+        if black_id is None:
+            pairings.append(Pairing(round=new_round, board=board, white_id=white_id, result='bye'))
+        else:
+            pairings.append(Pairing(round=new_round, board=board, white_id=white_id, black_id=black_id,
+                                    game=next(game_iter)))
+    Pairing.objects.bulk_create(pairings)
+
+    # Each new opponent's current score joins the Buchholz; byes score at once
+    opponents = _opponents(
+        Pairing.objects.filter(round__tournament=tournament).values_list('white_id', 'black_id', 'result')
+    )
+    for white_id, black_id in games:
+        entries[white_id].buchholz += entries[black_id].score
+        entries[black_id].buchholz += entries[white_id].score
+    for white_id, black_id in pairs:
+        if black_id is None:
+            _add_score(entries, opponents, white_id, BYE_POINTS)
+    TournamentPlayer.objects.bulk_update(entries.values(), TIEBREAK_FIELDS)
+
+    tournament.current_round = number
+    tournament.save(update_fields=['current_round'])
+
+    # bulk_create skips Game.save(): cache the games, start their clocks
+    # and update the site counters here
+    for game in created:
+        game._sync_on_commit()
+    stats.adjust_counter('total_games', len(created))
+    stats.adjust_counter('active_games', len(created))
+    stats.invalidate('live_games')
+    stats.invalidate_user_games(*(user_id for game in created for user_id in (game.white_player_id, game.black_player_id)))
+
+    if not games:
+        # Only byes (e.g. everyone else withdrew)
+        transaction.on_commit(partial(finish_round, new_round.pk), robust=True)
+    return new_round
+
+
+def start_tournament(tournament):
+    """Close registration, seed the players by rating and pair round one"""
+    from .models import Tournament, TournamentPlayer
+
+    with transaction.atomic():
+        tournament = Tournament.objects.select_for_update().get(pk=tournament.pk)
+        if tournament.status != 'registration':
+            raise TournamentError('The tournament has already started')
+        entries = list(
+            tournament.entries.filter(withdrawn=False).select_related('user')
+            .order_by('-user__rating_points', 'joined_at')
+        )
+        if len(entries) < 2:
+            raise TournamentError('At least two players are needed')
+        tournament.entries.filter(withdrawn=True).delete()
+        for seed, entry in enumerate(entries, 1):
+            entry.seed = seed
+        TournamentPlayer.objects.bulk_update(entries, ['seed'])
+
+        if tournament.format == 'round_robin':
+            tournament.rounds = len(entries) - 1 + len(entries) % 2
+        tournament.status = 'running'
+        tournament.started_at = timezone.now()
+        tournament.save(update_fields=['rounds', 'status', 'started_at'])
+        start_next_round(tournament)
+    return tournament
+
+
+def finish_round(round_id):
+    """Close a round whose games are all over; pair the next or end the tournament"""
+    from .models import Tournament, TournamentRound
+
+    with transaction.atomic():
+        finished = TournamentRound.objects.get(pk=round_id)
+        tournament = Tournament.objects.select_for_update().get(pk=finished.tournament_id)
+        if finished.completed_at is not None or finished.pairings.filter(result='').exists():
+            return
+        finished.completed_at = timezone.now()
+        finished.save(update_fields=['completed_at'])
+
+        if tournament.current_round != finished.number:
+            return
+        if tournament.current_round >= tournament.rounds:
+            tournament.status = 'completed'
+            tournament.completed_at = timezone.now()
+            tournament.save(update_fields=['status', 'completed_at'])
+            logger.info("Tournament %s finished", tournament.name)
+        else:
+            start_next_round(tournament)
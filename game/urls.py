@@ -7,6 +7,7 @@ urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     path('play/', views.play, name='play'),
     path('tournament/', views.tournament, name='tournament'),
+    path('tournament/<int:tournament_id>/', views.tournament_detail, name='tournament_detail'),
     path('leaderboard/', views.leaderboard, name='leaderboard'),
     path('watch/<str:code>/', views.watch_game, name='watch_game'),
     path('recent/', views.recent_view, name="recent game"),
@@ -25,4 +26,18 @@ urlpatterns = [
     path('api/game/<str:code>/resign/', views.api_resign, name='api_resign'),
     path('api/game/<str:code>/draw/', views.api_offer_draw, name='api_offer_draw'),
     path('api/game/<str:code>/session/', views.api_check_session, name='api_check_session'),
+    path('api/game/<str:code>/pgn/', views.api_game_pgn, name='api_game_pgn'),
+    path('api/pgn/export/', views.api_export_pgn, name='api_export_pgn'),
+    path('api/explorer/', views.api_explorer, name='api_explorer'),
+    path('api/game/<str:code>/analysis/', views.api_game_analysis, name='api_game_analysis'),
+    path('api/game/<str:code>/position/<int:ply>/', views.api_game_position, name='api_game_position'),
+    path('api/game/<str:code>/replay/', views.api_game_replay, name='api_game_replay'),
+    path('api/leaderboard/', views.api_leaderboard, name='api_leaderboard'),
+    path('api/leaderboard/around/<str:username>/', views.api_leaderboard_around, name='api_leaderboard_around'),
+    path('api/user/<str:username>/rating-history/', views.api_rating_history, name='api_rating_history'),
+    path('api/matchmaking/seek/', views.api_matchmaking_seek, name='api_matchmaking_seek'),
+    path('api/matchmaking/cancel/', views.api_matchmaking_cancel, name='api_matchmaking_cancel'),
+    path('api/matchmaking/status/', views.api_matchmaking_status, name='api_matchmaking_status'),
+    path('api/tournament/<int:tournament_id>/join/', views.api_tournament_join, name='api_tournament_join'),
+    path('api/tournament/<int:tournament_id>/withdraw/', views.api_tournament_withdraw, name='api_tournament_withdraw'),
 ]
\ No newline at end of file
@@ -3,16 +3,40 @@ from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.db.models import Q
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.utils.crypto import get_random_string
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.db.models import Q, Count
 from django.conf import settings
+from asgiref.sync import sync_to_async
+from datetime import datetime
+import asyncio
 import json
+import random
 
-from .models import User, Game, GameSession, Move, START_FEN
+from .analysis import analysed_moves, summary
+from .clocks import TIME_CONTROLS
+from .explorer import explore
+from .matchmaking import matchmaking, seek_channel
+from .models import User, Game, GameAnalysis, GameSession, Move, Pairing, START_FEN, Tournament, TournamentPlayer
+from .pgn import export_pgn, game_pgn, games_for_export
+from .ranking import DEFAULT_PAGE_SIZE, ranking
+from .rating import rating_series
+from .realtime import get_channel_layer, publish_game_event
+from .replay import decompressed, get_replay, is_finished, position_at
+from .search import DEFAULT_LEVEL, LEVELS
+from .services import (
+    MoveRejected, accept_draw, cancel_draw_offer, claim_draw, commit_move, create_computer_game,
+    flag_if_out_of_time, join_game, new_game_code, offer_draw, resign,
+)
+from .state_cache import game_cache
+from .stats import get_counters, get_live_games, get_user_games
+from .tournaments import standings
+
+# Longest a long-poll state request is held open (seconds)
+LONG_POLL_TIMEOUT = getattr(settings, 'MTU_CHESS_CONFIG', {}).get('LONG_POLL_TIMEOUT_SECONDS', 25)
 
 
 # ============================================
@@ -21,9 +45,7 @@ from .models import User, Game, GameSession, Move, START_FEN
 
 def home(request):
     """Landing page for MTU Chess Club"""
-    total_games = Game.objects.count()
-    active_games = Game.objects.filter(status='active').count()
-    total_users = User.objects.count()
+    counters = get_counters()
     
     # Top players by rating
     top_players = User.objects.filter(rating__isnull=False).order_by('-rating')[:5]
@@ -32,9 +54,9 @@ def home(request):
     recent_games = Game.objects.filter(status='completed').order_by('-completed_at')[:5]
     
     context = {
-        'total_games': total_games,
-        'active_games': active_games,
-        'total_users': total_users,
+        'total_games': counters['total_games'],
+        'active_games': counters['active_games'],
+        'total_users': counters['total_users'],
         'top_players': top_players,
         'recent_games': recent_games,
     }
@@ -131,14 +153,13 @@ def dashboard(request):
     user = request.user
     
     # Get user's recent games
-    user_games = Game.objects.filter(
-        Q(white_player=user) | Q(black_player=user)
-    ).order_by('-created_at')[:5]
+    user_games = get_user_games(user)
     
     # Get active games to watch
-    active_games = Game.objects.filter(status='active').exclude(
-        Q(white_player=user) | Q(black_player=user)
-    ).order_by('-started_at')[:5]
+    active_games = [
+        g for g in get_live_games()
+        if user.pk not in (g.white_player_id, g.black_player_id)
+    ][:5]
     
     context = {
         'user': user,
@@ -152,7 +173,7 @@ def dashboard(request):
 
 def guest_mode(request):
     """Guest mode - watch only"""
-    active_games = Game.objects.filter(status='active').order_by('-started_at')[:20]
+    active_games = get_live_games()
     
     context = {
         'active_games': active_games,
@@ -220,9 +241,21 @@ def watch_game(request, code):
                 game.status == 'waiting' and
                 (game.white_player is None or game.black_player is None))
     
+    # Finished games show their analysis (computed when the game ended)
+    analysis = GameAnalysis.objects.filter(game=game).first()
+    analysis_summary = None
+    if analysis is not None and analysis.status == 'done':
+        analysed = analysed_moves(analysis, [m.move_san for m in moves])
+        moves = [(m, analysed[i] if i < len(analysed) else None) for i, m in enumerate(moves)]
+        analysis_summary = summary(analysis)
+    else:
+        moves = [(m, None) for m in moves]
+    
     context = {
         'game': game,
         'moves': moves,
+        'analysis': analysis,
+        'analysis_summary': analysis_summary,
         'is_participant': is_participant,
         'can_join': can_join,
         'START_FEN': START_FEN,  # Add this line
@@ -230,6 +263,10 @@ def watch_game(request, code):
     return render(request, 'game/watch.html', context)
 
 
+def _tournaments_enabled():
+    return getattr(settings, 'MTU_CHESS_CONFIG', {}).get('ENABLE_TOURNAMENTS', True)
+
+
 def tournament(request):
     status = request.GET.get("status")
 
@@ -240,19 +277,86 @@ def tournament(request):
 
     games = queryset.order_by("-updated_at")[:50]   # slice LAST
 
+    tournaments = []
+    if _tournaments_enabled():
+        tournaments = Tournament.objects.annotate(player_count=Count('entries'))[:20]
+
     return render(request, "game/tournament.html", {
         "games": games,
+        "tournaments": tournaments,
         "active_status": status
     })
 
 
+def tournament_detail(request, tournament_id):
+    """Standings and the current round's pairings"""
+    if not _tournaments_enabled():
+        raise Http404
+    tournament = get_object_or_404(Tournament, pk=tournament_id)
+    
+    entries = standings(tournament)
+    my_entry = None
+    if request.user.is_authenticated:
+        my_entry = next((entry for entry in entries if entry.user_id == request.user.pk), None)
+    
+    round_number = _int_param(request, 'round', tournament.current_round, maximum=tournament.current_round)
+    pairings = (
+        Pairing.objects.filter(round__tournament=tournament, round__number=round_number)
+        .select_related('white__user', 'black__user', 'game')
+    )
+    
+    context = {
+        'tournament': tournament,
+        'standings': entries,
+        'my_entry': my_entry,
+        'pairings': pairings,
+        'round_number': round_number,
+        'round_numbers': range(1, tournament.current_round + 1),
+    }
+    return render(request, 'game/tournament_detail.html', context)
+
+
+
+def _leaderboard_filters(request):
+    """Department/level filters from the query string"""
+    department = request.GET.get('department') or None
+    try:
+        level = int(request.GET['level'])
+    except (KeyError, ValueError):
+        level = None
+    return department, level
+
+
+def _int_param(request, name, default, maximum=None):
+    try:
+        value = max(1, int(request.GET.get(name, default)))
+    except ValueError:
+        value = default
+    return min(value, maximum) if maximum else value
+
 
 def leaderboard(request):
     """Leaderboard page"""
-    players = User.objects.filter(rating__isnull=False).order_by('-rating')[:50]
+    department, level = _leaderboard_filters(request)
+    page = _int_param(request, 'page', 1)
+    players = ranking.page(page, department=department, level=level)
+    total = ranking.count(department=department, level=level)
+    
+    my_rank = None
+    if request.user.is_authenticated:
+        my_rank = ranking.rank(request.user.pk, department=department, level=level)
     
     context = {
         'players': players,
+        'page': page,
+        'has_previous': page > 1,
+        'has_next': page * DEFAULT_PAGE_SIZE < total,
+        'total_players': total,
+        'my_rank': my_rank,
+        'department': department or '',
+        'level': level or '',
+        'departments': User.DEPARTMENT_CHOICES,
+        'levels': User._meta.get_field('level').choices,
     }
     return render(request, 'game/leaderboard.html', context)
 
@@ -268,15 +372,19 @@ def api_create_game(request):
     try:
         data = json.loads(request.body.decode('utf-8')) if request.body else {}
         
-        # Generate unique code
-        code = get_random_string(6).upper()
-        while Game.objects.filter(code=code).exists():
-            code = get_random_string(6).upper()
-        
         # Get time control
         time_control = data.get('time_control', 'blitz_5')
         is_rated = data.get('is_rated', True)
         
+        if time_control not in TIME_CONTROLS:
+            return JsonResponse({'error': 'Unknown time control'}, status=400)
+        
+        if data.get('opponent') == 'computer':
+            return _create_computer_game(request, data, time_control)
+        
+        # Generate unique code
+        code = new_game_code()
+        
         # Create game
         game = Game.objects.create(
             code=code,
@@ -287,9 +395,9 @@ def api_create_game(request):
         )
         
         # Set initial time
-        initial_time = game.get_time_control_seconds()
-        game.white_time_remaining = initial_time
-        game.black_time_remaining = initial_time
+        initial_ms = game.get_time_control().base_ms
+        game.white_time_ms = initial_ms
+        game.black_time_ms = initial_ms
         
         # Assign player
         if request.user.is_authenticated:
@@ -313,8 +421,10 @@ def api_create_game(request):
             'code': game.code,
             'fen': game.fen,
             'status': game.status,
-            'white_time': game.white_time_remaining,
-            'black_time': game.black_time_remaining,
+            'white_time': game.white_time_ms // 1000,
+            'black_time': game.black_time_ms // 1000,
+            'white_time_ms': game.white_time_ms,
+            'black_time_ms': game.black_time_ms,
         })
     
     except Exception as e:
@@ -324,97 +434,179 @@ def api_create_game(request):
         }, status=500)
 
 
-@require_http_methods(["GET"])
-def api_game_state(request, code):
-    """
-    CRITICAL FIX: Get current game state WITHOUT modifying database
-    This prevents timer from resetting on every poll
-    """
+def _create_computer_game(request, data, time_control):
+    """api_create_game with {"opponent": "computer", "level": 1-5, "color": "white"/"black"/"random"}"""
     try:
-        game = Game.objects.get(code=code.upper())
-    except Game.DoesNotExist:
-        return JsonResponse({'error': 'Game not found'}, status=404)
-    
-    # Get timer state WITHOUT saving to database
-    timer_state = game.get_timer_state()
-    
+        level = int(data.get('level', DEFAULT_LEVEL))
+    except (TypeError, ValueError):
+        level = None
+    if level not in LEVELS:
+        return JsonResponse({'error': f'Level must be between {min(LEVELS)} and {max(LEVELS)}'}, status=400)
+    color = data.get('color', 'white')
+    if color == 'random':
+        color = random.choice(('white', 'black'))
+    if color not in ('white', 'black'):
+        return JsonResponse({'error': 'Color must be white, black or random'}, status=400)
+
+    game = create_computer_game(
+        color, level, time_control,
+        user=request.user,
+        guest_name=data.get('player_name', 'Guest'),
+        session_key=request.session.session_key or '',
+    )
     return JsonResponse({
+        'success': True,
         'code': game.code,
         'fen': game.fen,
         'status': game.status,
+        'color': color,
+        'engine_level': level,
         'white_player': game.get_white_display_name(),
         'black_player': game.get_black_display_name(),
-        'white_time': timer_state['white_time'],
-        'black_time': timer_state['black_time'],
-        'winner': game.winner,
-        'result_reason': game.result_reason,
-        'move_history': game.move_history,
-        'move_count': game.move_count,
-        'captured_pieces': game.captured_pieces,
-        'updated_at': game.updated_at.isoformat(),
-        'timer_last_updated': timer_state.get('last_updated'),
+        'white_time': game.white_time_ms // 1000,
+        'black_time': game.black_time_ms // 1000,
+        'white_time_ms': game.white_time_ms,
+        'black_time_ms': game.black_time_ms,
     })
 
 
+async def _get_cached_game(code):
+    """The game's CachedGame; the database is only asked on a miss or once the entry is due a check"""
+    cached = game_cache.get(code)
+    if cached is not None and game_cache.is_current(cached):
+        return cached
+    return await sync_to_async(game_cache.current)(code)
+
+
+def _client_state_version(request):
+    """Version the client already has, from ?since= or If-None-Match"""
+    since = request.GET.get('since') or request.headers.get('If-None-Match', '')
+    since = since.replace('W/', '').strip('"')
+    try:
+        return int(since)
+    except ValueError:
+        return None
+
+
+def _not_modified(version):
+    response = HttpResponseNotModified()
+    response['ETag'] = '"%d"' % version
+    return response
+
+
+@require_http_methods(["GET"])
+async def api_game_state(request, code):
+    """
+    Get current game state WITHOUT modifying database.
+
+    The state is served from the in-memory game cache, so polling doesn't
+    touch the database once a game has been loaded. Clients pass the
+    version they already have (?since=<version> or If-None-Match) and get
+    304 Not Modified when nothing changed. With ?wait=<seconds> the request
+    is held open until the game changes or the timeout passes (long-poll
+    for browsers without WebSockets).
+    """
+    code = code.upper()
+    since = _client_state_version(request)
+    try:
+        wait = min(float(request.GET.get('wait', 0)), LONG_POLL_TIMEOUT)
+    except ValueError:
+        wait = 0
+    
+    # Subscribe before checking the version so a move can't slip in between
+    layer = get_channel_layer()
+    queue = layer.subscribe(code) if since is not None and wait > 0 else None
+    try:
+        cached = await _get_cached_game(code)
+        if cached is None:
+            return JsonResponse({'error': 'Game not found'}, status=404)
+        
+        if cached.version == since:
+            if queue is None:
+                return _not_modified(cached.version)
+            try:
+                await asyncio.wait_for(queue.get(), timeout=wait)
+            except asyncio.TimeoutError:
+                return _not_modified(cached.version)
+            cached = await _get_cached_game(code)
+    finally:
+        if queue is not None:
+            layer.unsubscribe(code, queue)
+    
+    state = cached.get_state()
+    response = JsonResponse(state)
+    response['ETag'] = '"%d"' % state['version']
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def api_game_move(request, code):
-    """Submit a move"""
-    try:
-        game = Game.objects.get(code=code.upper())
-    except Game.DoesNotExist:
-        return JsonResponse({'error': 'Game not found'}, status=404)
-    
+    """
+    Submit a move.
+
+    The move is given in UCI ('uci': 'e2e4', 'e7e8q') or SAN ('move_san')
+    and applied to the stored position by the server-side board, which
+    rejects illegal moves and decides whether the game is over.
+    """
     try:
         data = json.loads(request.body.decode('utf-8'))
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
     
-    fen = data.get('fen')
-    if not fen:
-        return JsonResponse({'error': 'fen is required'}, status=400)
+    uci = data.get('uci')
+    move_san = data.get('move_san')
+    if any(value is not None and not isinstance(value, str) for value in (uci, move_san)):
+        return JsonResponse({'error': 'Moves are given as strings'}, status=400)
     
-    # Update game state
-    game.fen = fen
-    game.move_count += 1
+    if not uci and not move_san:
+        # No move: the client is reporting a flag fall, which the server
+        # checks against its own clock
+        if data.get('game_over') and data.get('reason') == 'timeout':
+            game = flag_if_out_of_time(code.upper())
+        else:
+            game = Game.objects.filter(code=code.upper()).first()
+        if game is None:
+            return JsonResponse({'error': 'Game not found'}, status=404)
+        timer_state = game.get_timer_state()
+        return JsonResponse({
+            'success': True,
+            'status': game.status,
+            'white_time': timer_state['white_time'],
+            'black_time': timer_state['black_time'],
+            'white_time_ms': timer_state['white_time_ms'],
+            'black_time_ms': timer_state['black_time_ms'],
+        })
     
-    # Update move history
-    move_san = data.get('move_san')
-    if move_san:
-        try:
-            history = json.loads(game.move_history) if game.move_history else []
-            history.append(move_san)
-            game.move_history = json.dumps(history)
-        except:
-            pass
-    
-    # Handle captured piece
-    captured = data.get('captured')
-    if captured:
-        captured_color = captured.get('color')
-        captured_piece = captured.get('piece')
-        if captured_color and captured_piece:
-            game.add_captured_piece(captured_piece, captured_color)
-    
-    # CRITICAL FIX: Update timer only when move is made
-    game.update_timer_on_move()
-    
-    # Check for game end
-    game_over = data.get('game_over', False)
-    if game_over:
-        winner = data.get('winner')
-        reason = data.get('reason')
-        game.mark_completed(winner=winner, reason=reason)
-    
-    game.save()
+    try:
+        game, move_info = commit_move(code.upper(), uci=uci, san=move_san, user=request.user)
+    except Game.DoesNotExist:
+        return JsonResponse({'error': 'Game not found'}, status=404)
+    except MoveRejected as e:
+        response = {'error': str(e)}
+        if e.game is not None:
+            response['fen'] = e.game.fen
+        return JsonResponse(response, status=e.status)
     
     # Return updated timer state
     timer_state = game.get_timer_state()
     
     return JsonResponse({
         'success': True,
+        'san': move_info['san'],
+        'fen': game.fen,
+        'status': game.status,
+        'winner': game.winner,
+        'result_reason': game.result_reason,
         'white_time': timer_state['white_time'],
         'black_time': timer_state['black_time'],
+        'white_time_ms': timer_state['white_time_ms'],
+        'black_time_ms': timer_state['black_time_ms'],
+        'draw_claim': move_info['draw_claim'],
+        'draw_offer': game.get_draw_offer(),
     })
 
 
@@ -427,28 +619,19 @@ def api_join_game(request, code):
     except Game.DoesNotExist:
         return JsonResponse({'error': 'Game not found'}, status=404)
     
-    if game.status != 'waiting':
-        return JsonResponse({'error': 'Game already has two players'}, status=400)
-    
     try:
         data = json.loads(request.body.decode('utf-8')) if request.body else {}
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
         
-        # Assign player
-        if request.user.is_authenticated:
-            game.black_player = request.user
-        else:
-            game.black_guest_name = data.get('player_name', 'Guest')
-        
-        game.mark_started()
-        
-        # Create session
-        if request.user.is_authenticated:
-            GameSession.objects.create(
-                user=request.user,
-                game=game,
-                session_key=request.session.session_key or 'guest',
-                color='black'
+        try:
+            game = join_game(
+                game.code, user=request.user,
+                guest_name=data.get('player_name', 'Guest'),
+                session_key=request.session.session_key,
             )
+        except MoveRejected as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
         
         return JsonResponse({
             'success': True,
@@ -457,8 +640,10 @@ def api_join_game(request, code):
             'status': game.status,
             'white_player': game.get_white_display_name(),
             'black_player': game.get_black_display_name(),
-            'white_time': game.white_time_remaining,
-            'black_time': game.black_time_remaining,
+            'white_time': game.white_time_ms // 1000,
+            'black_time': game.black_time_ms // 1000,
+            'white_time_ms': game.white_time_ms,
+            'black_time_ms': game.black_time_ms,
         })
     
     except Exception as e:
@@ -468,43 +653,191 @@ def api_join_game(request, code):
         }, status=500)
 
 
+def _player_color(request, game, data):
+    """
+    Colour the requester plays in a game, for resignation and draw offers:
+    a registered player's own seat, otherwise, for a guest, the guest seat
+    named in the request (guests aren't identified beyond that, as for
+    moves). A signed-in user who isn't playing gets None.
+    """
+    color = game.get_player_color(request.user)
+    if color is None:
+        if request.user.is_authenticated:
+            return None
+        color = data.get('color')
+        if color == 'white' and game.white_player_id or color == 'black' and game.black_player_id:
+            return None
+    if color not in ('white', 'black') or color == game.engine_color:
+        return None
+    return color
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def api_resign(request, code):
-    """Resign from a game"""
+    """Resign from a game (players only)"""
     try:
         game = Game.objects.get(code=code.upper())
     except Game.DoesNotExist:
         return JsonResponse({'error': 'Game not found'}, status=404)
     
-    data = json.loads(request.body.decode('utf-8'))
-    color = data.get('color')
-    
-    if color == 'white':
-        game.mark_completed(winner='black', reason='resignation')
-    else:
-        game.mark_completed(winner='white', reason='resignation')
+    try:
+        data = json.loads(request.body.decode('utf-8')) if request.body else {}
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
     
+    color = _player_color(request, game, data)
+    if color is None:
+        return JsonResponse({'error': 'Only the players can resign'}, status=403)
+    try:
+        resign(game.code, color)
+    except MoveRejected as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
     return JsonResponse({'success': True})
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
 def api_offer_draw(request, code):
-    """Offer or accept a draw"""
+    """
+    Draw offers: {"action": "offer"} (the default), "accept", "decline",
+    "withdraw", or "claim" for a threefold repetition or fifty-move draw
+    """
     try:
         game = Game.objects.get(code=code.upper())
     except Game.DoesNotExist:
         return JsonResponse({'error': 'Game not found'}, status=404)
     
-    data = json.loads(request.body.decode('utf-8'))
-    action = data.get('action')
+    try:
+        data = json.loads(request.body.decode('utf-8')) if request.body else {}
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    action = data.get('action', 'offer')
     
-    if action == 'accept':
-        game.mark_completed(winner='draw', reason='agreement')
+    color = _player_color(request, game, data)
+    if color is None:
+        return JsonResponse({'error': 'Only the players can offer, accept or claim a draw'}, status=403)
+    
+    try:
+        if action == 'claim':
+            game = claim_draw(game.code, color)
+            return JsonResponse({'success': True, 'draw_claimed': True, 'reason': game.result_reason})
+        if action == 'offer':
+            game = offer_draw(game.code, color)
+        elif action == 'accept':
+            game = accept_draw(game.code, color)
+        elif action in ('decline', 'withdraw'):
+            game, event = cancel_draw_offer(game.code, color)
+            return JsonResponse({'success': True, event: True})
+        else:
+            return JsonResponse({'error': 'Unknown action'}, status=400)
+    except MoveRejected as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    
+    if game.status == 'completed':
         return JsonResponse({'success': True, 'draw_accepted': True})
+    return JsonResponse({'success': True, 'draw_offered': True, 'draw_offer': game.get_draw_offer()})
+
+
+def _public_player(player):
+    """Leaderboard row without the matric number"""
+    return {key: value for key, value in player.items() if key != 'matric_number'}
+
+
+@require_http_methods(["GET"])
+def api_leaderboard(request):
+    """
+    Leaderboard page or top N as JSON
+    Query: page, size (max 100) or top; optional department, level
+    """
+    department, level = _leaderboard_filters(request)
+    if 'top' in request.GET:
+        players = ranking.top(_int_param(request, 'top', 10, maximum=100),
+                              department=department, level=level)
+        page = 1
+    else:
+        page = _int_param(request, 'page', 1)
+        size = _int_param(request, 'size', DEFAULT_PAGE_SIZE, maximum=100)
+        players = ranking.page(page, size=size, department=department, level=level)
+    
+    return JsonResponse({
+        'page': page,
+        'total': ranking.count(department=department, level=level),
+        'players': [_public_player(p) for p in players],
+    })
+
+
+@require_http_methods(["GET"])
+def api_leaderboard_around(request, username):
+    """A player's rank with the players up to `radius` (default 10, max 50) places around them"""
+    user = User.objects.filter(username=username).only('pk').first()
+    if user is None:
+        return JsonResponse({'error': 'Player not found'}, status=404)
+    
+    department, level = _leaderboard_filters(request)
+    rank = ranking.rank(user.pk, department=department, level=level)
+    if rank is None:
+        return JsonResponse({'error': 'Player is not ranked'}, status=404)
     
-    return JsonResponse({'success': True, 'draw_offered': True})
+    radius = _int_param(request, 'radius', 10, maximum=50)
+    return JsonResponse({
+        'username': username,
+        'rank': rank,
+        'players': [_public_player(p) for p in ranking.around(
+            user.pk, radius=radius, department=department, level=level)],
+    })
+
+
+def _datetime_param(request, name, end=False):
+    """
+    Datetime (or date) query parameter; None if missing, ValueError if
+    invalid. A bare date means the start of that day, or with end its last
+    moment, so ?to=2025-06-30 includes the 30th (as export_pgn --to does).
+    """
+    value = request.GET.get(name)
+    if not value:
+        return None
+    # Date first: parse_datetime() also reads a bare date, as midnight
+    try:
+        day = parse_date(value)
+    except ValueError:
+        raise ValueError(name)
+    if day is not None:
+        parsed = datetime.combine(day, datetime.max.time() if end else datetime.min.time())
+    else:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(name)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+@require_http_methods(["GET"])
+def api_rating_history(request, username):
+    """
+    A player's rating after each rated game, downsampled for charts
+    Query: from, to (ISO date/datetime), points (default 200, max 1000)
+    """
+    user = User.objects.filter(username=username).only('pk').first()
+    if user is None:
+        return JsonResponse({'error': 'Player not found'}, status=404)
+    
+    try:
+        start = _datetime_param(request, 'from')
+        end = _datetime_param(request, 'to', end=True)
+    except ValueError as e:
+        return JsonResponse({'error': f"Invalid date for '{e}'"}, status=400)
+    
+    series = rating_series(user, start, end, max_points=_int_param(request, 'points', 200, maximum=1000))
+    return JsonResponse({
+        'username': username,
+        'points': [[recorded_at.isoformat(), rating] for recorded_at, rating in series],
+    })
 
 
 @require_http_methods(["GET"])
@@ -525,4 +858,302 @@ def api_check_session(request, code):
             'color': session.color,
         })
     except GameSession.DoesNotExist:
-        return JsonResponse({'has_session': False})
\ No newline at end of file
+        return JsonResponse({'has_session': False})
+
+# ============================================
+# MATCHMAKING
+# ============================================
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def api_matchmaking_seek(request):
+    """Join the matchmaking queue for a time control"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Login required'}, status=401)
+    
+    try:
+        data = json.loads(request.body.decode('utf-8')) if request.body else {}
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    time_control = data.get('time_control', 'blitz_5')
+    if not isinstance(time_control, str) or time_control not in TIME_CONTROLS:
+        return JsonResponse({'error': 'Unknown time control'}, status=400)
+    
+    matchmaking.seek(request.user, time_control, request.session.session_key or '')
+    return JsonResponse(matchmaking.status(request.user.pk))
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def api_matchmaking_cancel(request):
+    """Leave the matchmaking queue"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Login required'}, status=401)
+    
+    return JsonResponse({'success': True, 'cancelled': matchmaking.cancel(request.user.pk)})
+
+
+@require_http_methods(["GET"])
+async def api_matchmaking_status(request):
+    """
+    Matchmaking status: 'waiting', 'matched' (with the game code and colour)
+    or 'idle'. With ?wait=<seconds> a waiting request is held open until a
+    match is found or the timeout passes.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Login required'}, status=401)
+    
+    try:
+        wait = min(float(request.GET.get('wait', 0)), LONG_POLL_TIMEOUT)
+    except ValueError:
+        wait = 0
+    
+    # Subscribe before checking so a match can't slip in between
+    layer = get_channel_layer()
+    channel = seek_channel(user.pk)
+    queue = layer.subscribe(channel) if wait > 0 else None
+    try:
+        status = matchmaking.status(user.pk)
+        if status['status'] == 'waiting' and queue is not None:
+            try:
+                await asyncio.wait_for(queue.get(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            status = matchmaking.status(user.pk)
+    finally:
+        if queue is not None:
+            layer.unsubscribe(channel, queue)
+    
+    return JsonResponse(status)
+
+
+# ============================================
+# TOURNAMENTS
+# ============================================
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def api_tournament_join(request, tournament_id):
+    """Register for a tournament that hasn't started"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Login required'}, status=401)
+    if not _tournaments_enabled():
+        return JsonResponse({'error': 'Tournaments are disabled'}, status=404)
+    
+    try:
+        tournament = Tournament.objects.get(pk=tournament_id)
+    except Tournament.DoesNotExist:
+        return JsonResponse({'error': 'Tournament not found'}, status=404)
+    
+    if tournament.status != 'registration':
+        return JsonResponse({'error': 'Registration is closed'}, status=400)
+    
+    entry, created = TournamentPlayer.objects.get_or_create(tournament=tournament, user=request.user)
+    if entry.withdrawn:
+        entry.withdrawn = False
+        entry.save(update_fields=['withdrawn'])
+    return JsonResponse({'success': True, 'joined': True, 'players': tournament.entries.count()})
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def api_tournament_withdraw(request, tournament_id):
+    """Leave a tournament; once it has started the player is just not paired again"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Login required'}, status=401)
+    
+    try:
+        entry = TournamentPlayer.objects.select_related('tournament').get(
+            tournament_id=tournament_id, user=request.user
+        )
+    except TournamentPlayer.DoesNotExist:
+        return JsonResponse({'error': 'Not registered'}, status=404)
+    
+    if entry.tournament.status == 'registration':
+        entry.delete()
+    elif entry.tournament.status == 'running':
+        entry.withdrawn = True
+        entry.save(update_fields=['withdrawn'])
+    else:
+        return JsonResponse({'error': 'The tournament is over'}, status=400)
+    return JsonResponse({'success': True, 'withdrawn': True})
+
+
+# ============================================
+# PGN EXPORT
+# ============================================
+
+PGN_CONTENT_TYPE = 'application/x-chess-pgn'
+
+
+@require_http_methods(["GET"])
+def api_game_pgn(request, code):
+    """Download one game as PGN"""
+    try:
+        game = Game.objects.select_related(
+            'white_player', 'black_player', 'tournament', 'pairing__round'
+        ).get(code=code.upper())
+    except Game.DoesNotExist:
+        return JsonResponse({'error': 'Game not found'}, status=404)
+    
+    response = HttpResponse(game_pgn(game), content_type=PGN_CONTENT_TYPE)
+    response['Content-Disposition'] = f'attachment; filename="{game.code}.pgn"'
+    return response
+
+
+@require_http_methods(["GET"])
+def api_export_pgn(request):
+    """
+    Stream finished games as one PGN file: ?user=<username>,
+    ?tournament=<id> and/or ?from=&to= (start time, both days included).
+    A date range alone can cover the whole archive, so exporting without a
+    user or tournament is for staff only.
+    """
+    user = tournament = None
+    username = request.GET.get('user')
+    if username:
+        user = User.objects.filter(username=username).first()
+        if user is None:
+            return JsonResponse({'error': 'User not found'}, status=404)
+    tournament_id = request.GET.get('tournament')
+    if tournament_id:
+        tournament = Tournament.objects.filter(pk=tournament_id).first() if tournament_id.isdigit() else None
+        if tournament is None:
+            return JsonResponse({'error': 'Tournament not found'}, status=404)
+    try:
+        start = _datetime_param(request, 'from')
+        end = _datetime_param(request, 'to', end=True)
+    except ValueError as e:
+        return JsonResponse({'error': f"Invalid date for '{e}'"}, status=400)
+    
+    if not (user or tournament) and not request.user.is_staff:
+        return JsonResponse({'error': 'Choose a user or tournament'}, status=403)
+    
+    games = games_for_export(user=user, tournament=tournament, start=start, end=end)
+    name = username or (f'tournament-{tournament.pk}' if tournament else 'games')
+    response = StreamingHttpResponse(export_pgn(games), content_type=PGN_CONTENT_TYPE)
+    response['Content-Disposition'] = f'attachment; filename="{name}.pgn"'
+    return response
+
+
+# ============================================
+# OPENING EXPLORER
+# ============================================
+
+@require_http_methods(["GET"])
+def api_explorer(request):
+    """Moves played from a position (?fen=, default the start) with their results"""
+    fen = request.GET.get('fen') or START_FEN
+    try:
+        moves = explore(fen)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid FEN'}, status=400)
+    
+    return JsonResponse({
+        'fen': fen,
+        'games': sum(move['games'] for move in moves),
+        'moves': moves,
+    })
+
+
+# ============================================
+# GAME ANALYSIS
+# ============================================
+
+@require_http_methods(["GET"])
+def api_game_analysis(request, code):
+    """Engine analysis of a finished game: per-move scores and judgements"""
+    try:
+        game = Game.objects.get(code=code.upper())
+    except Game.DoesNotExist:
+        return JsonResponse({'error': 'Game not found'}, status=404)
+    analysis = GameAnalysis.objects.filter(game=game).first()
+    if analysis is None:
+        return JsonResponse({'error': 'Game has not been analysed'}, status=404)
+    
+    data = {'code': game.code, 'status': analysis.status}
+    if analysis.status == 'done':
+        data['summary'] = summary(analysis)
+        data['moves'] = analysed_moves(analysis, game.get_sans())
+    return JsonResponse(data)
+
+
+# ============================================
+# GAME REPLAY
+# ============================================
+
+# Finished games don't change: let browsers and proxies keep replays
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def _finished_game(code):
+    """(game, None) for a finished game, else (None, error response)"""
+    try:
+        game = Game.objects.get(code=code.upper())
+    except Game.DoesNotExist:
+        return None, JsonResponse({'error': 'Game not found'}, status=404)
+    if not is_finished(game):
+        return None, JsonResponse({'error': 'Game is still in progress'}, status=409)
+    return game, None
+
+
+def _cached_response(request, response_factory, etag):
+    """304 if the client has this ETag, else the response with immutable caching headers"""
+    if etag in request.headers.get('If-None-Match', '').replace('W/', '').split(', '):
+        response = HttpResponseNotModified()
+    else:
+        response = response_factory()
+    response['ETag'] = etag
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+@require_http_methods(["GET"])
+def api_game_position(request, code, ply):
+    """Position after `ply` plies of a finished game and the move that led to it"""
+    game, error = _finished_game(code)
+    if error:
+        return error
+    replay = get_replay(game)
+    try:
+        fen, move = position_at(replay, ply)
+    except IndexError:
+        return JsonResponse({'error': f"Game has {game.move_count} plies"}, status=404)
+    
+    return _cached_response(request, lambda: JsonResponse({
+        'code': game.code,
+        'ply': ply,
+        'fen': fen,
+        'san': move[0] if move else None,
+        'uci': move[1] if move else None,
+        'move_count': game.move_count,
+    }), '"replay-%d-%d"' % (replay.pk, ply))
+
+
+@require_http_methods(["GET"])
+def api_game_replay(request, code):
+    """
+    A finished game for scrubbing through on the client: keyframe FENs
+    every keyframe_interval plies, every move (UCI and SAN) and the clocks.
+    Sent gzip-compressed as stored when the client accepts it.
+    """
+    game, error = _finished_game(code)
+    if error:
+        return error
+    replay = get_replay(game, with_data=True)
+    gzipped = 'gzip' in request.headers.get('Accept-Encoding', '')
+    
+    def replay_response():
+        if gzipped:
+            response = HttpResponse(bytes(replay.data), content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(decompressed(replay), content_type='application/json')
+        response['Vary'] = 'Accept-Encoding'
+        return response
+    # Each encoding is a different representation, with its own ETag
+    etag = '"replay-%d%s"' % (replay.pk, '-gzip' if gzipped else '')
+    return _cached_response(request, replay_response, etag)
@@ -2,6 +2,9 @@
 ASGI config for lan_chess project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django; WebSocket connections (/ws/game/<code>/) go to
+the live game updates endpoint in game/consumers.py. Importing it also
+starts the background game clock scheduler.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +16,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lan_chess.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up so the game models are ready
+from game.consumers import game_websocket  # noqa: E402
+from game.scheduler import start_scheduler  # noqa: E402
+
+start_scheduler()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        await game_websocket(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
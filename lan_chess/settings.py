@@ -173,6 +173,21 @@ MTU_CHESS_CONFIG = {
     'MAX_ACTIVE_GAMES_PER_USER': 3,
     'GAME_TIMEOUT_MINUTES': 30,
     'MINIMUM_GAMES_FOR_RATING': 5,
+    'RATING_SYSTEM': 'glicko2',  # or 'elo' (see game/rating.py)
+    'LONG_POLL_TIMEOUT_SECONDS': 25,
+    'GAME_CACHE_SIZE': 1000,  # finished games kept in the state cache
+    'GAME_CACHE_TTL_SECONDS': 2,  # live games in the state cache are re-checked against the database after this
+    'ENABLE_CLOCK_SCHEDULER': True,  # flag timeouts server-side without a move
+    'SWEEP_INTERVAL_MINUTES': 5,  # abandon stale games / prune sessions (0 = off)
+    'STATS_CACHE_SECONDS': 300,  # home page counters / dashboard lists
+    'RANKING_REBUILD_SECONDS': 300,  # leaderboard index reload from the database
+    'EXPLORER_MAX_PLY': 40,  # plies of each finished game in the opening explorer
+    'ENGINE_WORKERS': 2,  # processes searching computer opponent moves
+    'ANALYSIS_WORKERS': 1,  # post-game analysis jobs run at once (0 = only analyse_games)
+    'ANALYSIS_DEPTH': 6,  # search limits per analysed position
+    'ANALYSIS_NODES': 20000,
+    'REPLAY_KEYFRAME_PLIES': 16,  # replay store: a FEN every N plies, moves in between
+    'DRAW_OFFER_SECONDS': 60,  # a draw offer lapses if not answered within this time
     
     # Feature flags
     'ENABLE_TOURNAMENTS': True,
@@ -1,7 +1,8 @@
 """
 WSGI config for lan_chess project.
 
-It exposes the WSGI callable as a module-level variable named ``application``.
+It exposes the WSGI callable as a module-level variable named ``application``
+and starts the background game clock scheduler.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
@@ -14,3 +15,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lan_chess.settings')
 
 application = get_wsgi_application()
+
+from game.scheduler import start_scheduler  # noqa: E402
+
+start_scheduler()